@@ -1,29 +1,58 @@
 from __future__ import annotations
 
-import asyncio
 from datetime import datetime
 import json
-from typing import Any, Dict, List, Optional
+import math
+from typing import Any, Dict, Iterator, List, Optional
 import re
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from sqlalchemy.orm import joinedload
 from werkzeug.exceptions import InternalServerError
 
 from core.database import db
 from core.models import Conversation, DocumentChunk, Message, User
-from core.security import token_required
+from core.security import admin_required, token_required
 from models.request import ChatRequest, ChatWithPredictionRequest, PredictionRequest
 from models.response import ChatWithPredictionResponse, PredictionResponse, ChatResponse
 from services import model_service
+from services.admission import PRIORITY_BATCH, LLMOverloadedError
 from services.llm_service import llm_service
 from services.model_service import model_service
-from core.supportfunc import cosine_similarity, extract_params, get_example_response, search_embedding, store_document_chunk
+from services.voyage_service import detect_format, iter_voyage_rows
+from core.supportfunc import (
+    call_llm_stream,
+    chunk_index,
+    cosine_similarity,
+    delete_document_chunk,
+    example_index,
+    explanation_cache,
+    extract_params,
+    get_example_response,
+    get_semantic_example_response,
+    ingest_document,
+    lexical_index,
+    search_embedding,
+    store_document_chunk,
+    store_document_chunks,
+)
 
 
 chat_bp = Blueprint("chat", __name__)
 
+
+@chat_bp.errorhandler(LLMOverloadedError)
+def llm_overloaded(e: LLMOverloadedError):
+    # LM Studio đang quá tải: báo client thử lại sau thay vì chờ timeout
+    response = jsonify({"error": "llm_overloaded", "message": str(e), "retry_after": e.retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
 DEFAULT_BOT_REPLY = "Hien tai chua ket noi LM Studio"
+MAX_BATCH_ROWS = 10000
+MAX_SWEEP_STEPS = 5000
+MAX_BULK_CHUNKS = 10000
 
 
 def _extract_structured_inputs(context_messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
@@ -249,9 +278,232 @@ def predict_endpoint():
 
         return jsonify(response), 200
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         raise InternalServerError(description=f"Prediction error: {str(e)}")
     
+@chat_bp.route("/predict/batch", methods=["POST"])
+def predict_batch_endpoint():
+    payload = request.get_json(silent=True) or {}
+    items = payload.get("items")
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items_required"}), 400
+
+    if len(items) > MAX_BATCH_ROWS:
+        return jsonify({"error": f"Toi da {MAX_BATCH_ROWS} dong moi request"}), 413
+
+    try:
+        results = model_service.predict_many(items)
+    except Exception as e:
+        raise InternalServerError(description=f"Prediction error: {str(e)}")
+
+    failed = sum(1 for item in results if "error" in item)
+    return jsonify({"items": results, "total": len(results), "failed": failed}), 200
+
+
+@chat_bp.route("/predict/speed-sweep", methods=["POST"])
+def speed_sweep_endpoint():
+    payload = request.get_json(silent=True) or {}
+
+    try:
+        speed_min = float(payload.get("speed_min", 0.5))
+        speed_max = float(payload.get("speed_max", 12.0))
+        steps = int(payload.get("steps", 100))
+        distance_km = payload.get("distance_km")
+        distance_km = float(distance_km) if distance_km is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "speed_min, speed_max, steps, distance_km phai la so"}), 400
+
+    if steps > MAX_SWEEP_STEPS:
+        return jsonify({"error": f"Toi da {MAX_SWEEP_STEPS} buoc"}), 400
+
+    try:
+        result = model_service.speed_sweep(payload, speed_min, speed_max, steps, distance_km)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        raise InternalServerError(description=f"Prediction error: {str(e)}")
+
+    return jsonify(result), 200
+
+
+@chat_bp.route("/predict/voyage", methods=["POST"])
+def voyage_endpoint():
+    """
+    Nhận log hành trình CSV/NDJSON (multipart field "file" hoặc raw body),
+    đọc theo stream và trả về tổng nhiên liệu cùng tổng theo từng segment.
+    """
+    args = request.args
+    # Chỉ multipart mới đi qua form parser; mọi content type khác (kể cả
+    # form-urlencoded) đọc thẳng request.stream để parser không nuốt mất body
+    multipart = request.mimetype == "multipart/form-data"
+    ship_type = args.get("ship_type") or (request.form.get("ship_type") if multipart else None)
+    if not ship_type:
+        return jsonify({"error": "ship_type is required"}), 400
+
+    try:
+        chunk_size = int(args.get("chunk_size", 1024))
+        segment_seconds = float(args.get("segment_seconds", 3600))
+        max_gap = args.get("max_gap_seconds")
+        max_gap_seconds = float(max_gap) if max_gap is not None else None
+    except ValueError:
+        return jsonify({"error": "chunk_size, segment_seconds, max_gap_seconds phai la so"}), 400
+
+    if not math.isfinite(segment_seconds) or segment_seconds <= 0:
+        return jsonify({"error": "segment_seconds phai lon hon 0"}), 400
+
+    if multipart:
+        upload = request.files.get("file")
+        if upload is None:
+            return jsonify({"error": "file is required for multipart uploads"}), 400
+        stream = upload.stream
+        fmt = args.get("format") or detect_format(upload.mimetype, upload.filename)
+    else:
+        stream = request.stream
+        fmt = args.get("format") or detect_format(request.mimetype, None)
+
+    try:
+        result = model_service.score_voyage(
+            iter_voyage_rows(stream, fmt),
+            ship_type,
+            chunk_size=min(chunk_size, MAX_BATCH_ROWS),
+            segment_seconds=segment_seconds,
+            max_gap_seconds=max_gap_seconds,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        raise InternalServerError(description=f"Prediction error: {str(e)}")
+
+    return jsonify(result), 200
+
+
+@chat_bp.route("/models", methods=["GET"])
+def list_models():
+    return jsonify({
+        "available": list(model_service.SHIP_MODEL_MAP),
+        "loaded": model_service.loaded_ships(),
+        "versions": model_service.model_versions(),
+    })
+
+
+@chat_bp.route("/models/<ship_type>/activate", methods=["POST"])
+@token_required
+@admin_required
+def activate_model_version(ship_type: str, current_user: User):
+    payload = request.get_json(silent=True) or {}
+    version = (payload.get("version") or "").strip()
+    if not version:
+        return jsonify({"error": "version is required"}), 400
+
+    try:
+        result = model_service.activate_version(ship_type, version)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        raise InternalServerError(description=f"Could not activate model: {str(e)}")
+
+    return jsonify(result), 200
+
+
+@chat_bp.route("/models/warm", methods=["POST"])
+@token_required
+@admin_required
+def warm_models(current_user: User):
+    payload = request.get_json(silent=True) or {}
+    ship_types = payload.get("ship_types")
+    status = model_service.warm(ship_types)
+    failed = {st: err for st, err in status.items() if err}
+    return jsonify({
+        "loaded": model_service.loaded_ships(),
+        "failed": failed,
+    }), 200 if not failed else 207
+
+
+@chat_bp.route("/models/unload", methods=["POST"])
+@token_required
+@admin_required
+def unload_models(current_user: User):
+    payload = request.get_json(silent=True) or {}
+    try:
+        removed = model_service.unload(payload.get("ship_type"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"unloaded": removed, "loaded": model_service.loaded_ships()})
+
+
+@chat_bp.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify({
+        "prediction_cache": model_service.cache_stats(),
+        "chunk_index": chunk_index.stats(),
+        "lexical_index": lexical_index.stats(),
+        "example_index": example_index.stats(),
+        "embedding_cache": model_service.embedding_cache_stats(),
+        "explanation_cache": explanation_cache.stats(),
+        "llm_admission": llm_service.admission.stats(),
+        "coalescing": {
+            "llm": llm_service.flights.stats(),
+            "embedding": model_service.embedding_flights.stats(),
+        },
+    })
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_chat_reply(
+    conversation_id: int,
+    response_payload: Dict[str, Any],
+    metadata_payload: Optional[Dict[str, Any]],
+    assistant_reply: Optional[str],
+    deltas: Optional[Iterator[str]],
+) -> Response:
+    """
+    SSE cho /chat/chat: event "prediction" (nếu có dự đoán) đi đầu tiên, sau đó
+    các "delta" của câu trả lời, cuối cùng "done" với payload như bản JSON.
+    Message của assistant được lưu sau khi stream xong.
+    """
+    def generate():
+        if response_payload.get("prediction_made"):
+            yield _sse("prediction", {
+                "prediction_made": True,
+                "prediction_result": response_payload["prediction_result"],
+            })
+        parts: List[str] = []
+        try:
+            for delta in (deltas if deltas is not None else [assistant_reply or ""]):
+                parts.append(delta)
+                yield _sse("delta", {"content": delta})
+        except Exception as e:
+            print(f"ERROR: LLM stream failed: {e}")
+            error: Dict[str, Any] = {"error": str(e)}
+            if isinstance(e, LLMOverloadedError):
+                error["retry_after"] = e.retry_after
+            yield _sse("error", error)
+            if not parts:
+                return
+        reply = "".join(parts)
+        assistant_msg = Message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=reply,
+            metadata_json=metadata_payload,
+        )
+        db.session.add(assistant_msg)
+        db.session.commit()
+        yield _sse("done", {**response_payload, "response": reply, "message_id": assistant_msg.id})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @chat_bp.route("/chat", methods=["POST"])
 def chat_with_auto_prediction():
     try:
@@ -263,11 +515,15 @@ def chat_with_auto_prediction():
         context = data.get("context", [])
         conversation_id = data.get("conversation_id")
         conversation_id = int(conversation_id)
+        # stream=true: trả về SSE, câu trả lời của LLM được relay từng đoạn
+        stream = data.get("stream") is True or request.args.get("stream", "").lower() in ("1", "true", "yes")
         structured_params = None
         user_message_content = messages[-1].get("content", "")
         print("User message content:")
         print(user_message_content)
-        extracted = extract_params(user_message_content, conversation_id, db.session, structured_params)
+        extracted = extract_params(
+            user_message_content, conversation_id, db.session, structured_params, explain=not stream
+        )
         # store new message of user to DB
         user_msg = Message(
         conversation_id=conversation_id,
@@ -279,20 +535,31 @@ def chat_with_auto_prediction():
         
         response_payload: Dict[str, Any]
         metadata_payload: Optional[Dict[str, Any]] = None
+        deltas: Optional[Iterator[str]] = None
         if extracted is False:
             user_message = user_message_content.lower()
             response = get_example_response(db.session, user_message)
+            query_vec = None
+            if response is None:
+                # Một embedding cho cả so khớp câu mẫu theo ngữ nghĩa và retrieval chunk
+                query_vec = model_service.get_embedding(user_message)
+                response = get_semantic_example_response(db.session, query_vec)
             if response is not None:
                 assistant_reply = response
                 response_payload = {"response": response}
             else:
-                embedding_result  = search_embedding(user_message)
+                embedding_result  = search_embedding(user_message, query_vec)
                 print("Embedding search result:")
                 print(embedding_result)
                 print("Calling LLM for chat...")
-                llm_response = asyncio.run(llm_service.chat(embedding_result, "vi", model_name=model))
-                assistant_reply = llm_response
-                response_payload = {"response": llm_response}
+                if stream:
+                    deltas = llm_service.stream_sync(embedding_result, "vi", model_name=model)
+                    assistant_reply = None
+                    response_payload = {}
+                else:
+                    llm_response = llm_service.chat_sync(embedding_result, "vi", model_name=model)
+                    assistant_reply = llm_response
+                    response_payload = {"response": llm_response}
         else:
             print("Extracted parameters:")
             print(extracted)
@@ -300,6 +567,8 @@ def chat_with_auto_prediction():
             prediction_value = extracted.get("prediction") or extracted.get("result")
             params = extracted.get("params")
             params = params if isinstance(params, dict) else {}
+            if stream and prediction_value is not None:
+                deltas = call_llm_stream(prediction_value, params)
             form_data = structured_params or _params_to_form_data(params)
             prediction_result = None
             if prediction_value is not None:
@@ -318,6 +587,10 @@ def chat_with_auto_prediction():
                     "prediction_result": prediction_result,
                     "form_data": form_data or params,
                 }
+        if stream:
+            return _stream_chat_reply(
+                conversation_id, response_payload, metadata_payload, assistant_reply, deltas
+            )
         assistant_msg = Message(
             conversation_id=conversation_id,
             role="assistant",
@@ -327,6 +600,8 @@ def chat_with_auto_prediction():
         db.session.add(assistant_msg)
         db.session.commit()
         return jsonify(response_payload)
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         print(f"ERROR: {str(e)}")
         import traceback
@@ -371,7 +646,8 @@ def llm_analysis():
         )
 
         llm_messages = [{"role": "user", "content": prompt}]
-        llm_response = asyncio.run(llm_service.chat(llm_messages, language))
+        # Phân tích hàng loạt nhường chỗ cho chat khi LM Studio bận
+        llm_response = llm_service.chat_sync(llm_messages, language, priority=PRIORITY_BATCH)
 
         def _clean_and_parse(text: str):
             # Loại bỏ ```json ... ``` hoặc ``` ...
@@ -399,6 +675,8 @@ def llm_analysis():
         parsed = _clean_and_parse(llm_response)
 
         return jsonify({"analysis": parsed, "raw_text": llm_response}), 200
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         # Trả lỗi an toàn để frontend fallback local analysis
         return jsonify({"analysis": None, "raw_text": "", "error": str(e)}), 500
@@ -430,4 +708,128 @@ def chunk():
         return jsonify({"error": str(e)}), 500
 
 
+@chat_bp.route("/chunks/bulk", methods=["POST"])
+@token_required
+@admin_required
+def bulk_chunks(current_user: User):
+    """
+    Ingest nhiều chunk: {"chunks": [{"content", "metadata"}], "batch_size": 64}.
+    ?stream=1 trả về NDJSON, mỗi dòng là tiến độ của một batch; mặc định trả
+    về tổng kết sau khi xong.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("chunks")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "chunks must be a non-empty list"}), 400
+    if len(items) > MAX_BULK_CHUNKS:
+        return jsonify({"error": f"Toi da {MAX_BULK_CHUNKS} chunk moi request"}), 400
+
+    batch_size = data.get("batch_size")
+    if batch_size is not None and (not isinstance(batch_size, int) or batch_size <= 0):
+        return jsonify({"error": "batch_size phai la so nguyen duong"}), 400
+
+    progress = store_document_chunks(items, batch_size)
+
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        def generate():
+            for update in progress:
+                yield json.dumps(update, ensure_ascii=False) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    chunk_ids: List[int] = []
+    failed: List[Dict[str, Any]] = []
+    batches = 0
+    for update in progress:
+        batches += 1
+        chunk_ids.extend(update["chunk_ids"])
+        failed.extend(update["failed"])
+
+    status = 200 if chunk_ids or not failed else 500
+    return jsonify({
+        "total": len(items),
+        "stored": len(chunk_ids),
+        "batches": batches,
+        "chunk_ids": chunk_ids,
+        "failed": failed,
+    }), status
+
+
+@chat_bp.route("/documents", methods=["POST"])
+@token_required
+@admin_required
+def ingest_document_endpoint(current_user: User):
+    """
+    Upload tài liệu text/markdown (multipart field "file" hoặc raw body) để
+    chunk + embedding + lưu theo kiểu streaming.
+    Query: document_id (mặc định = tên file), max_tokens, overlap_tokens,
+    batch_size, prune, stream=1 (NDJSON tiến độ từng batch).
+    """
+    args = request.args
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, content_type, filename = upload.stream, upload.mimetype, upload.filename
+    else:
+        stream, content_type, filename = request.stream, request.content_type, None
+
+    if (content_type or "").startswith("application/pdf") or (filename or "").lower().endswith(".pdf"):
+        return jsonify({"error": "Chi nhan text da trich xuat (text/markdown), khong nhan PDF"}), 415
+
+    document_id = args.get("document_id") or request.form.get("document_id") or filename
+    if not document_id:
+        return jsonify({"error": "document_id is required"}), 400
+
+    try:
+        max_tokens = int(args.get("max_tokens", 256))
+        overlap_tokens = int(args.get("overlap_tokens", 32))
+        batch_size = int(args["batch_size"]) if args.get("batch_size") else None
+    except ValueError:
+        return jsonify({"error": "max_tokens, overlap_tokens, batch_size phai la so nguyen"}), 400
+    if max_tokens <= 0 or overlap_tokens < 0 or (batch_size is not None and batch_size <= 0):
+        return jsonify({"error": "max_tokens, batch_size phai lon hon 0"}), 400
+
+    metadata = {"source": filename} if filename else {}
+    progress = ingest_document(
+        stream,
+        document_id,
+        metadata=metadata,
+        max_tokens=max_tokens,
+        overlap_tokens=overlap_tokens,
+        batch_size=batch_size,
+        prune=args.get("prune", "1").lower() not in ("0", "false", "no"),
+    )
 
+    if args.get("stream", "").lower() in ("1", "true", "yes"):
+        def generate():
+            try:
+                for update in progress:
+                    yield json.dumps(update, ensure_ascii=False) + "\n"
+            except Exception as e:
+                yield json.dumps({"done": True, "error": str(e)}, ensure_ascii=False) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    failed: List[Dict[str, Any]] = []
+    try:
+        for update in progress:
+            if update.get("done"):
+                update["failed_items"] = failed
+                return jsonify(update), 200
+            failed.extend(update["failed"])
+    except Exception as e:
+        print("Error ingesting document:", e)
+        return jsonify({"error": str(e), "failed_items": failed}), 500
+    return jsonify({"error": "Ingest khong hoan tat"}), 500
+
+
+@chat_bp.route("/chunk/<int:chunk_id>", methods=["DELETE"])
+@token_required
+@admin_required
+def delete_chunk(chunk_id: int, current_user: User):
+    try:
+        if not delete_document_chunk(chunk_id):
+            return jsonify({"error": "Chunk khong ton tai"}), 404
+        return jsonify({"deleted": True, "chunk_id": chunk_id}), 200
+    except Exception as e:
+        print("Error deleting chunk:", e)
+        return jsonify({"error": str(e)}), 500
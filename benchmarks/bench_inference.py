@@ -0,0 +1,79 @@
+"""
+So sánh overhead mỗi lần predict: đường cũ (DataFrame + print) và fast path NumPy.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_inference [--repeat 2000]
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+
+import pandas as pd
+
+from models.testmodel import FEATURES, SCENARIOS
+from services.model_service import ModelService
+
+
+def _legacy_prepare(vals, sink):
+    # Giống prepare_features trước đây: DataFrame 1 dòng rồi in ra stdout
+    df = pd.DataFrame([vals], columns=FEATURES)
+    print("INPUT FED TO MODEL:", file=sink)
+    print(df, file=sink)
+    return df
+
+
+def _time_per_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def run(repeat: int):
+    # Không cache, không process pool: "total new" phải chạy model thật mỗi lần
+    service = ModelService(cache_size=0, inference_workers=0)
+    # Đo riêng đường prediction cache hit (cùng params lặp lại)
+    cached_service = ModelService(cache_size=1024, inference_workers=0)
+    sink = io.StringIO()
+
+    print(f"{'Ship':<10s} {'Scenario':<28s} {'prep old':>10s} {'prep new':>10s} "
+          f"{'total old':>10s} {'total new':>10s} {'cache hit':>10s}   (median µs/call)")
+    print("-" * 97)
+
+    for ship_type, path in service.SHIP_MODEL_MAP.items():
+        if not os.path.exists(path):
+            print(f"{ship_type:<10s} model not found: {path}")
+            continue
+        model = service.get_model(ship_type)
+
+        for scenario_name, vals in SCENARIOS.items():
+            params = dict(zip(FEATURES, vals), ship_type=ship_type)
+
+            def old_prep():
+                sink.seek(0)
+                sink.truncate()
+                return _legacy_prepare(vals, sink)
+
+            def new_prep():
+                return service._model_input(model, service.prepare_features(params))
+
+            prep_old = _time_per_call(old_prep, repeat)
+            prep_new = _time_per_call(new_prep, repeat)
+            total_old = _time_per_call(lambda: model.predict(old_prep()), repeat)
+            total_new = _time_per_call(lambda: service.predict(params), repeat)
+            cached_service.predict(params)
+            cache_hit = _time_per_call(lambda: cached_service.predict(params), repeat)
+
+            print(f"{ship_type:<10s} {scenario_name:<28s} {prep_old:>10.1f} {prep_new:>10.1f} "
+                  f"{total_old:>10.1f} {total_new:>10.1f} {cache_hit:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,114 @@
+"""
+Benchmark retrieval: recall@k và độ trễ của IVF so với exact search.
+
+Dữ liệu tổng hợp có cấu trúc cụm (giống embedding văn bản thật hơn là nhiễu
+đều); query là vector của kho cộng nhiễu. Với mỗi nprobe in ra recall@k so
+với EmbeddingIndex (exact) và độ trễ p50/p95.
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_retrieval --n 200000 --nprobe 1 4 8 16 32
+    python -m benchmarks.bench_retrieval --index-dir /tmp/chunk_index   # đo cả thời gian mở mmap
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from services.embedding_index import EmbeddingIndex, normalize_rows
+from services.ivf_index import IVFIndex
+
+
+def make_corpus(n: int, dim: int, n_topics: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    labels = rng.integers(0, n_topics, size=n)
+    matrix = topics[labels] + rng.normal(scale=0.8, size=(n, dim)).astype(np.float32)
+    return normalize_rows(matrix)
+
+
+def make_queries(corpus: np.ndarray, n_queries: int, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    base = corpus[rng.integers(0, corpus.shape[0], size=n_queries)]
+    return base + rng.normal(scale=noise, size=base.shape).astype(np.float32)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    arr = np.array(samples) * 1e3
+    return {"p50": float(np.percentile(arr, 50)), "p95": float(np.percentile(arr, 95))}
+
+
+def _run_queries(index: EmbeddingIndex, queries: np.ndarray, k: int, **kwargs: Any):
+    results, samples = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = index.search(q, k=k, **kwargs)
+        samples.append(time.perf_counter() - start)
+        results.append({chunk_id for chunk_id, _ in hits})
+    return results, samples
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    corpus = make_corpus(args.n, args.dim, args.topics)
+    ids = np.arange(1, args.n + 1, dtype=np.int64)
+    queries = make_queries(corpus, args.queries, args.noise)
+
+    exact = EmbeddingIndex()
+    exact.build_from_matrix(ids, corpus)
+    truth, exact_samples = _run_queries(exact, queries, args.k)
+
+    ivf = IVFIndex(root=args.index_dir, nlist=args.nlist)
+    start = time.perf_counter()
+    ivf.build_from_matrix(ids, corpus)
+    build_seconds = time.perf_counter() - start
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "n": args.n, "dim": args.dim, "k": args.k, "queries": args.queries,
+            "nlist": int(ivf._state.main[0].shape[0]), "numpy": np.__version__,
+        },
+        "exact": {"latency_ms": _percentiles(exact_samples)},
+        "ivf": {"build_seconds": build_seconds, "nprobe": {}},
+    }
+
+    if args.index_dir:
+        ivf._persist(["bench", args.n])
+        reopened = IVFIndex(root=args.index_dir, nlist=args.nlist)
+        start = time.perf_counter()
+        reopened._load_persisted(["bench", args.n])
+        report["ivf"]["open_mmap_seconds"] = time.perf_counter() - start
+        ivf = reopened
+
+    for nprobe in args.nprobe:
+        found, samples = _run_queries(ivf, queries, args.k, nprobe=nprobe)
+        recall = np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, truth)])
+        report["ivf"]["nprobe"][str(nprobe)] = {
+            "recall_at_k": float(recall),
+            "latency_ms": _percentiles(samples),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="số vector trong kho")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=500, help="số cụm chủ đề của dữ liệu tổng hợp")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = tự chọn ~4*sqrt(n)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--index-dir", help="lưu index ra thư mục này và đo với bản mở bằng mmap")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
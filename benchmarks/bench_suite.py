@@ -0,0 +1,294 @@
+"""
+Bộ benchmark inference cho ModelService.
+
+Đo cho từng loại tàu và từng đường inference (native, compiled, cached,
+process pool):
+  - độ trễ một dòng (p50/p95/p99, µs), qua predict và apredict
+  - throughput batch 1 / 100 / 10k dòng (rows/s) và throughput của
+    APREDICT_CONCURRENCY lời gọi apredict đồng thời
+  - thời gian load model, bộ nhớ cấp phát đỉnh (tracemalloc) và mức tăng RSS
+    khi load (gồm cả trang mmap và bộ nhớ native mà tracemalloc không thấy)
+
+Kết quả in ra JSON; có thể so với baseline đã lưu để bắt regression trước
+khi deploy (exit code 1 nếu có metric xấu đi quá --tolerance).
+
+Chạy từ thư mục gốc của repo:
+    python -m benchmarks.bench_suite --output bench.json
+    python -m benchmarks.bench_suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_suite --baseline benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from models.export_trees import build_check_matrix
+from models.testmodel import FEATURES, SCENARIOS
+from services.model_service import ModelService
+
+
+BATCH_SIZES = (1, 100, 10000)
+PATHS = ("native", "compiled", "cached", "pool")
+APREDICT_CONCURRENCY = 64
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    arr = np.array(samples) * 1e6
+    return {
+        "p50": float(np.percentile(arr, 50)),
+        "p95": float(np.percentile(arr, 95)),
+        "p99": float(np.percentile(arr, 99)),
+        "mean": float(arr.mean()),
+    }
+
+
+def _time_calls(fn: Callable[[], Any], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _time_async_calls(make_call: Callable[[], Any], repeat: int) -> List[float]:
+    async def _run() -> List[float]:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await make_call()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    return asyncio.run(_run())
+
+
+def _concurrent_throughput(service: ModelService, rows: List[Dict[str, Any]], runs: int) -> float:
+    """rows/s khi APREDICT_CONCURRENCY lời gọi apredict chạy cùng lúc (lấy lần nhanh nhất)."""
+    batch = [rows[i % len(rows)] for i in range(APREDICT_CONCURRENCY)]
+
+    async def _run() -> float:
+        best = float("inf")
+        for _ in range(runs):
+            start = time.perf_counter()
+            await asyncio.gather(*(service.apredict(row) for row in batch))
+            best = min(best, time.perf_counter() - start)
+        return len(batch) / best
+
+    return asyncio.run(_run())
+
+
+def _make_service(path: str, pool_workers: int) -> ModelService:
+    service = ModelService(
+        cache_size=100000 if path == "cached" else 0,
+        inference_workers=pool_workers if path == "pool" else 0,
+    )
+    service.backend = "compiled" if path == "compiled" else "native"
+    return service
+
+
+def _rows(ship_type: str, X: np.ndarray) -> List[Dict[str, Any]]:
+    return [dict(zip(FEATURES, row), ship_type=ship_type) for row in X.tolist()]
+
+
+def _rss_mb() -> float:
+    """RSS hiện tại của process (MB); không có /proc thì dùng RSS đỉnh."""
+    try:
+        with open("/proc/self/statm") as fh:
+            resident_pages = int(fh.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về byte
+        return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def _measure_load(service: ModelService, ship_type: str) -> Dict[str, float]:
+    service.unload(ship_type)
+    rss_before = _rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    service.get_model(ship_type)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": seconds,
+        "peak_mb": peak / 2**20,
+        "rss_delta_mb": _rss_mb() - rss_before,
+    }
+
+
+def bench_ship(ship_type: str, repeat: int, pool_workers: int) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"load": {}, "paths": {}}
+    scenario_rows = _rows(ship_type, np.array(list(SCENARIOS.values())))
+    X_big = build_check_matrix(max(BATCH_SIZES))
+
+    for path in PATHS:
+        service = _make_service(path, pool_workers)
+        if path == "compiled" and not os.path.exists(service.compiled_path(ship_type)):
+            result["paths"][path] = {"skipped": "run python -m models.export_trees first"}
+            continue
+
+        try:
+            if path in ("native", "compiled"):
+                result["load"][path] = _measure_load(service, ship_type)
+
+            # Khởi động (load model, spawn worker) trước khi đo
+            service.predict(scenario_rows[0])
+
+            if path == "cached":
+                # Đo đường cache hit: cùng một dòng lặp lại
+                samples = _time_calls(lambda: service.predict(scenario_rows[0]), repeat)
+            else:
+                i = iter(range(10**9))
+                samples = _time_calls(
+                    lambda: service.predict(scenario_rows[next(i) % len(scenario_rows)]), repeat
+                )
+
+            throughput = {}
+            for size in BATCH_SIZES:
+                batch = _rows(ship_type, X_big[:size])
+                runs = max(3, min(repeat, 20000 // size))
+                best = min(_time_calls(lambda: service.predict_many(batch), runs))
+                throughput[str(size)] = size / best
+
+            # apredict: executor thread (local) hoặc Future của process pool
+            if path == "cached":
+                async_samples = _time_async_calls(lambda: service.apredict(scenario_rows[0]), repeat)
+            else:
+                j = iter(range(10**9))
+                async_samples = _time_async_calls(
+                    lambda: service.apredict(scenario_rows[next(j) % len(scenario_rows)]), repeat
+                )
+            concurrent_runs = max(3, min(repeat, 20000 // APREDICT_CONCURRENCY))
+
+            result["paths"][path] = {
+                "latency_us": _percentiles(samples),
+                "throughput_rows_per_s": throughput,
+                "apredict": {
+                    "latency_us": _percentiles(async_samples),
+                    "throughput_rows_per_s": {
+                        f"concurrent_{APREDICT_CONCURRENCY}": _concurrent_throughput(
+                            service, scenario_rows, concurrent_runs
+                        ),
+                    },
+                },
+            }
+            if path == "cached":
+                result["paths"][path]["cache"] = service.cache_stats()
+        except Exception as e:
+            result["paths"][path] = {"error": str(e)}
+        finally:
+            service.shutdown()
+
+    return result
+
+
+def run(repeat: int, pool_workers: int, ships: Optional[List[str]] = None) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "pool_workers": pool_workers,
+        },
+        "ships": {},
+    }
+    for ship_type, model_path in ModelService.SHIP_MODEL_MAP.items():
+        if ships and ship_type not in ships:
+            continue
+        if not os.path.exists(model_path):
+            report["ships"][ship_type] = {"skipped": f"model not found: {model_path}"}
+            continue
+        report["ships"][ship_type] = bench_ship(ship_type, repeat, pool_workers)
+    return report
+
+
+# --- So sánh với baseline ---
+def _flatten(node: Any, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    if isinstance(node, dict):
+        for key, value in node.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        flat[prefix] = float(node)
+    return flat
+
+
+def _higher_is_better(metric: str) -> Optional[bool]:
+    if ".throughput_rows_per_s." in metric:
+        return True
+    if ".latency_us." in metric or metric.endswith((".seconds", ".peak_mb", ".rss_delta_mb")):
+        return False
+    return None  # thông tin phụ (cache stats...) không so sánh
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    current = _flatten(report["ships"])
+    previous = _flatten(baseline["ships"])
+    regressions = []
+    for metric, old in previous.items():
+        direction = _higher_is_better(metric)
+        new = current.get(metric)
+        if direction is None or new is None or old <= 0:
+            continue
+        change = (new - old) / old
+        worse = change < -tolerance if direction else change > tolerance
+        if worse:
+            regressions.append(f"{metric}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1000, help="số lần đo độ trễ một dòng")
+    parser.add_argument("--pool-workers", type=int, default=2)
+    parser.add_argument("--ships", nargs="*", type=str.upper)
+    parser.add_argument("--output", help="ghi JSON ra file thay vì stdout")
+    parser.add_argument("--baseline", help="file JSON baseline để so sánh")
+    parser.add_argument("--save-baseline", help="lưu kết quả lần chạy này làm baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="mức xấu đi cho phép (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    # Log "Loaded model ..." của ModelService không được lẫn vào JSON trên stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args.repeat, args.pool_workers, args.ships)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            regressions = compare(report, json.load(fh), args.tolerance)
+        report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as fh:
+            fh.write(text)
+
+    if report.get("regressions"):
+        print(f"{len(report['regressions'])} performance regression(s):", file=sys.stderr)
+        for line in report["regressions"]:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,12 @@ from api.auth import auth_bp
 from api.chat import chat_bp
 from core.config import load_settings
 from core.database import db
+from core.embedding_store import DBEmbeddingStore
+from core.explanation_store import DBExplanationStore
+from core.migrations import ensure_schema
+from core.supportfunc import explanation_cache
+from services.env import get_env_bool
+from services.model_service import model_service
 
 
 def create_app() -> Flask:
@@ -17,6 +23,7 @@ def create_app() -> Flask:
         SQLALCHEMY_DATABASE_URI=settings.database_url,
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         SECRET_KEY=settings.secret_key,
+        ADMIN_EMAILS=settings.admin_emails,
     )
 
     # Enable CORS for all routes; tighten origins in production if needed.
@@ -29,10 +36,26 @@ def create_app() -> Flask:
         from core import models  # noqa: F401
 
         db.create_all()
+        # Migration cột là bước deploy riêng (python -m core.migrations --schema-only);
+        # SCHEMA_AUTO_MIGRATE=1 chỉ nên dùng khi chạy một process (dev)
+        if get_env_bool("SCHEMA_AUTO_MIGRATE", False):
+            ensure_schema()
+
+    # Tầng thứ hai của cache embedding: bảng embedding_cache
+    if get_env_bool("EMBEDDING_CACHE_PERSIST", True):
+        model_service.set_embedding_store(DBEmbeddingStore(app))
+
+    # Tầng thứ hai của cache câu giải thích: bảng explanation_cache
+    if get_env_bool("EXPLANATION_CACHE_PERSIST", True):
+        explanation_cache.attach_store(DBExplanationStore(app))
 
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(chat_bp, url_prefix="/chat")
 
+    # Load sẵn model của tất cả loại tàu để request đầu tiên không phải đọc pickle.
+    if get_env_bool("MODEL_PRELOAD", True):
+        model_service.warm()
+
     @app.route("/")
     def index():
         # Simple HTML page to manually interact with the API during development.
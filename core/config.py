@@ -11,6 +11,7 @@ load_dotenv()
 class Settings:
     database_url: str
     secret_key: str
+    admin_emails: frozenset[str]
 
 
 def _normalize_database_url(url: str) -> str:
@@ -29,7 +30,14 @@ def load_settings() -> Settings:
         raise RuntimeError("SUPABASE_DB_URL environment variable is required")
 
     secret_key = os.environ.get("SECRET_KEY", "change-me")
+    # Comma-separated list of users allowed to call the admin endpoints.
+    admin_emails = frozenset(
+        email.strip().lower()
+        for email in os.environ.get("ADMIN_EMAILS", "").split(",")
+        if email.strip()
+    )
     return Settings(
         database_url=_normalize_database_url(database_url),
         secret_key=secret_key,
+        admin_emails=admin_emails,
     )
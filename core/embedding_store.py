@@ -0,0 +1,61 @@
+"""
+Store bền vững cho cache embedding (bảng embedding_cache).
+
+Mỗi thao tác chạy trong app context riêng nên dùng session riêng: commit ở
+đây không đụng tới transaction của request, và gọi được từ thread nền
+(ví dụ pipeline ingest tài liệu). Embedding lưu dạng float32 bytes
+(encode_f32), không phải double precision[].
+"""
+from typing import Dict, List
+
+from flask import Flask
+from sqlalchemy.dialects.postgresql import insert
+
+from core.database import db
+from core.models import EmbeddingCacheEntry
+from services.vector_codec import decode_f32, encode_f32
+
+
+class DBEmbeddingStore:
+    def __init__(self, app: Flask):
+        self.app = app
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys:
+            return {}
+        with self.app.app_context():
+            rows = (
+                db.session.query(EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding)
+                .filter(EmbeddingCacheEntry.key.in_(keys))
+                .all()
+            )
+        return {key: decode_f32(embedding).tolist() for key, embedding in rows}
+
+    def put_many(self, model: str, entries: Dict[str, List[float]]) -> None:
+        if not entries:
+            return
+        with self.app.app_context():
+            stmt = insert(EmbeddingCacheEntry).values([
+                {"key": key, "model": model, "embedding": encode_f32(embedding)}
+                for key, embedding in entries.items()
+            ]).on_conflict_do_nothing(index_elements=["key"])
+            try:
+                db.session.execute(stmt)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def purge_except(self, model: str) -> int:
+        with self.app.app_context():
+            try:
+                removed = (
+                    EmbeddingCacheEntry.query
+                    .filter(EmbeddingCacheEntry.model != model)
+                    .delete(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return removed
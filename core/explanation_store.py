@@ -0,0 +1,75 @@
+"""
+Store bền vững cho cache câu giải thích của LLM (bảng explanation_cache).
+
+Giống DBEmbeddingStore: mỗi thao tác chạy trong app context riêng, nên
+commit ở đây không đụng tới transaction của request. Tuổi của entry được so
+bằng now() của DB, không phụ thuộc đồng hồ của worker.
+"""
+from datetime import timedelta
+from typing import Optional
+
+from flask import Flask
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from core.database import db
+from core.models import ExplanationCacheEntry
+
+
+class DBExplanationStore:
+    def __init__(self, app: Flask):
+        self.app = app
+
+    def get(self, key: str, max_age_seconds: float) -> Optional[str]:
+        with self.app.app_context():
+            row = (
+                db.session.query(ExplanationCacheEntry.explanation)
+                .filter(
+                    ExplanationCacheEntry.key == key,
+                    ExplanationCacheEntry.created_at >= func.now() - timedelta(seconds=max_age_seconds),
+                )
+                .first()
+            )
+        return row[0] if row else None
+
+    def put(
+        self,
+        key: str,
+        explanation: str,
+        ship_type: Optional[str] = None,
+        model: str = "",
+        prompt_version: int = 0,
+    ) -> None:
+        with self.app.app_context():
+            stmt = insert(ExplanationCacheEntry).values(
+                key=key,
+                ship_type=ship_type,
+                model=model,
+                prompt_version=prompt_version,
+                explanation=explanation,
+            )
+            # Entry hết hạn có cùng key được ghi đè và tính tuổi lại từ đầu
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["key"],
+                set_={"explanation": stmt.excluded.explanation, "created_at": func.now()},
+            )
+            try:
+                db.session.execute(stmt)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def purge_expired(self, ttl_seconds: float) -> int:
+        with self.app.app_context():
+            try:
+                removed = (
+                    ExplanationCacheEntry.query
+                    .filter(ExplanationCacheEntry.created_at < func.now() - timedelta(seconds=ttl_seconds))
+                    .delete(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return removed
@@ -0,0 +1,130 @@
+"""
+Migration nhỏ cho các cột không được db.create_all() thêm vào bảng đã tồn tại.
+
+Là một bước deploy riêng (chạy một lần trước khi khởi động các worker), vì
+ALTER TABLE giữ ACCESS EXCLUSIVE lock trên bảng:
+    python -m core.migrations --schema-only
+
+Chuyển embedding double precision[] sang float32 bytea (+ int8/scale):
+    python -m core.migrations --batch-size 1000
+    python -m core.migrations --drop-array     # xóa luôn giá trị cũ sau khi chuyển
+"""
+import argparse
+import os
+
+from sqlalchemy import bindparam, text
+
+from core.database import db
+from core.models import DocumentChunk
+from services.env import get_env_bool
+from services.vector_codec import encode_f32, quantize_i8
+
+
+# (bảng, cột, kiểu)
+SCHEMA_COLUMNS = (
+    ("fluxmare_chunks", "embedding_f32", "BYTEA"),
+    ("fluxmare_chunks", "embedding_i8", "BYTEA"),
+    ("fluxmare_chunks", "embedding_scale", "DOUBLE PRECISION"),
+    ("llm_role_examples", "prompt_embedding", "BYTEA"),
+    ("llm_role_examples", "embedding_model", "VARCHAR(255)"),
+)
+
+
+def ensure_schema() -> int:
+    """
+    Thêm các cột còn thiếu (idempotent); gọi trong app context.
+
+    Chỉ ALTER bảng thực sự thiếu cột, nên chạy lại trên schema đã đủ không
+    lấy lock nào. Trả về số cột đã thêm.
+    """
+    existing = {
+        (table, column)
+        for table, column in db.session.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema()"
+        ))
+    }
+    added = 0
+    for table, column, column_type in SCHEMA_COLUMNS:
+        if (table, column) in existing:
+            continue
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}"))
+        print(f"Added column {table}.{column}")
+        added += 1
+    db.session.commit()
+    return added
+
+
+def embedding_columns(vector) -> dict:
+    """Giá trị các cột embedding cho một vector mới."""
+    quantized, scale = quantize_i8(vector)
+    columns = {"embedding_f32": encode_f32(vector), "embedding_i8": quantized, "embedding_scale": scale}
+    if get_env_bool("EMBEDDING_KEEP_ARRAY", False):
+        columns["embedding"] = list(vector)
+    return columns
+
+
+def migrate_embeddings(batch_size: int = 1000, drop_array: bool = False) -> int:
+    """Điền embedding_f32/i8/scale cho các dòng còn thiếu; một commit mỗi batch."""
+    table = DocumentChunk.__table__
+    update = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(
+            embedding_f32=bindparam("f32"),
+            embedding_i8=bindparam("i8"),
+            embedding_scale=bindparam("scale"),
+            **({"embedding": None} if drop_array else {}),
+        )
+    )
+
+    criteria = [DocumentChunk.embedding.isnot(None)]
+    if not drop_array:
+        criteria.append(DocumentChunk.embedding_f32.is_(None))
+
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.session.query(DocumentChunk.id, DocumentChunk.embedding)
+            .filter(DocumentChunk.id > last_id, *criteria)
+            .order_by(DocumentChunk.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        params = []
+        for row_id, vector in rows:
+            quantized, scale = quantize_i8(vector)
+            params.append({"row_id": row_id, "f32": encode_f32(vector), "i8": quantized, "scale": scale})
+        db.session.execute(update, params)
+        db.session.commit()
+        migrated += len(rows)
+        last_id = rows[-1].id
+        print(f"Migrated {migrated} embeddings (last id {last_id})")
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-array", action="store_true", help="đặt cột embedding cũ về NULL sau khi chuyển")
+    parser.add_argument("--schema-only", action="store_true", help="chỉ thêm cột còn thiếu, không chuyển dữ liệu")
+    args = parser.parse_args()
+
+    os.environ.setdefault("MODEL_PRELOAD", "0")
+    from core.app import create_app
+
+    app = create_app()
+    with app.app_context():
+        added = ensure_schema()
+        print(f"Schema up to date ({added} columns added)")
+        if args.schema_only:
+            return
+        total = migrate_embeddings(args.batch_size, args.drop_array)
+    print(f"Done: {total} rows migrated")
+
+
+if __name__ == "__main__":
+    main()
@@ -122,6 +122,9 @@ class LLMRoleExample(db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey("roles.id"), nullable=False)
     user_prompt = db.Column(db.Text, nullable=False)
     assistant_response = db.Column(db.Text, nullable=False)
+    # Embedding float32 của user_prompt, tính một lần (xem core/supportfunc.py)
+    prompt_embedding = db.Column(db.LargeBinary, nullable=True)
+    embedding_model = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
     def __repr__(self):
@@ -134,12 +137,48 @@ class DocumentChunk(db.Model):
 
     content = db.Column(db.Text, nullable=False)
 
-    # Lưu embedding 768 chiều
+    # Lưu embedding 768 chiều (định dạng cũ, double precision[])
     embedding = db.Column(db.ARRAY(db.Float), nullable=True)
 
+    # Định dạng gọn: float32 little-endian và bản int8 + scale
+    # (services/vector_codec.py); core/migrations.py chuyển dữ liệu cũ sang
+    embedding_f32 = db.Column(db.LargeBinary, nullable=True)
+    embedding_i8 = db.Column(db.LargeBinary, nullable=True)
+    embedding_scale = db.Column(db.Float, nullable=True)
+
     meta = db.Column(JSONB, default=dict)
 
     created_at = db.Column(db.DateTime, server_default=func.now())
 
     def __repr__(self):
         return f"<DocumentChunk {self.id}>"
+
+
+class EmbeddingCacheEntry(db.Model):
+    __tablename__ = "embedding_cache"
+
+    # sha256(model + text), xem services/embedding_cache.py
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(255), nullable=False, index=True)
+    # float32 little-endian (encode_f32 trong services/vector_codec.py)
+    embedding = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<EmbeddingCacheEntry {self.key[:12]} model={self.model}>"
+
+
+class ExplanationCacheEntry(db.Model):
+    __tablename__ = "explanation_cache"
+
+    # sha256(ship type + feature lượng tử hóa + bucket dự đoán + model + prompt version),
+    # xem services/explanation_cache.py
+    key = db.Column(db.String(64), primary_key=True)
+    ship_type = db.Column(db.String(255), nullable=True)
+    model = db.Column(db.String(255), nullable=False)
+    prompt_version = db.Column(db.Integer, nullable=False)
+    explanation = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=func.now(), index=True)
+
+    def __repr__(self):
+        return f"<ExplanationCacheEntry {self.key[:12]} ship={self.ship_type} model={self.model}>"
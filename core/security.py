@@ -69,3 +69,17 @@ def token_required(func: Callable[P, R]) -> Callable[P, R]:
         return func(*args, **kwargs)
 
     return wrapper
+
+
+def admin_required(func: Callable[P, R]) -> Callable[P, R]:
+    """Use below @token_required: only users listed in ADMIN_EMAILS may pass."""
+
+    @wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        user = kwargs.get("current_user")
+        admins = current_app.config.get("ADMIN_EMAILS") or frozenset()
+        if user is None or (user.email or "").lower() not in admins:
+            return jsonify({"error": "Admin privileges required"}), 403  # type: ignore[return-value]
+        return func(*args, **kwargs)
+
+    return wrapper
@@ -1,16 +1,58 @@
-import asyncio
+import os
 import random
 import re
-from typing import Any, Dict, Optional
+from typing import IO, Any, Dict, Iterator, List, Optional
 
 import numpy as np
-from sqlalchemy import func
+from flask import current_app
+from sqlalchemy import case, func, or_
 from sqlalchemy.orm import Session
 
+from core.migrations import embedding_columns
 from core.models import DocumentChunk, LLMRoleExample, State
+from services.chunking import chunk_meta, chunk_text, embed_in_background, iter_text
+from services.embedding_index import Int8Index, create_index, index_poll_seconds
+from services.env import get_env_bool, get_env_float, get_env_int
+from services.example_index import ExampleIndex
+from services.explanation_cache import ExplanationCache, explanation_key
+from services.lexical_index import BM25Index, reciprocal_rank_fusion
 from services.llm_service import llm_service
 from services.model_service import model_service
+from services.vector_codec import decode_f32, decode_i8, encode_f32
 from core.database import db
+
+SIMILARITY_THRESHOLD = 0.7
+TOP_K = 3
+
+# Index embedding dùng chung cho cả process, build lười ở lần search đầu tiên.
+# RETRIEVAL_BACKEND=exact (quét toàn bộ ma trận), int8 (ma trận int8, rescore
+# bằng float32 đọc từ DB) hoặc ivf (ANN, lưu đĩa + mmap)
+chunk_index = create_index(rescore=lambda ids: _chunk_vectors_by_id(ids))
+
+# Index BM25 trên content, fuse với kết quả vector bằng reciprocal rank fusion
+# để query chứa token kỹ thuật ("Weather_WavePeriod", tên tàu) vẫn có context
+lexical_index = BM25Index()
+HYBRID_RETRIEVAL = get_env_bool("RETRIEVAL_HYBRID", True)
+HYBRID_CANDIDATES = get_env_int("HYBRID_CANDIDATES", 20)
+# Tỉ lệ term của query tối thiểu phải có trong chunk để chunk chỉ khớp từ khóa được nhận
+HYBRID_MIN_TERM_MATCH = get_env_float("HYBRID_MIN_TERM_MATCH", 0.5)
+RRF_K = 60
+
+# Cache câu giải thích của call_llm; tăng EXPLANATION_PROMPT_VERSION khi sửa
+# prompt trong explanation_messages để bỏ các câu đã cache
+EXPLANATION_PROMPT_VERSION = 1
+explanation_cache = ExplanationCache(
+    maxsize=get_env_int("EXPLANATION_CACHE_SIZE", 1024),
+    ttl_seconds=get_env_float("EXPLANATION_CACHE_TTL_SECONDS", 7 * 24 * 3600.0),
+)
+
+# Câu trả lời mẫu: exact match theo text chuẩn hóa, fuzzy theo trigram, semantic
+# theo cosine với embedding user_prompt (đủ tự tin thì không gọi LLM)
+example_index = ExampleIndex(
+    threshold=get_env_float("EXAMPLE_FUZZY_THRESHOLD", 0.6),
+    semantic_threshold=get_env_float("EXAMPLE_SEMANTIC_THRESHOLD", 0.9),
+)
+
 STRUCTURED_FIELD_MAP = {
     "speedOverGround": "Ship_SpeedOverGround",
     "windSpeed10M": "Weather_WindSpeed10M",
@@ -45,19 +87,96 @@ LABELS = {
 }
 
 
-def get_example_response(db: Session, user_message: str):
-    # Tìm câu gần giống (LIKE)
-    example = (
-        db.query(LLMRoleExample)
-        .filter(func.lower(LLMRoleExample.user_prompt).like(f"%{user_message.lower()}%"))
-        .first()
+def _example_fingerprint(db: Session):
+    # Bảng nhỏ: count + max id + tổng độ dài đủ để phát hiện thêm / xóa / sửa
+    count, max_id, total_len = db.query(
+        func.count(LLMRoleExample.id),
+        func.max(LLMRoleExample.id),
+        func.coalesce(
+            func.sum(func.length(LLMRoleExample.user_prompt) + func.length(LLMRoleExample.assistant_response)),
+            0,
+        ),
+    ).one()
+    return [int(count), int(max_id or 0), int(total_len)]
+
+
+def _load_examples(db: Session):
+    """
+    [(id, user_prompt, assistant_response, embedding)]. Chỉ đọc embedding đã
+    lưu của đúng model embedding hiện tại; ví dụ còn thiếu (None) được
+    _embed_examples tính ở thread nền của ExampleIndex.
+    """
+    model = model_service.EMBEDDING_MODEL
+    rows = (
+        db.query(
+            LLMRoleExample.id,
+            LLMRoleExample.user_prompt,
+            LLMRoleExample.assistant_response,
+            LLMRoleExample.prompt_embedding,
+            LLMRoleExample.embedding_model,
+        )
+        .order_by(LLMRoleExample.id)
+        .all()
     )
+    vectors = {
+        row.id: decode_f32(row.prompt_embedding)
+        for row in rows
+        if row.prompt_embedding is not None and row.embedding_model == model
+    }
+    return [
+        (row.id, row.user_prompt, row.assistant_response, vectors.get(row.id))
+        for row in rows
+    ]
+
+
+def _embed_examples(app):
+    """Hàm embed cho thread nền: tính embedding của prompt rồi lưu lại để lần build sau khỏi gọi."""
+    def embed(pending):
+        model = model_service.EMBEDDING_MODEL
+        vectors = model_service.get_embeddings([prompt for _, prompt in pending], retry_count=1)
+        with app.app_context():
+            try:
+                db.session.bulk_update_mappings(LLMRoleExample, [
+                    {"id": example_id, "prompt_embedding": encode_f32(vector), "embedding_model": model}
+                    for (example_id, _), vector in zip(pending, vectors)
+                ])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[WARN] Could not store example prompt embeddings: {e}")
+        return vectors
+    return embed
+
+
+def get_example_index(db: Session) -> ExampleIndex:
+    """Index câu trả lời mẫu, build lại khi bảng đổi (kiểm tra tối đa mỗi CHUNK_INDEX_POLL_SECONDS)."""
+    example_index.refresh(
+        index_poll_seconds(),
+        lambda: _example_fingerprint(db),
+        lambda: _load_examples(db),
+        _embed_examples(current_app._get_current_object()),
+    )
+    return example_index
+
+
+def get_example_response(db: Session, user_message: str):
+    # Tra trong index RAM: exact theo text chuẩn hóa, sau đó fuzzy theo trigram
+    example = get_example_index(db).match(user_message)
     if example:
-        return example.assistant_response
+        return example.response
     return None
 
 
-def call_llm(prediction_value: float, params: Dict[str, Any]) -> str:
+def get_semantic_example_response(db: Session, query_vec: List[float]):
+    # Cosine giữa embedding câu hỏi (cũng dùng cho search_embedding) và embedding user_prompt
+    example = get_example_index(db).match_vector(query_vec)
+    if example:
+        print(f"Semantic example match id={example.id} (sim={example.score:.4f})")
+        return example.response
+    return None
+
+
+def explanation_messages(prediction_value: float, params: Dict[str, Any]) -> List[Dict[str, str]]:
     assistant_message = (
     f"Bạn PHẢI trả lời HOÀN TOÀN bằng tiếng Việt, "
     f"ngay cả khi các tham số hoặc dữ liệu đầu vào có chứa tiếng Anh (dịch các dữ liệu đầu vào sang tiếng Việt).\n\n"
@@ -67,11 +186,47 @@ def call_llm(prediction_value: float, params: Dict[str, Any]) -> str:
     )
     elaboration_prompt = "Vui lòng giải thích chi tiết về dự đoán này với những thông tin hữu ích."
     result_messages = [{"role": "assistant", "content": assistant_message}]
-    elaboration_messages = result_messages + [{"role": "user", "content": elaboration_prompt}]
-    final_response = asyncio.run(llm_service.chat(elaboration_messages, "vi"))
+    return result_messages + [{"role": "user", "content": elaboration_prompt}]
+
+
+def _explanation_cache_key(prediction_value: float, params: Dict[str, Any]) -> tuple:
+    labels = {
+        "ship_type": params.get("ship_type"),
+        "model": llm_service.model_name,
+        "prompt_version": EXPLANATION_PROMPT_VERSION,
+    }
+    key = explanation_key(
+        labels["ship_type"], params, prediction_value, labels["model"], EXPLANATION_PROMPT_VERSION
+    )
+    return key, labels
+
+
+def call_llm(prediction_value: float, params: Dict[str, Any]) -> str:
+    # Bộ tham số gần giống đã được giải thích -> không gọi LLM
+    key, labels = _explanation_cache_key(prediction_value, params)
+    cached = explanation_cache.get(key)
+    if cached is not None:
+        return cached
+    final_response = llm_service.chat_sync(explanation_messages(prediction_value, params), "vi")
+    explanation_cache.put(key, final_response, **labels)
     return final_response
 
 
+def call_llm_stream(prediction_value: float, params: Dict[str, Any]) -> Iterator[str]:
+    """Như call_llm nhưng yield từng đoạn giải thích ngay khi LLM sinh ra."""
+    key, labels = _explanation_cache_key(prediction_value, params)
+    cached = explanation_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts: List[str] = []
+    for delta in llm_service.stream_sync(explanation_messages(prediction_value, params), "vi"):
+        parts.append(delta)
+        yield delta
+    # Chỉ cache khi stream chạy hết (client không ngắt giữa chừng)
+    explanation_cache.put(key, "".join(parts), **labels)
+
+
 def _normalize_ship_type(value: Any) -> Optional[str]:
     if value is None:
         return None
@@ -110,7 +265,12 @@ def extract_params(
     conversation_id: int,
     db: Session,
     structured_params: Optional[Dict[str, Any]] = None,
+    explain: bool = True,
 ):
+    """
+    explain=False: không gọi LLM giải thích (llm_response=None); caller tự
+    stream bằng call_llm_stream(prediction, params).
+    """
     extracted: Dict[str, Any] = {}
 
     if structured_params:
@@ -149,7 +309,7 @@ def extract_params(
 
     if previously_full:
         prediction = model_service.predict(params)
-        answer = call_llm(prediction, params)
+        answer = call_llm(prediction, params) if explain else None
         response = (
             f"Cảm ơn bạn đã cập nhật thông tin về {', '.join(LABELS[p] for p in provided)}. "
             f"Tôi sẽ tính toán lại dự đoán dựa trên dữ liệu mới."
@@ -184,7 +344,7 @@ def extract_params(
         return {"done": False, "message": response, "updated": False, "params": params}
 
     result = model_service.predict(params)
-    llm_answer = call_llm(result, params)
+    llm_answer = call_llm(result, params) if explain else None
 
     return {
         "done": True,
@@ -205,13 +365,16 @@ def store_document_chunk(content: str, metadata: dict):
         # 2. Tạo row mới
         chunk = DocumentChunk(
             content=content,
-            embedding=embedding_vector,
-            metadata=metadata,
+            meta=metadata,
+            **embedding_columns(embedding_vector),
         )
 
         # 3. Lưu DB
         db.session.add(chunk)
         db.session.commit()
+        # Đưa ngay vào index đang chạy; worker khác bắt kịp qua watermark
+        chunk_index.add([chunk.id], [embedding_vector])
+        lexical_index.add([chunk.id], [content])
 
         print(f"[✓] Saved chunk id={chunk.id}, dim={len(embedding_vector)}")
         return chunk
@@ -221,6 +384,208 @@ def store_document_chunk(content: str, metadata: dict):
         print(f"[ERROR] Failed to store chunk: {str(e)}")
         raise
 
+
+def _embed_batch(texts: List[str]) -> List[Any]:
+    """Embedding cho cả batch; nếu request batch lỗi thì thử từng text để tách item hỏng."""
+    try:
+        return model_service.get_embeddings(texts, batch_size=len(texts))
+    except Exception as e:
+        print(f"[WARN] Batch embedding failed ({e}), retrying items one by one")
+    results: List[Any] = []
+    for text in texts:
+        try:
+            results.append(model_service.get_embedding(text, retry_count=1))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _write_chunks(pending: List[tuple], label: str) -> tuple:
+    """
+    Insert [(key, content, embedding, meta)] bằng một lần flush + một commit.
+    Trả về (chunk_ids, failed); cả batch lỗi nếu DB lỗi.
+    """
+    if not pending:
+        return [], []
+    chunks = [
+        DocumentChunk(content=content, meta=meta, **embedding_columns(vector))
+        for _, content, vector, meta in pending
+    ]
+    try:
+        db.session.add_all(chunks)
+        # flush: một INSERT nhiều dòng; lấy id trước commit để tránh
+        # mỗi object phải SELECT lại sau khi bị expire
+        db.session.flush()
+        chunk_ids = [chunk.id for chunk in chunks]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ERROR] Failed to store {label}: {str(e)}")
+        return [], [{"index": key, "error": f"database error: {e}"} for key, _, _, _ in pending]
+    chunk_index.add(chunk_ids, [vector for _, _, vector, _ in pending])
+    lexical_index.add(chunk_ids, [content for _, content, _, _ in pending])
+    return chunk_ids, []
+
+
+def store_document_chunks(items: List[Dict[str, Any]], batch_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Ingest nhiều chunk: embedding theo batch (input dạng list), insert cả batch
+    và commit một lần mỗi batch. Yield tiến độ sau mỗi batch:
+    {"batch", "processed", "total", "stored", "chunk_ids", "failed": [{"index", "error"}]}
+    """
+    batch_size = max(1, batch_size or model_service.embedding_batch_size)
+    total = len(items)
+
+    for batch_no, start in enumerate(range(0, total, batch_size), 1):
+        batch = items[start:start + batch_size]
+        failed: List[Dict[str, Any]] = []
+        valid: List[tuple] = []
+        for offset, item in enumerate(batch):
+            index = start + offset
+            if not isinstance(item, dict):
+                failed.append({"index": index, "error": "item must be an object"})
+                continue
+            content = item.get("content")
+            metadata = item.get("metadata") or {}
+            if not isinstance(content, str) or not content.strip():
+                failed.append({"index": index, "error": "content is required"})
+            elif not isinstance(metadata, dict):
+                failed.append({"index": index, "error": "metadata must be an object"})
+            else:
+                valid.append((index, content, metadata))
+
+        pending: List[tuple] = []
+        if valid:
+            vectors = _embed_batch([content for _, content, _ in valid])
+            for (index, content, metadata), vector in zip(valid, vectors):
+                if isinstance(vector, Exception):
+                    failed.append({"index": index, "error": f"embedding failed: {vector}"})
+                else:
+                    pending.append((index, content, vector, metadata))
+
+        chunk_ids, write_failed = _write_chunks(pending, f"batch {batch_no}")
+        failed.extend(write_failed)
+
+        failed.sort(key=lambda f: f["index"])
+        print(f"[✓] Bulk batch {batch_no}: stored {len(chunk_ids)}, failed {len(failed)}")
+        yield {
+            "batch": batch_no,
+            "processed": min(start + batch_size, total),
+            "total": total,
+            "stored": len(chunk_ids),
+            "chunk_ids": chunk_ids,
+            "failed": failed,
+        }
+
+
+def _document_chunk_hashes(document_id: str) -> Dict[str, List[int]]:
+    """{content_hash: [chunk_id]} của các chunk đã ingest cho tài liệu này."""
+    rows = (
+        db.session.query(DocumentChunk.id, DocumentChunk.meta["content_hash"].astext)
+        .filter(DocumentChunk.meta["document_id"].astext == document_id)
+        .all()
+    )
+    hashes: Dict[str, List[int]] = {}
+    for chunk_id, chunk_hash in rows:
+        if chunk_hash:
+            hashes.setdefault(chunk_hash, []).append(chunk_id)
+    return hashes
+
+
+def ingest_document(
+    stream: IO[bytes],
+    document_id: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    max_tokens: int = 256,
+    overlap_tokens: int = 32,
+    batch_size: Optional[int] = None,
+    prune: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Ingest một tài liệu lớn từ stream: chunk (generator) -> embedding theo batch
+    trên thread nền -> ghi DB ở thread hiện tại, một commit mỗi batch.
+
+    Chunk có content_hash đã tồn tại cho document_id thì bỏ qua (không gọi
+    embedding); với prune=True các chunk cũ không còn trong tài liệu bị xóa.
+    Yield tiến độ sau mỗi batch và một bản tổng kết cuối cùng ("done": True).
+    """
+    batch_size = max(1, batch_size or model_service.embedding_batch_size)
+    existing = _document_chunk_hashes(document_id)
+    seen_hashes = set()
+    totals = {"chunks": 0, "stored": 0, "skipped": 0, "failed": 0}
+
+    def _tracked_chunks():
+        for chunk in chunk_text(iter_text(stream), max_tokens, overlap_tokens):
+            seen_hashes.add(chunk.content_hash)
+            totals["chunks"] += 1
+            yield chunk
+
+    batches = embed_in_background(_tracked_chunks(), _embed_batch, batch_size, set(existing))
+    for batch_no, batch in enumerate(batches, 1):
+        failed: List[Dict[str, Any]] = []
+        pending: List[tuple] = []
+        for chunk, vector in zip(batch.chunks, batch.vectors):
+            if isinstance(vector, Exception):
+                failed.append({"index": chunk.index, "error": f"embedding failed: {vector}"})
+            else:
+                pending.append((chunk.index, chunk.content, vector, chunk_meta(chunk, document_id, metadata)))
+
+        chunk_ids, write_failed = _write_chunks(pending, f"{document_id} batch {batch_no}")
+        failed.extend(write_failed)
+        totals["stored"] += len(chunk_ids)
+        totals["skipped"] += batch.skipped
+        totals["failed"] += len(failed)
+        yield {
+            "document_id": document_id,
+            "batch": batch_no,
+            "chunks": totals["chunks"],
+            "stored": len(chunk_ids),
+            "skipped": batch.skipped,
+            "chunk_ids": chunk_ids,
+            "failed": failed,
+        }
+
+    removed: List[int] = []
+    if prune:
+        removed = [
+            chunk_id
+            for chunk_hash, chunk_ids in existing.items()
+            if chunk_hash not in seen_hashes
+            for chunk_id in chunk_ids
+        ]
+        if removed:
+            try:
+                DocumentChunk.query.filter(DocumentChunk.id.in_(removed)).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            chunk_index.remove(removed)
+            lexical_index.remove(removed)
+
+    print(
+        f"[✓] Ingested document {document_id}: {totals['chunks']} chunks, stored {totals['stored']}, "
+        f"skipped {totals['skipped']}, removed {len(removed)}, failed {totals['failed']}"
+    )
+    yield {"done": True, "document_id": document_id, **totals, "removed": len(removed)}
+
+
+def delete_document_chunk(chunk_id: int) -> bool:
+    """Xóa chunk khỏi DB và tombstone trong index. False nếu không tồn tại."""
+    chunk = DocumentChunk.query.get(chunk_id)
+    if chunk is None:
+        return False
+    try:
+        db.session.delete(chunk)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    chunk_index.remove([chunk_id])
+    lexical_index.remove([chunk_id])
+    print(f"[✓] Deleted chunk id={chunk_id}")
+    return True
+
 def cosine_similarity(a, b):
     a = np.array(a)
     b = np.array(b)
@@ -233,37 +598,170 @@ def cosine_similarity(a, b):
         return 0.0
 
     return float(np.dot(a, b) / denom)
-def search_embedding(message: str):
-    # 1. Lấy embedding của message nhập vào
-    query_vec = model_service.get_embedding(message)
+# Chunk có embedding ở định dạng mới (float32 bytea) hoặc cũ (double precision[])
+HAS_EMBEDDING = or_(DocumentChunk.embedding_f32.isnot(None), DocumentChunk.embedding.isnot(None))
 
-    # 2. Lấy toàn bộ chunk từ DB
-    chunks = DocumentChunk.query.all()
 
-    results = []
-    for chunk in chunks:
-        if chunk.embedding is None:
-            continue
+def _chunk_embeddings(*criteria):
+    """
+    (ids, vectors) cho index; content được lấy riêng cho các chunk thắng.
+
+    Chỉ một định dạng mỗi dòng đi qua kết nối: int8 cho backend int8, float32
+    cho các backend khác; double precision[] chỉ với dòng chưa migrate.
+    """
+    f32_missing = DocumentChunk.embedding_f32.is_(None)
+    if isinstance(chunk_index, Int8Index):
+        i8_missing = DocumentChunk.embedding_i8.is_(None)
+        rows = (
+            db.session.query(
+                DocumentChunk.id,
+                DocumentChunk.embedding_i8,
+                DocumentChunk.embedding_scale,
+                case((i8_missing, DocumentChunk.embedding_f32), else_=None),
+                case((i8_missing & f32_missing, DocumentChunk.embedding), else_=None),
+            )
+            .filter(HAS_EMBEDDING, *criteria)
+            .all()
+        )
+        vectors = [
+            _first_vector(decode_i8(i8, scale), decode_f32(f32), legacy)
+            for _, i8, scale, f32, legacy in rows
+        ]
+    else:
+        rows = (
+            db.session.query(
+                DocumentChunk.id,
+                DocumentChunk.embedding_f32,
+                case((f32_missing, DocumentChunk.embedding), else_=None),
+            )
+            .filter(HAS_EMBEDDING, *criteria)
+            .all()
+        )
+        vectors = [_first_vector(decode_f32(f32), legacy) for _, f32, legacy in rows]
+    return [row[0] for row in rows], vectors
+
+
+def _first_vector(*candidates):
+    return next((v for v in candidates if v is not None), None)
+
+
+def _chunk_vectors_by_id(ids):
+    """{id: embedding float32} để rescore các ứng viên của index int8."""
+    rows = (
+        db.session.query(
+            DocumentChunk.id,
+            DocumentChunk.embedding_f32,
+            case((DocumentChunk.embedding_f32.is_(None), DocumentChunk.embedding), else_=None),
+        )
+        .filter(DocumentChunk.id.in_(ids))
+        .all()
+    )
+    return {chunk_id: _first_vector(decode_f32(f32), legacy) for chunk_id, f32, legacy in rows}
+
 
-        sim = cosine_similarity(query_vec, chunk.embedding)
+def _load_chunk_embeddings():
+    return _chunk_embeddings()
 
-        # Chỉ lấy chunk có similarity >= 0.7
-        if sim >= 0.7:
-            results.append({
-                "id": chunk.id,
-                "content": chunk.content,
-                "similarity": round(sim, 4)
-            })
 
-    # Nếu không có chunk nào ≥ 0.7 → trả về message gốc, không context
-    if not results:
+def _chunk_fingerprint():
+    # Watermark rẻ của bảng: đổi khi có chunk được thêm hoặc xóa
+    count, max_id = (
+        db.session.query(func.count(DocumentChunk.id), func.max(DocumentChunk.id))
+        .filter(HAS_EMBEDDING)
+        .one()
+    )
+    return [int(count), int(max_id or 0)]
+
+
+def _chunk_ids():
+    return [
+        row.id
+        for row in db.session.query(DocumentChunk.id).filter(HAS_EMBEDDING)
+    ]
+
+
+def get_chunk_index():
+    """Index đã sẵn sàng, đã bắt kịp thay đổi của worker khác (tối đa mỗi CHUNK_INDEX_POLL_SECONDS)."""
+    chunk_index.ensure_loaded(_load_chunk_embeddings, _chunk_fingerprint)
+    chunk_index.maybe_sync(
+        index_poll_seconds(),
+        _chunk_fingerprint,
+        lambda after_id: _chunk_embeddings(DocumentChunk.id > after_id),
+        _chunk_ids,
+        lambda ids: _chunk_embeddings(DocumentChunk.id.in_(ids)),
+    )
+    return chunk_index
+
+
+def _chunk_contents(*criteria):
+    rows = db.session.query(DocumentChunk.id, DocumentChunk.content).filter(HAS_EMBEDDING, *criteria).all()
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def get_lexical_index():
+    """Index BM25 đã sẵn sàng, bắt kịp worker khác theo cùng watermark với index embedding."""
+    lexical_index.ensure_loaded(_chunk_contents)
+    lexical_index.maybe_sync(
+        index_poll_seconds(),
+        _chunk_fingerprint,
+        lambda after_id: _chunk_contents(DocumentChunk.id > after_id),
+        _chunk_ids,
+        lambda ids: _chunk_contents(DocumentChunk.id.in_(ids)),
+    )
+    return lexical_index
+
+
+def _retrieve(message: str, query_vec) -> List[tuple]:
+    """
+    [(chunk_id, cosine hoặc None)] tốt nhất, tối đa TOP_K.
+
+    Vector: ứng viên có cosine >= SIMILARITY_THRESHOLD. Hybrid: thêm ứng viên
+    BM25 khớp ít nhất HYBRID_MIN_TERM_MATCH số term của query, hai danh sách
+    được fuse bằng reciprocal rank fusion.
+    """
+    if not HYBRID_RETRIEVAL:
+        return get_chunk_index().search(query_vec, k=TOP_K, threshold=SIMILARITY_THRESHOLD)
+
+    vector_hits = get_chunk_index().search(
+        query_vec, k=max(TOP_K, HYBRID_CANDIDATES), threshold=SIMILARITY_THRESHOLD
+    )
+    lexical_hits = get_lexical_index().search(
+        message, k=max(TOP_K, HYBRID_CANDIDATES), min_term_match=HYBRID_MIN_TERM_MATCH
+    )
+    similarity = dict(vector_hits)
+    fused = reciprocal_rank_fusion(
+        [[chunk_id for chunk_id, _ in vector_hits], [chunk_id for chunk_id, _ in lexical_hits]],
+        k=RRF_K,
+    )
+    return [(chunk_id, similarity.get(chunk_id)) for chunk_id, _ in fused[:TOP_K]]
+
+
+def search_embedding(message: str, query_vec: Optional[List[float]] = None):
+    # 1. Lấy embedding của message nhập vào (nếu caller chưa tính)
+    if query_vec is None:
+        query_vec = model_service.get_embedding(message)
+
+    # 2. Tìm top-k trên index trong RAM (cosine >= threshold, fuse với BM25 nếu bật hybrid)
+    hits = _retrieve(message, query_vec)
+
+    # Nếu không có chunk nào ≥ 0.7 (và không chunk nào khớp từ khóa) → trả về message gốc, không context
+    if not hits:
         return [
-            {"role": "system", "content": "Không tìm thấy thông tin liên quan (similarity < 0.7)."},
+            {"role": "system", "content": f"Không tìm thấy thông tin liên quan (similarity < {SIMILARITY_THRESHOLD})."},
             {"role": "user", "content": message}
         ]
 
-    # Sort giảm dần similarity và lấy top 3
-    top_results = sorted(results, key=lambda x: x["similarity"], reverse=True)[:3]
+    # 3. Chỉ lấy content của các chunk thắng
+    contents = dict(
+        db.session.query(DocumentChunk.id, DocumentChunk.content)
+        .filter(DocumentChunk.id.in_([chunk_id for chunk_id, _ in hits]))
+        .all()
+    )
+    top_results = [
+        {"id": chunk_id, "content": contents[chunk_id], "similarity": None if sim is None else round(sim, 4)}
+        for chunk_id, sim in hits
+        if chunk_id in contents
+    ]
 
     context_text = (
         "Dưới đây là các thông tin tham khảo để giúp bạn trả lời câu hỏi, "
@@ -271,7 +769,8 @@ def search_embedding(message: str):
     )
     
     for idx, r in enumerate(top_results, 1):
-        context_text += f"{idx}. {r['content']} (sim={r['similarity']})\n"
+        source = "khớp từ khóa" if r["similarity"] is None else f"sim={r['similarity']}"
+        context_text += f"{idx}. {r['content']} ({source})\n"
 
     messages = [
         {"role": "system", "content": context_text},
@@ -0,0 +1,59 @@
+"""
+Export model của từng loại tàu thành bảng cây NumPy (*.trees.npz).
+
+Chạy từ thư mục gốc của repo, sau đó đặt MODEL_BACKEND=compiled:
+    python -m models.export_trees [--tolerance 1e-4]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from models.testmodel import SCENARIOS
+from services.model_service import ModelService
+from services.tree_engine import CompiledEnsemble
+
+
+def build_check_matrix(n_random: int = 5000, seed: int = 0) -> np.ndarray:
+    """Các SCENARIOS cộng thêm điểm ngẫu nhiên phủ rộng quanh chúng."""
+    base = np.array(list(SCENARIOS.values()), dtype=np.float64)
+    low = base.min(axis=0) * 0.5
+    high = base.max(axis=0) * 1.5
+    rng = np.random.default_rng(seed)
+    return np.vstack([base, rng.uniform(low, high, size=(n_random, base.shape[1]))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    service = ModelService()
+    # So sánh luôn với pickle gốc, kể cả khi MODEL_BACKEND=compiled
+    service.backend = "native"
+    X_check = build_check_matrix()
+    report = service.export_compiled(X_check, tolerance=args.tolerance)
+
+    for ship_type, info in report.items():
+        if "error" in info:
+            print(f"{ship_type:<10s} ❌ {info['error']}")
+            continue
+        print(f"{ship_type:<10s} ✅ {info['source']}: {info['trees']} trees, {info['nodes']} nodes, "
+              f"max |err| = {info['max_abs_error']:.2e} -> {info['path']}")
+
+        # So sánh nhanh thời gian predict trên cùng batch
+        native = service.get_model(ship_type)
+        native_input = service._model_input(native, X_check)
+        engine = CompiledEnsemble.load(service.compiled_path(ship_type))
+        for rows in (1, 100, len(X_check)):
+            start = time.perf_counter()
+            native.predict(native_input[:rows])
+            t_native = time.perf_counter() - start
+            start = time.perf_counter()
+            engine.predict(X_check[:rows])
+            t_compiled = time.perf_counter() - start
+            print(f"{'':<10s} {rows:>6d} rows: native {t_native * 1e3:8.2f} ms | compiled {t_compiled * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Đưa một model đã train vào model store (MODEL_STORE_DIR, mặc định models/store).
+
+Chạy từ thư mục gốc của repo:
+    python -m models.publish_model CETO path/to/ceto_model.pkl [--version v2] [--activate]
+
+Version mới chỉ được dùng khi --activate, hoặc khi loại tàu chưa có version nào.
+Có thể đổi version khi server đang chạy qua POST /chat/models/<ship>/activate.
+"""
+import argparse
+
+from services.model_service import ModelService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ship_type", choices=sorted(ModelService.SHIP_MODEL_MAP), type=str.upper)
+    parser.add_argument("model_path")
+    parser.add_argument("--version")
+    parser.add_argument("--activate", action="store_true")
+    args = parser.parse_args()
+
+    store = ModelService(cache_size=0).store
+    version = store.publish(args.ship_type, args.model_path, version=args.version, activate=args.activate)
+    print(f"Published {args.ship_type} {version} -> {store.root}")
+    print(store.describe(args.ship_type))
+
+
+if __name__ == "__main__":
+    main()
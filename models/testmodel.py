@@ -2,10 +2,6 @@ import joblib
 import pandas as pd
 import os
 
-print("=" * 70)
-print(" LOADING ML MODELS FOR TESTING ")
-print("=" * 70)
-
 # Folder where .pkl files are located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -38,31 +34,41 @@ SCENARIOS = {
 
 # ----------------------------------------------------------------------
 
-for model_name, filename in models.items():
-    path = os.path.join(BASE_DIR, filename)
 
-    print("\n" + "=" * 70)
-    print(f" LOADING MODEL → {model_name}")
+def main():
+    print("=" * 70)
+    print(" LOADING ML MODELS FOR TESTING ")
     print("=" * 70)
 
-    if not os.path.exists(path):
-        print(f"❌ Model NOT FOUND: {path}")
-        continue
+    for model_name, filename in models.items():
+        path = os.path.join(BASE_DIR, filename)
+
+        print("\n" + "=" * 70)
+        print(f" LOADING MODEL → {model_name}")
+        print("=" * 70)
+
+        if not os.path.exists(path):
+            print(f"❌ Model NOT FOUND: {path}")
+            continue
 
-    # Load the ML model
-    model = joblib.load(path)
-    print("✅ Loaded successfully!")
+        # Load the ML model
+        model = joblib.load(path)
+        print("✅ Loaded successfully!")
 
-    print(f"\nTESTING SCENARIOS FOR: {model_name}")
-    print("-" * 70)
-    print(f"{'Scenario':<40s} | Fuel (kg/s)")
-    print("-" * 70)
+        print(f"\nTESTING SCENARIOS FOR: {model_name}")
+        print("-" * 70)
+        print(f"{'Scenario':<40s} | Fuel (kg/s)")
+        print("-" * 70)
+
+        for scenario_name, vals in SCENARIOS.items():
+            df = pd.DataFrame([vals], columns=FEATURES)
+            pred = model.predict(df)[0]
+            print(f"{scenario_name:<40s} | {pred:.4f}")
+
+    print("\n" + "=" * 70)
+    print(" ALL MODELS TESTED ✓")
+    print("=" * 70)
 
-    for scenario_name, vals in SCENARIOS.items():
-        df = pd.DataFrame([vals], columns=FEATURES)
-        pred = model.predict(df)[0]
-        print(f"{scenario_name:<40s} | {pred:.4f}")
 
-print("\n" + "=" * 70)
-print(" ALL MODELS TESTED ✓")
-print("=" * 70)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Admission control trước LM Studio.
+
+Tối đa max_concurrency request chạy cùng lúc; phần còn lại xếp hàng ưu tiên
+(interactive trước batch, cùng mức thì đến trước vào trước) trong một hàng
+đợi có giới hạn. Hàng đầy thì request mới bị từ chối ngay, hoặc đẩy request
+batch đang chờ ra nếu request mới ưu tiên hơn; chờ quá queue_timeout cũng bị
+từ chối. Caller nhận LLMOverloadedError kèm retry_after (giây) ước lượng từ
+thời gian phục vụ trung bình, API trả 503 + Retry-After.
+
+Slot được trao thẳng từ request vừa xong cho waiter kế tiếp qua
+concurrent.futures.Future, nên dùng được từ coroutine trên bất kỳ event loop
+nào.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import math
+import threading
+import time
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+# Số mẫu thời gian chờ giữ lại để tính percentile
+WAIT_SAMPLES = 1024
+
+
+class LLMOverloadedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        # (priority, seq, future); entry đã xong/bị hủy được bỏ qua khi pop
+        self._waiters: List[Tuple[int, int, "concurrent.futures.Future[bool]"]] = []
+        self._queued: Dict[int, int] = collections.Counter()
+        self._seq = itertools.count()
+        self._waits: Deque[float] = collections.deque(maxlen=WAIT_SAMPLES)
+        self._service_seconds = 0.0     # EWMA thời gian giữ slot
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.timeouts = 0
+
+    # --- Ước lượng Retry-After ---
+    def retry_after(self) -> int:
+        depth = sum(self._queued.values())
+        service = self._service_seconds or 1.0
+        return max(1, math.ceil(service * (depth + 1) / self.max_concurrency))
+
+    def _overloaded(self, reason: str) -> LLMOverloadedError:
+        return LLMOverloadedError(f"LLM overloaded: {reason}", self.retry_after())
+
+    # --- Vào / ra ---
+    def _enqueue(self, priority: int) -> Optional["concurrent.futures.Future[bool]"]:
+        """None nếu có slot ngay; ngược lại Future được set khi tới lượt."""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queued_total():
+                self._active += 1
+                return None
+            if self._queued_total() >= self.max_queue and not self._evict_for(priority):
+                self.rejected += 1
+                raise self._overloaded("queue full")
+            future: "concurrent.futures.Future[bool]" = concurrent.futures.Future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+            self._queued[priority] += 1
+            return future
+
+    def _queued_total(self) -> int:
+        return sum(self._queued.values())
+
+    def _evict_for(self, priority: int) -> bool:
+        """Đẩy waiter kém ưu tiên nhất (đến sau cùng) nếu nó kém hơn priority."""
+        worst = None
+        for entry in self._waiters:
+            if entry[2].done():
+                continue
+            if worst is None or (entry[0], entry[1]) > (worst[0], worst[1]):
+                worst = entry
+        if worst is None or worst[0] <= priority:
+            return False
+        self._queued[worst[0]] -= 1
+        self.evicted += 1
+        worst[2].set_exception(self._overloaded("preempted by higher-priority request"))
+        return True
+
+    def _release(self, held_seconds: float) -> None:
+        with self._lock:
+            alpha = 0.2
+            self._service_seconds = (
+                held_seconds if not self._service_seconds
+                else (1 - alpha) * self._service_seconds + alpha * held_seconds
+            )
+            while self._waiters:
+                priority, _, future = heapq.heappop(self._waiters)
+                if future.done():
+                    continue
+                self._queued[priority] -= 1
+                future.set_result(True)  # slot chuyển thẳng cho waiter, _active giữ nguyên
+                return
+            self._active -= 1
+
+    async def _acquire_async(self, priority: int) -> None:
+        start = time.monotonic()
+        future = self._enqueue(priority)
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.queue_timeout)
+            except BaseException as e:
+                with self._lock:
+                    withdrawn = future.cancel()
+                    if withdrawn:
+                        self._queued[priority] -= 1
+                if not withdrawn and future.exception() is None:
+                    # Slot được trao đúng lúc hết giờ / bị hủy
+                    if isinstance(e, asyncio.TimeoutError):
+                        self._record_wait(start)
+                        return
+                    self._release(0.0)
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    if withdrawn:
+                        self.timeouts += 1
+                        raise self._overloaded(f"waited more than {self.queue_timeout}s") from None
+                    raise future.exception() from None
+                raise
+        self._record_wait(start)
+
+    def _record_wait(self, start: float) -> None:
+        with self._lock:
+            self.admitted += 1
+            self._waits.append(time.monotonic() - start)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+        """Giữ một slot trong suốt khối async with."""
+        await self._acquire_async(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = np.array(self._waits) * 1e3 if self._waits else None
+            queued = {PRIORITY_NAMES.get(p, str(p)): n for p, n in self._queued.items()}
+            return {
+                "max_concurrency": self.max_concurrency,
+                "active": self._active,
+                "queue_depth": sum(queued.values()),
+                "queued": queued,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "evicted": self.evicted,
+                "timeouts": self.timeouts,
+                "wait_ms": {
+                    "p50": float(np.percentile(waits, 50)) if waits is not None else 0.0,
+                    "p95": float(np.percentile(waits, 95)) if waits is not None else 0.0,
+                    "max": float(waits.max()) if waits is not None else 0.0,
+                },
+                "avg_service_ms": round(self._service_seconds * 1e3, 1),
+                "retry_after_seconds": self.retry_after(),
+            }
@@ -0,0 +1,198 @@
+"""
+Chia tài liệu lớn thành chunk theo kiểu streaming để ingest vào fluxmare_chunks.
+
+Văn bản được đọc từng block từ stream nhị phân, cắt thành chunk tối đa
+max_tokens token với overlap_tokens token gối đầu, ưu tiên cắt ở cuối câu
+hoặc đoạn. Token được ước lượng bằng regex (từ / dấu câu) nên không cần
+tokenizer của model embedding. Bộ nhớ chỉ phụ thuộc kích thước block và chunk,
+không phụ thuộc độ dài tài liệu.
+"""
+import codecs
+import hashlib
+import itertools
+import queue
+import re
+import threading
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+READ_BLOCK_BYTES = 64 * 1024
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+SENTENCE_END = {".", "!", "?", "…", ";"}
+
+
+class TextChunk(NamedTuple):
+    index: int          # thứ tự chunk trong tài liệu
+    offset: int         # vị trí ký tự bắt đầu trong tài liệu
+    content: str
+    tokens: int
+    content_hash: str
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_text(stream: IO[bytes], encoding: str = "utf-8", block_size: int = READ_BLOCK_BYTES) -> Iterator[str]:
+    """Đọc stream nhị phân thành các đoạn text; ký tự nhiều byte bị cắt giữa block vẫn đúng."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    first = True
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if first:
+            text = text.lstrip("\ufeff")
+            first = False
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _cut_point(buf: str, spans: List[tuple], min_cut: int) -> int:
+    """Số token của chunk: sau dấu kết câu hoặc trước dòng trống cuối cùng trong cửa sổ."""
+    for i in range(len(spans) - 1, min_cut - 1, -1):
+        start, end = spans[i]
+        if buf[start:end] in SENTENCE_END:
+            return i + 1
+        if i + 1 < len(spans) and "\n\n" in buf[end:spans[i + 1][0]]:
+            return i + 1
+    return len(spans)
+
+
+def chunk_text(pieces: Iterable[str], max_tokens: int = 256, overlap_tokens: int = 32) -> Iterator[TextChunk]:
+    """Generator chunk có overlap từ các đoạn text liên tiếp."""
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens - 1))
+
+    buf = ""
+    base = 0        # offset của buf[0] trong tài liệu
+    index = 0
+    pieces = iter(pieces)
+    eof = False
+
+    while True:
+        if not eof:
+            piece = next(pieces, None)
+            if piece is None:
+                eof = True
+            else:
+                buf += piece
+
+        while True:
+            spans = [m.span() for m in itertools.islice(TOKEN_RE.finditer(buf), max_tokens + 1)]
+            if not eof:
+                # Token cuối có thể còn tiếp ở đoạn sau
+                if len(spans) <= max_tokens:
+                    break
+            elif not spans:
+                break
+
+            window = spans[:max_tokens]
+            if eof and len(spans) <= max_tokens:
+                cut = len(window)
+            else:
+                cut = _cut_point(buf, window, max(1, max_tokens // 2))
+
+            start, end = window[0][0], window[cut - 1][1]
+            text = buf[start:end]
+            yield TextChunk(index, base + start, text, cut, content_hash(text))
+            index += 1
+
+            if cut >= len(spans):
+                buf, base = buf[end:], base + end
+                break
+            # Chunk sau bắt đầu lùi lại overlap_tokens token (luôn tiến ít nhất 1 token)
+            drop = spans[max(cut - overlap_tokens, 1)][0]
+            buf, base = buf[drop:], base + drop
+
+        if eof:
+            return
+
+
+class EmbeddedBatch(NamedTuple):
+    chunks: List[TextChunk]
+    vectors: List[Any]      # embedding, hoặc Exception nếu item đó lỗi
+    skipped: int            # số chunk bị bỏ qua (hash đã có) kể từ batch trước
+
+
+_DONE = object()
+
+
+def embed_in_background(
+    chunks: Iterable[TextChunk],
+    embed: Callable[[List[str]], List[Any]],
+    batch_size: int = 64,
+    skip_hashes: Optional[Set[str]] = None,
+    queue_size: int = 2,
+) -> Iterator[EmbeddedBatch]:
+    """
+    Đọc chunk + gọi embedding trên một thread riêng, trả batch qua hàng đợi có
+    giới hạn; thread gọi (ghi DB) xử lý batch trước trong khi batch sau đang
+    được embedding. Lỗi của thread nền được raise lại ở thread gọi.
+    """
+    results: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+    stop = threading.Event()
+    skip_hashes = skip_hashes or set()
+
+    def _put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker() -> None:
+        try:
+            batch: List[TextChunk] = []
+            skipped = 0
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                if chunk.content_hash in skip_hashes:
+                    skipped += 1
+                    continue
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    if not _put(EmbeddedBatch(batch, embed([c.content for c in batch]), skipped)):
+                        return
+                    batch, skipped = [], 0
+            if batch or skipped:
+                vectors = embed([c.content for c in batch]) if batch else []
+                if not _put(EmbeddedBatch(batch, vectors, skipped)):
+                    return
+            _put(_DONE)
+        except BaseException as e:
+            _put(e)
+
+    thread = threading.Thread(target=_worker, name="embed-pipeline", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+
+def chunk_meta(chunk: TextChunk, document_id: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    meta = dict(extra or {})
+    meta.update({
+        "document_id": document_id,
+        "offset": chunk.offset,
+        "chunk_index": chunk.index,
+        "tokens": chunk.tokens,
+        "content_hash": chunk.content_hash,
+    })
+    return meta
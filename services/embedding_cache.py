@@ -0,0 +1,109 @@
+"""
+Cache embedding hai tầng: LRU trong process phía trước một store bền vững
+(bảng embedding_cache, do core inject vào).
+
+Key là sha256(model + text) nên đổi EMBEDDING_MODEL thì key cũ không bao giờ
+khớp; khi phát hiện model đổi, LRU được xóa và store dọn các dòng của model cũ.
+"""
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from services.cache import LRUCache
+
+
+def embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, maxsize: int, store: Optional[Any] = None):
+        self.memory = LRUCache(maxsize)
+        # store cần có get_many(keys) -> {key: vector},
+        # put_many(model, {key: vector}) và purge_except(model)
+        self.store = store
+        self.model: Optional[str] = None
+        self._lock = threading.Lock()
+        self.store_hits = 0
+        self.store_misses = 0
+        self.store_errors = 0
+
+    def attach_store(self, store: Any) -> None:
+        with self._lock:
+            self.store = store
+            self.model = None  # dọn model cũ trong store ở lần dùng kế tiếp
+
+    def _check_model(self, model: str) -> None:
+        if model == self.model:
+            return
+        with self._lock:
+            if model == self.model:
+                return
+            if self.model is not None:
+                print(f"Embedding model changed {self.model} -> {model}, clearing embedding cache")
+                self.memory.clear()
+            self.model = model
+            store = self.store
+        if store is not None:
+            try:
+                removed = store.purge_except(model)
+                if removed:
+                    print(f"Purged {removed} cached embeddings of other models")
+            except Exception as e:
+                self.store_errors += 1
+                print(f"Embedding store purge failed: {e}")
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Embedding đã cache theo thứ tự texts; None ở vị trí chưa có."""
+        self._check_model(model)
+        keys = [embedding_key(model, text) for text in texts]
+        found: List[Optional[List[float]]] = [self.memory.get(key) for key in keys]
+
+        missing = {keys[i] for i, vector in enumerate(found) if vector is None}
+        if missing and self.store is not None:
+            try:
+                stored: Dict[str, List[float]] = self.store.get_many(list(missing))
+            except Exception as e:
+                self.store_errors += 1
+                print(f"Embedding store read failed: {e}")
+                stored = {}
+            self.store_hits += len(stored)
+            self.store_misses += len(missing) - len(stored)
+            for i, key in enumerate(keys):
+                if found[i] is None and key in stored:
+                    found[i] = stored[key]
+                    self.memory.put(key, stored[key])
+        return found
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[List[float]]) -> None:
+        self._check_model(model)
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            key = embedding_key(model, text)
+            self.memory.put(key, vector)
+            entries[key] = vector
+        if entries and self.store is not None:
+            try:
+                self.store.put_many(model, entries)
+            except Exception as e:
+                self.store_errors += 1
+                print(f"Embedding store write failed: {e}")
+
+    def clear(self) -> None:
+        self.memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.store_hits
+        return {
+            "model": self.model,
+            "memory": memory,
+            "store": {
+                "enabled": self.store is not None,
+                "hits": self.store_hits,
+                "misses": self.store_misses,
+                "errors": self.store_errors,
+            },
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
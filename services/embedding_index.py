@@ -0,0 +1,414 @@
+"""
+Index embedding trong RAM cho retrieval.
+
+Toàn bộ embedding được giữ thành một ma trận float32 đã chuẩn hóa L2 cùng
+mảng id song song; cosine similarity của cả bảng chỉ là một phép nhân
+ma trận-vector, top-k lấy bằng argpartition. Với kho lớn, chọn
+RETRIEVAL_BACKEND=int8 (ma trận int8 + rescore float32) hoặc ivf (ANN, xem
+services/ivf_index.py).
+
+Index được cập nhật tăng dần:
+  - add(): chunk mới vào một vùng delta nhỏ (quét exact), định kỳ gộp vào
+    ma trận chính
+  - remove(): đánh dấu tombstone, bỏ qua lúc search, dọn khi gộp
+  - sync(): worker khác bắt kịp DB nhờ watermark (count, max id) thay vì
+    đọc lại cả bảng
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from services.env import get_env_bool, get_env_float, get_env_int
+from services.index_sync import WatermarkSync
+from services.vector_codec import quantize_rows
+
+
+# Gộp delta vào ma trận chính khi vượt số dòng này hoặc tỉ lệ tombstone này
+MERGE_DELTA_ROWS = 4096
+MERGE_TOMBSTONE_RATIO = 0.1
+
+# Số dòng int8 đổi sang float32 mỗi lần khi tính score (giới hạn bộ nhớ tạm)
+INT8_SCORE_BLOCK_ROWS = 8192
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa L2 từng dòng; dòng toàn 0 giữ nguyên (similarity = 0)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def top_k(scores: np.ndarray, k: int, threshold: Optional[float] = None) -> np.ndarray:
+    """Vị trí của k điểm cao nhất (>= threshold), sắp giảm dần."""
+    candidates = np.arange(scores.shape[0])
+    if threshold is not None:
+        candidates = np.flatnonzero(scores >= threshold)
+    if candidates.size > k:
+        part = np.argpartition(-scores[candidates], k - 1)[:k]
+        candidates = candidates[part]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def prepare_rows(
+    ids: Sequence[int],
+    vectors: Iterable[Sequence[float]],
+    dim: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids int64, ma trận float32 đã chuẩn hóa); bỏ embedding rỗng hoặc lệch số chiều."""
+    ids_list: List[int] = []
+    rows: List[Sequence[float]] = []
+    for chunk_id, vector in zip(ids, vectors):
+        if vector is None:
+            continue
+        if dim is None:
+            dim = len(vector)
+        if len(vector) != dim:
+            print(f"Skipping chunk {chunk_id}: embedding dim {len(vector)} != {dim}")
+            continue
+        ids_list.append(chunk_id)
+        rows.append(vector)
+
+    if rows:
+        matrix = normalize_rows(np.asarray(rows, dtype=np.float32))
+    else:
+        matrix = np.empty((0, dim or 0), dtype=np.float32)
+    return np.asarray(ids_list, dtype=np.int64), matrix
+
+
+def normalize_query(query: Sequence[float], dim: int) -> Optional[np.ndarray]:
+    q = np.asarray(query, dtype=np.float32)
+    if q.shape[0] != dim:
+        raise ValueError(f"Query dim {q.shape[0]} != index dim {dim}")
+    norm = np.linalg.norm(q)
+    if norm == 0:
+        return None
+    return q / norm
+
+
+class IndexState(NamedTuple):
+    """Snapshot bất biến; writer thay cả object nên reader không cần lock."""
+    main: Tuple[np.ndarray, ...]   # dữ liệu của backend (exact: (ids, matrix))
+    alive: Optional[np.ndarray]    # mask bool trên các dòng của main, None = còn hết
+    delta_ids: np.ndarray
+    delta_matrix: np.ndarray
+    dead: frozenset                # id bị xóa (hoặc bị thay) nhưng vẫn nằm trong main
+
+
+class EmbeddingIndex(WatermarkSync):
+    def __init__(self):
+        self._state = IndexState(self._empty(), None, *prepare_rows([], []), frozenset())
+        self._build_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self.loaded = False
+        # Watermark [count, max_id] của DB mà index đã phản ánh
+        self.watermark: Optional[List[int]] = None
+        self._last_poll = 0.0
+
+    # --- Phần riêng của backend exact (IVF override) ---
+    @staticmethod
+    def _empty() -> Tuple[np.ndarray, ...]:
+        return (np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+
+    @staticmethod
+    def _main_ids(main: Tuple[np.ndarray, ...]) -> np.ndarray:
+        return main[0]
+
+    @staticmethod
+    def _main_matrix(main: Tuple[np.ndarray, ...]) -> np.ndarray:
+        return main[1]
+
+    def _build_main(self, ids: np.ndarray, matrix: np.ndarray) -> Tuple[np.ndarray, ...]:
+        return (ids, matrix)
+
+    def _score_main(self, main: Tuple[np.ndarray, ...], q: np.ndarray, **kwargs: Any) -> Tuple[np.ndarray, np.ndarray]:
+        """(vị trí dòng trong main, score) của các ứng viên."""
+        scores = main[1] @ q
+        return np.arange(scores.shape[0]), scores
+
+    def _merge_main(
+        self, main: Tuple[np.ndarray, ...], keep: np.ndarray, ids: np.ndarray, matrix: np.ndarray
+    ) -> Tuple[np.ndarray, ...]:
+        """main mới = các dòng keep của main + (ids, matrix)."""
+        if not main[0].size:
+            return (ids, matrix)
+        return (np.concatenate((main[0][keep], ids)), np.concatenate((main[1][keep], matrix)))
+
+    # --- Thông tin ---
+    def __len__(self) -> int:
+        state = self._state
+        return len(self._main_ids(state.main)) - len(state.dead) + len(state.delta_ids)
+
+    @property
+    def dim(self) -> int:
+        state = self._state
+        matrix = self._main_matrix(state.main)
+        return int(matrix.shape[1] if matrix.shape[0] else state.delta_matrix.shape[1])
+
+    def ids(self) -> Set[int]:
+        state = self._state
+        live = set(self._main_ids(state.main).tolist()) - state.dead
+        live.update(state.delta_ids.tolist())
+        return live
+
+    def stats(self) -> dict:
+        state = self._state
+        return {
+            "backend": type(self).__name__,
+            "loaded": self.loaded,
+            "size": len(self),
+            "delta": int(state.delta_ids.shape[0]),
+            "tombstones": len(state.dead),
+            "watermark": self.watermark,
+        }
+
+    # --- Build toàn bộ ---
+    def build(self, ids: Sequence[int], vectors: Iterable[Sequence[float]]) -> None:
+        ids_arr, matrix = prepare_rows(ids, vectors)
+        self.build_from_matrix(ids_arr, matrix)
+
+    def build_from_matrix(self, ids: np.ndarray, matrix: np.ndarray) -> None:
+        """Build từ ma trận float32 đã chuẩn hóa."""
+        main = self._build_main(ids, matrix) if ids.shape[0] else self._empty()
+        with self._write_lock:
+            self._state = IndexState(main, None, *prepare_rows([], [], matrix.shape[1]), frozenset())
+            self._max_id = int(ids.max()) if ids.shape[0] else 0
+            self._skipped = frozenset()
+        self.loaded = True
+
+    def ensure_loaded(
+        self,
+        loader: Callable[[], Tuple[Sequence[int], Iterable[Sequence[float]]]],
+        fingerprint: Optional[Callable[[], Any]] = None,
+    ) -> "EmbeddingIndex":
+        """
+        Build index bằng loader ở lần dùng đầu tiên (hoặc sau invalidate).
+
+        fingerprint() trả về watermark [count, max_id] của nguồn dữ liệu;
+        backend có lưu đĩa mở lại bản đã lưu rồi bắt kịp bằng sync().
+        """
+        if self.loaded:
+            return self
+        with self._build_lock:
+            if not self.loaded:
+                current = fingerprint() if fingerprint is not None else None
+                if current is None or not self._load_persisted(current):
+                    ids, vectors = loader()
+                    self.build(ids, vectors)
+                    self.watermark = current
+                    if current is not None:
+                        self._persist(current)
+                # Bản lưu trên đĩa cũ hơn DB -> sync ngay ở lần gọi kế tiếp
+                self._last_poll = time.monotonic() if self.watermark == current else 0.0
+        return self
+
+    # Backend lưu đĩa (IVF) override hai hook này
+    def _load_persisted(self, fingerprint: Any) -> bool:
+        return False
+
+    def _persist(self, fingerprint: Any) -> None:
+        pass
+
+    def _after_merge(self) -> None:
+        pass
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+    # --- Cập nhật tăng dần ---
+    def add(self, ids: Sequence[int], vectors: Iterable[Sequence[float]]) -> int:
+        """Thêm (hoặc thay) chunk vào index đang chạy; trả về số dòng đã thêm."""
+        if not self.loaded:
+            return 0  # lần search đầu tiên sẽ build đầy đủ
+        with self._write_lock:
+            state = self._state
+            new_ids, new_matrix = prepare_rows(ids, vectors, self.dim or None)
+            if new_ids.size == 0:
+                return 0
+            keep = ~np.isin(state.delta_ids, new_ids)
+            delta_ids = np.concatenate((state.delta_ids[keep], new_ids))
+            if state.delta_matrix.shape[0]:
+                delta_matrix = np.concatenate((state.delta_matrix[keep], new_matrix))
+            else:
+                delta_matrix = new_matrix
+            # Bản cũ của id bị thay nằm trong main -> tombstone
+            alive, dead = self._tombstone(state, set(new_ids.tolist()))
+            self._state = IndexState(state.main, alive, delta_ids, delta_matrix, dead)
+            self._maybe_merge()
+        return int(new_ids.size)
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Tombstone các chunk đã xóa; trả về số id thực sự có trong index."""
+        if not self.loaded:
+            return 0
+        with self._write_lock:
+            state = self._state
+            targets = set(int(i) for i in ids)
+            in_delta = np.isin(state.delta_ids, list(targets))
+            in_main = (targets & set(self._main_ids(state.main).tolist())) - state.dead
+            if not in_main and not in_delta.any():
+                return 0
+            alive, dead = self._tombstone(state, in_main)
+            self._state = IndexState(
+                state.main, alive, state.delta_ids[~in_delta], state.delta_matrix[~in_delta], dead
+            )
+            self._maybe_merge()
+            return len(in_main) + int(in_delta.sum())
+
+    def _tombstone(self, state: IndexState, targets: Set[int]) -> Tuple[Optional[np.ndarray], frozenset]:
+        main_ids = self._main_ids(state.main)
+        targets = targets - state.dead
+        if not targets or not main_ids.size:
+            return state.alive, state.dead
+        hit = np.isin(main_ids, list(targets))
+        if not hit.any():
+            return state.alive, state.dead
+        alive = ~hit if state.alive is None else state.alive & ~hit
+        return alive, state.dead | frozenset(main_ids[hit].tolist())
+
+    def _maybe_merge(self) -> None:
+        # Gọi khi đang giữ _write_lock
+        state = self._state
+        main_rows = len(self._main_ids(state.main))
+        if state.delta_ids.shape[0] < MERGE_DELTA_ROWS and len(state.dead) <= MERGE_TOMBSTONE_RATIO * max(main_rows, 1):
+            return
+        dim = self.dim
+        keep = state.alive if state.alive is not None else np.ones(main_rows, dtype=bool)
+        if keep.sum() + state.delta_ids.shape[0] == 0:
+            main = self._empty()
+        else:
+            main = self._merge_main(state.main, keep, state.delta_ids, state.delta_matrix)
+        self._state = IndexState(main, None, *prepare_rows([], [], dim), frozenset())
+        self._after_merge()
+
+    # --- Search ---
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 3,
+        threshold: Optional[float] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[int, float]]:
+        """[(chunk_id, cosine similarity)] của tối đa k chunk gần nhất."""
+        state = self._state
+        main_ids = self._main_ids(state.main)
+        if main_ids.size == 0 and state.delta_ids.size == 0:
+            return []
+        q = normalize_query(query, self.dim)
+        if q is None:
+            return []
+
+        cand_ids: List[np.ndarray] = []
+        cand_scores: List[np.ndarray] = []
+        if main_ids.size:
+            positions, scores = self._score_main(state.main, q, **kwargs)
+            if state.alive is not None:
+                live = state.alive[positions]
+                positions, scores = positions[live], scores[live]
+            cand_ids.append(main_ids[positions])
+            cand_scores.append(scores)
+        if state.delta_ids.size:
+            cand_ids.append(state.delta_ids)
+            cand_scores.append(state.delta_matrix @ q)
+
+        all_ids = np.concatenate(cand_ids)
+        all_scores = np.concatenate(cand_scores)
+        winners = top_k(all_scores, k, threshold)
+        return [(int(all_ids[i]), float(all_scores[i])) for i in winners]
+
+
+class Int8Index(EmbeddingIndex):
+    """
+    Index exact giữ ma trận int8 (1/4 bộ nhớ float32) với scale theo từng dòng.
+
+    Score int8 chỉ dùng để chọn rescore_factor * k ứng viên; rescore(ids)
+    trả về embedding float32 của các ứng viên (ví dụ đọc cột embedding_f32)
+    để xếp hạng và áp ngưỡng bằng cosine chính xác.
+    """
+
+    def __init__(self, rescore: Optional[Callable[[List[int]], Dict[int, Any]]] = None, rescore_factor: int = 4):
+        super().__init__()
+        self.rescore = rescore
+        self.rescore_factor = max(1, rescore_factor)
+
+    @staticmethod
+    def _empty() -> Tuple[np.ndarray, ...]:
+        return (np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.int8), np.empty(0, dtype=np.float32))
+
+    def _build_main(self, ids: np.ndarray, matrix: np.ndarray) -> Tuple[np.ndarray, ...]:
+        return (ids, *quantize_rows(matrix))
+
+    def _score_main(self, main: Tuple[np.ndarray, ...], q: np.ndarray, **kwargs: Any) -> Tuple[np.ndarray, np.ndarray]:
+        ids, quantized, scales = main
+        scores = np.empty(ids.shape[0], dtype=np.float32)
+        for start in range(0, ids.shape[0], INT8_SCORE_BLOCK_ROWS):
+            block = quantized[start:start + INT8_SCORE_BLOCK_ROWS]
+            scores[start:start + block.shape[0]] = block.astype(np.float32) @ q
+        scores *= scales
+        return np.arange(ids.shape[0]), scores
+
+    def _merge_main(
+        self, main: Tuple[np.ndarray, ...], keep: np.ndarray, ids: np.ndarray, matrix: np.ndarray
+    ) -> Tuple[np.ndarray, ...]:
+        new_q, new_scales = quantize_rows(matrix)
+        if not main[0].size:
+            return (ids, new_q, new_scales)
+        return (
+            np.concatenate((main[0][keep], ids)),
+            np.concatenate((main[1][keep], new_q)),
+            np.concatenate((main[2][keep], new_scales)),
+        )
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 3,
+        threshold: Optional[float] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[int, float]]:
+        if self.rescore is None:
+            return super().search(query, k, threshold, **kwargs)
+        candidates = super().search(query, k * self.rescore_factor, None, **kwargs)
+        if not candidates:
+            return []
+        q = normalize_query(query, self.dim)
+        vectors = self.rescore([chunk_id for chunk_id, _ in candidates])
+        ids = np.array([chunk_id for chunk_id, _ in candidates], dtype=np.int64)
+        scores = np.array([score for _, score in candidates], dtype=np.float32)
+        for i, chunk_id in enumerate(ids.tolist()):
+            vector = vectors.get(chunk_id)
+            if vector is not None:
+                v = np.asarray(vector, dtype=np.float32)
+                norm = np.linalg.norm(v)
+                scores[i] = float(v @ q / norm) if norm else 0.0
+        winners = top_k(scores, k, threshold)
+        return [(int(ids[i]), float(scores[i])) for i in winners]
+
+
+def create_index(
+    backend: Optional[str] = None,
+    rescore: Optional[Callable[[List[int]], Dict[int, Any]]] = None,
+) -> EmbeddingIndex:
+    """Tạo index theo RETRIEVAL_BACKEND: "exact" (mặc định), "int8" hoặc "ivf"."""
+    backend = (backend or os.getenv("RETRIEVAL_BACKEND", "exact")).strip().lower()
+    if backend == "exact":
+        return EmbeddingIndex()
+    if backend == "int8":
+        return Int8Index(rescore=rescore, rescore_factor=get_env_int("INT8_RESCORE_FACTOR", 4))
+    if backend == "ivf":
+        from services.ivf_index import IVFIndex
+
+        return IVFIndex(
+            root=os.getenv("CHUNK_INDEX_DIR", "data/chunk_index"),
+            nlist=get_env_int("IVF_NLIST", 0),
+            nprobe=get_env_int("IVF_NPROBE", 8),
+            use_mmap=get_env_bool("CHUNK_INDEX_MMAP", True),
+            persist_seconds=get_env_float("CHUNK_INDEX_PERSIST_SECONDS", 600.0),
+        )
+    raise ValueError(f"Unknown RETRIEVAL_BACKEND: {backend!r}")
+
+
+def index_poll_seconds() -> float:
+    return get_env_float("CHUNK_INDEX_POLL_SECONDS", 5.0)
@@ -0,0 +1,264 @@
+"""
+Index trong RAM cho câu trả lời mẫu (llm_role_examples).
+
+  - exact: dict text đã chuẩn hóa (chữ thường, bỏ dấu câu, gộp khoảng trắng)
+    -> ví dụ; tra cứu O(1)
+  - fuzzy: inverted index trigram (kiểu pg_trgm, trên text đã bỏ dấu) ->
+    ví dụ; similarity Jaccard giữa tập trigram của câu hỏi và user_prompt,
+    chỉ nhận khi >= threshold
+  - semantic: ma trận float32 đã chuẩn hóa của embedding user_prompt; một
+    phép nhân ma trận-vector với embedding của câu hỏi (chính vector dùng cho
+    retrieval chunk), chỉ nhận khi cosine >= semantic_threshold
+
+Bảng nhỏ nên khi watermark [count, max_id, tổng độ dài] đổi thì build lại
+toàn bộ; state được thay nguyên khối nên lookup không cần khóa.
+
+Exact/fuzzy có ngay sau build. Ví dụ chưa có embedding được embed trên một
+thread nền (không giữ _build_lock trong lúc gọi HTTP) rồi ghép vào ma trận;
+lỗi thì chờ lâu dần (EMBED_RETRY_SECONDS, nhân đôi tới EMBED_RETRY_MAX_SECONDS)
+mới thử lại.
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.embedding_index import normalize_query, prepare_rows
+from services.lexical_index import fold_diacritics
+
+# Backoff khi embedding service lỗi
+EMBED_RETRY_SECONDS = 30.0
+EMBED_RETRY_MAX_SECONDS = 900.0
+
+PUNCT_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return SPACE_RE.sub(" ", PUNCT_RE.sub(" ", text)).strip()
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Trigram theo từng từ, đệm 2 khoảng trắng đầu và 1 cuối như pg_trgm."""
+    grams = set()
+    for word in fold_diacritics(normalize_text(text)).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class ExampleMatch(NamedTuple):
+    id: int
+    response: str
+    score: float        # 1.0 cho exact match, similarity trigram cho fuzzy, cosine cho semantic
+
+
+class _State(NamedTuple):
+    exact: Dict[str, Tuple[int, str]]
+    postings: Dict[str, List[int]]          # trigram -> vị trí ví dụ
+    sizes: List[int]                        # số trigram của từng ví dụ
+    examples: List[Tuple[int, str]]         # (id, assistant_response)
+    positions: np.ndarray                   # dòng của matrix -> vị trí ví dụ
+    matrix: np.ndarray                      # embedding user_prompt đã chuẩn hóa
+    pending: List[Tuple[int, str]]          # (vị trí, user_prompt) chưa có embedding
+
+
+_EMPTY = _State({}, {}, [], [], np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), [])
+
+
+class ExampleIndex:
+    def __init__(self, threshold: float = 0.6, semantic_threshold: float = 0.9):
+        self.threshold = threshold
+        self.semantic_threshold = semantic_threshold
+        self._state = _EMPTY
+        self._build_lock = threading.Lock()
+        self.loaded = False
+        self.watermark: Optional[List[int]] = None
+        self._last_poll = 0.0
+        self.lookups = 0
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.semantic_lookups = 0
+        self.semantic_hits = 0
+        # Embedding nền: đang chạy, thời điểm được thử lại, backoff hiện tại
+        self._embedding = False
+        self._embed_retry_at = 0.0
+        self._embed_backoff = 0.0
+        self.embed_failures = 0
+
+    def __len__(self) -> int:
+        return len(self._state.examples)
+
+    @property
+    def unembedded(self) -> int:
+        return len(self._state.pending)
+
+    def build(self, rows: Iterable[Tuple[int, str, str, Optional[Sequence[float]]]]) -> None:
+        """
+        rows: (id, user_prompt, assistant_response, embedding hoặc None),
+        id tăng dần (id nhỏ thắng khi trùng).
+        """
+        exact: Dict[str, Tuple[int, str]] = {}
+        postings: Dict[str, List[int]] = {}
+        sizes: List[int] = []
+        examples: List[Tuple[int, str]] = []
+        vectors: List[Any] = []
+        pending: List[Tuple[int, str]] = []
+        for example_id, prompt, response, vector in rows:
+            exact.setdefault(normalize_text(prompt), (example_id, response))
+            grams = trigrams(prompt)
+            position = len(examples)
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+            sizes.append(len(grams))
+            examples.append((example_id, response))
+            vectors.append(vector)
+            if vector is None:
+                pending.append((position, prompt))
+        positions, matrix = prepare_rows(range(len(examples)), vectors)
+        self._state = _State(exact, postings, sizes, examples, positions, matrix, pending)
+        self.loaded = True
+
+    # --- Embedding nền cho ví dụ còn thiếu ---
+    def _schedule_embedding(self, embed: Callable[[List[Tuple[int, str]]], List[Sequence[float]]]) -> None:
+        # Caller giữ _build_lock
+        state = self._state
+        if not state.pending or self._embedding or time.monotonic() < self._embed_retry_at:
+            return
+        self._embedding = True
+        pending = [(state.examples[position][0], prompt) for position, prompt in state.pending]
+        threading.Thread(target=self._embed_pending, args=(state, pending, embed), daemon=True).start()
+
+    def _embed_pending(self, state: _State, pending: List[Tuple[int, str]], embed: Callable) -> None:
+        try:
+            vectors = embed(pending)
+        except Exception as e:
+            with self._build_lock:
+                self._embedding = False
+                self.embed_failures += 1
+                self._embed_backoff = min(max(self._embed_backoff * 2, EMBED_RETRY_SECONDS), EMBED_RETRY_MAX_SECONDS)
+                self._embed_retry_at = time.monotonic() + self._embed_backoff
+            print(f"[WARN] Failed to embed {len(pending)} example prompts ({e}), retry in {self._embed_backoff:.0f}s")
+            return
+
+        with self._build_lock:
+            self._embedding = False
+            self._embed_backoff = 0.0
+            self._embed_retry_at = 0.0
+            if self._state is not state:
+                return  # đã build lại trong lúc chờ; vector đã lưu DB sẽ được đọc ở build đó/kế tiếp
+            done = [position for position, _ in state.pending]
+            new_positions, new_matrix = prepare_rows(done, vectors, state.matrix.shape[1] or None)
+            if state.positions.size:
+                positions = np.concatenate((state.positions, new_positions))
+                matrix = np.concatenate((state.matrix, new_matrix))
+            else:
+                positions, matrix = new_positions, new_matrix
+            embedded = set(new_positions.tolist())
+            remaining = [item for item in state.pending if item[0] not in embedded]
+            self._state = state._replace(positions=positions, matrix=matrix, pending=remaining)
+        print(f"[✓] Embedded {len(embedded)} example prompts")
+
+    def refresh(
+        self,
+        poll_seconds: float,
+        fingerprint: Callable[[], List[int]],
+        loader: Callable[[], Iterable[Tuple[int, str, str, Optional[Sequence[float]]]]],
+        embed: Optional[Callable[[List[Tuple[int, str]]], List[Sequence[float]]]] = None,
+    ) -> bool:
+        """
+        Build lại khi watermark của bảng đổi; kiểm tra tối đa mỗi poll_seconds.
+
+        embed([(id, user_prompt)]) -> embeddings (và tự lưu lại) chạy trên thread
+        nền cho các ví dụ chưa có embedding, theo backoff khi lỗi.
+        """
+        now = time.monotonic()
+        if self.loaded and poll_seconds > 0 and now - self._last_poll < poll_seconds:
+            return False
+        with self._build_lock:
+            if self.loaded and poll_seconds > 0 and now - self._last_poll < poll_seconds:
+                return False
+            self._last_poll = now
+            current = list(fingerprint())
+            rebuilt = not self.loaded or current != self.watermark
+            if rebuilt:
+                self.build(loader())
+                self.watermark = current
+            if embed is not None:
+                self._schedule_embedding(embed)
+        if rebuilt:
+            print(f"Example index rebuilt: {len(self)} examples")
+        return rebuilt
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+    def match(self, message: str) -> Optional[ExampleMatch]:
+        state = self._state
+        self.lookups += 1
+        hit = state.exact.get(normalize_text(message))
+        if hit is not None:
+            self.exact_hits += 1
+            return ExampleMatch(hit[0], hit[1], 1.0)
+
+        grams = trigrams(message)
+        if not grams or not state.examples:
+            return None
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(state.postings.get(gram, ()))
+
+        best, best_score = -1, 0.0
+        for position, common in shared.items():
+            score = common / (len(grams) + state.sizes[position] - common)
+            if score > best_score or (score == best_score and position < best):
+                best, best_score = position, score
+        if best < 0 or best_score < self.threshold:
+            return None
+        self.fuzzy_hits += 1
+        example_id, response = state.examples[best]
+        return ExampleMatch(example_id, response, best_score)
+
+    def match_vector(self, query: Sequence[float]) -> Optional[ExampleMatch]:
+        """Ví dụ có embedding gần nhất với cosine >= semantic_threshold."""
+        state = self._state
+        if state.matrix.shape[0] == 0:
+            return None
+        self.semantic_lookups += 1
+        if len(query) != state.matrix.shape[1]:
+            return None  # embedding model đổi, chờ build lại
+        q = normalize_query(query, state.matrix.shape[1])
+        if q is None:
+            return None
+        scores = state.matrix @ q
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < self.semantic_threshold:
+            return None
+        self.semantic_hits += 1
+        example_id, response = state.examples[int(state.positions[best])]
+        return ExampleMatch(example_id, response, score)
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.fuzzy_hits
+        return {
+            "loaded": self.loaded,
+            "examples": len(self),
+            "embedded": int(self._state.positions.size),
+            "pending_embeddings": self.unembedded,
+            "embed_failures": self.embed_failures,
+            "embed_retry_in": round(max(0.0, self._embed_retry_at - time.monotonic()), 1),
+            "threshold": self.threshold,
+            "semantic_threshold": self.semantic_threshold,
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0,
+            "semantic_lookups": self.semantic_lookups,
+            "semantic_hits": self.semantic_hits,
+        }
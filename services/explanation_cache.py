@@ -0,0 +1,162 @@
+"""
+Cache câu giải thích của LLM cho kết quả dự đoán (call_llm).
+
+Key = sha256 của loại tàu, vector feature đã lượng tử hóa theo bước của
+từng feature, bucket của giá trị dự đoán (bước tương đối, mặc định 1%),
+tên model LLM và version của prompt. Hai bộ tham số gần nhau cho cùng một
+câu giải thích; đổi model hoặc sửa prompt (tăng version) thì key cũ không
+bao giờ khớp.
+
+Hai tầng: LRU có TTL trong process phía trước một store bền vững (bảng
+explanation_cache, do core inject vào).
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional, Union
+
+from services.cache import LRUCache
+
+
+# Bước lượng tử hóa mặc định của từng feature khi tạo key
+DEFAULT_STEPS = {
+    "Ship_SpeedOverGround": 0.1,
+    "Environment_SeaFloorDepth": 1.0,
+    "Weather_Temperature2M": 0.5,
+    "Weather_OceanCurrentVelocity": 0.05,
+    "Weather_WindSpeed10M": 0.5,
+    "Weather_WaveHeight": 0.1,
+    "Weather_WavePeriod": 0.5,
+}
+
+
+def quantize(value: Any, step: float) -> Optional[float]:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value):
+        return None
+    return round(round(value / step) * step, 6) if step > 0 else value
+
+
+# Bước tuyệt đối cho giá trị dự đoán <= 0 (không dùng được thang log)
+NON_POSITIVE_STEP = 0.001
+
+
+def prediction_bucket(value: float, relative_step: float = 0.01) -> Union[int, str]:
+    """
+    Bucket theo thang log: các giá trị lệch nhau dưới relative_step chung bucket.
+
+    Giá trị <= 0 có bucket riêng (chuỗi, không trùng bucket dương) theo bước
+    NON_POSITIVE_STEP; relative_step <= 0 nghĩa là không gộp.
+    """
+    value = float(value)
+    if not math.isfinite(value) or relative_step <= 0:
+        return repr(value)
+    if value <= 0:
+        return f"<=0:{int(round(value / NON_POSITIVE_STEP))}"
+    return int(round(math.log(value) / math.log1p(relative_step)))
+
+
+def explanation_key(
+    ship_type: Optional[str],
+    features: Mapping[str, Any],
+    prediction: float,
+    model: str,
+    prompt_version: int,
+    steps: Optional[Mapping[str, float]] = None,
+    relative_step: float = 0.01,
+) -> str:
+    steps = steps or DEFAULT_STEPS
+    quantized = {
+        name: quantize(features.get(name), step)
+        for name, step in sorted(steps.items())
+    }
+    payload = json.dumps(
+        [str(ship_type or "").upper(), quantized, prediction_bucket(prediction, relative_step), model, prompt_version],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExplanationCache:
+    def __init__(self, maxsize: int, ttl_seconds: float, store: Optional[Any] = None):
+        # Giá trị trong LRU: (explanation, thời điểm hết hạn theo time.time())
+        self.memory = LRUCache(maxsize)
+        self.ttl_seconds = ttl_seconds
+        # store cần có get(key, max_age_seconds) -> str | None,
+        # put(key, explanation, **labels) và purge_expired(ttl_seconds)
+        self.store = store
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.store_hits = 0
+        self.store_misses = 0
+        self.store_errors = 0
+
+    def attach_store(self, store: Any) -> None:
+        with self._lock:
+            self.store = store
+        try:
+            removed = store.purge_expired(self.ttl_seconds)
+            if removed:
+                print(f"Purged {removed} expired cached explanations")
+        except Exception as e:
+            self.store_errors += 1
+            print(f"Explanation store purge failed: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            explanation, expires_at = entry
+            if expires_at > time.time():
+                return explanation
+            self.expired += 1  # entry bị ghi đè ở lần put kế tiếp
+
+        if self.store is None:
+            return None
+        try:
+            explanation = self.store.get(key, self.ttl_seconds)
+        except Exception as e:
+            self.store_errors += 1
+            print(f"Explanation store read failed: {e}")
+            return None
+        if explanation is None:
+            self.store_misses += 1
+            return None
+        self.store_hits += 1
+        self.memory.put(key, (explanation, time.time() + self.ttl_seconds))
+        return explanation
+
+    def put(self, key: str, explanation: str, **labels: Any) -> None:
+        if not explanation:
+            return
+        self.memory.put(key, (explanation, time.time() + self.ttl_seconds))
+        if self.store is not None:
+            try:
+                self.store.put(key, explanation, **labels)
+            except Exception as e:
+                self.store_errors += 1
+                print(f"Explanation store write failed: {e}")
+
+    def clear(self) -> None:
+        self.memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] - self.expired + self.store_hits
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "memory": memory,
+            "expired": self.expired,
+            "store": {
+                "enabled": self.store is not None,
+                "hits": self.store_hits,
+                "misses": self.store_misses,
+                "errors": self.store_errors,
+            },
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,79 @@
+"""
+Đồng bộ tăng dần index trong process với bảng nguồn qua watermark rẻ
+[count, max_id], dùng chung cho index embedding và index BM25.
+"""
+import time
+from typing import Any, Callable, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class WatermarkSync:
+    """
+    Mixin: lớp con cần có ids() -> Set[int], add(ids, payloads) -> số dòng
+    đã nhận, remove(ids), __len__ và _build_lock; payload là embedding hoặc
+    content tùy index. Lớp con đặt lại _max_id và _skipped mỗi khi build lại
+    toàn bộ.
+    """
+
+    watermark: Optional[List[int]] = None
+    _last_poll: float = 0.0
+    # Id lớn nhất đã đồng bộ; None = tính lại từ ids() ở lần sync kế tiếp
+    _max_id: Optional[int] = None
+    # Id có trong bảng nhưng index từ chối (embedding lệch số chiều, payload
+    # rỗng); được tính vào count để không so danh sách id ở mọi lần poll
+    _skipped: FrozenSet[int] = frozenset()
+
+    def ids(self) -> Set[int]:
+        raise NotImplementedError
+
+    def sync(
+        self,
+        fingerprint: Callable[[], List[int]],
+        fetch_after: Callable[[int], Tuple[Sequence[int], Iterable[Any]]],
+        fetch_ids: Callable[[], Iterable[int]],
+        fetch_by_ids: Callable[[List[int]], Tuple[Sequence[int], Iterable[Any]]],
+    ) -> bool:
+        """
+        Bắt kịp các thay đổi từ worker khác.
+
+        Chỉ đọc payload của id mới (id > max id đã đồng bộ); khi số lượng vẫn
+        lệch (có chunk bị xóa, hoặc transaction commit trễ) thì so danh sách
+        id - không đọc lại payload của cả bảng. Chạy dưới _build_lock nên
+        không chồng lên build hay một lần sync khác.
+        """
+        with self._build_lock:
+            current = list(fingerprint())
+            if current == self.watermark:
+                return False
+            count, max_id = current
+
+            if self._max_id is None:
+                self._max_id = max(self.ids(), default=0)
+            if max_id > self._max_id:
+                self._add_tracked(*fetch_after(self._max_id))
+                self._max_id = max_id
+
+            if len(self) + len(self._skipped) != count:
+                db_ids = set(fetch_ids())
+                local = self.ids()
+                self.remove(local - db_ids)
+                missing = sorted(db_ids - local - self._skipped)
+                if missing:
+                    self.add(*fetch_by_ids(missing))
+                self._skipped = frozenset(db_ids - self.ids())
+
+            self.watermark = current
+            return True
+
+    def _add_tracked(self, ids: Sequence[int], payloads: Iterable[Any]) -> None:
+        ids = [int(i) for i in ids]
+        if self.add(ids, payloads) < len(ids):
+            # Hiếm: chỉ khi có dòng bị từ chối mới phải xem index đã nhận id nào
+            self._skipped = self._skipped | frozenset(set(ids) - self.ids())
+
+    def maybe_sync(self, poll_seconds: float, *fetchers: Callable) -> bool:
+        """sync() tối đa một lần mỗi poll_seconds (poll_seconds <= 0: mỗi lần gọi)."""
+        now = time.monotonic()
+        if poll_seconds > 0 and now - self._last_poll < poll_seconds:
+            return False
+        self._last_poll = now
+        return self.sync(*fetchers)
@@ -0,0 +1,133 @@
+"""
+Process pool cho inference CPU-bound.
+
+Mỗi worker process tự tạo ModelService và load sẵn model của tất cả loại tàu
+một lần. Ma trận input và mảng kết quả đi qua shared memory, chỉ tên block
+và shape được pickle qua ranh giới process.
+
+Process cha quyết định version model: mỗi task mang theo version active mà
+process cha đang thấy, worker nào đang giữ version khác thì load lại trước
+khi predict. Nhờ vậy hot-swap không cần load model vào process cha.
+"""
+import atexit
+import multiprocessing as mp
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+
+# ModelService riêng của từng worker process
+_worker_service = None
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Process tạo block chịu trách nhiệm unlink; worker chỉ attach.
+    # Trước 3.13 worker dùng chung resource tracker với process cha nên
+    # việc register lại cùng tên không tạo ra entry mới.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(backend: str) -> None:
+    global _worker_service
+    from services.model_service import ModelService
+
+    _worker_service = ModelService(cache_size=0, inference_workers=0)
+    _worker_service.backend = backend
+    # Version do process cha chỉ định qua từng task, worker không tự poll manifest
+    _worker_service.store_poll_seconds = float("inf")
+    _worker_service.warm()
+
+
+def _predict_shared(ship_type: str, version: Optional[str], in_name: str, out_name: str, shape, dtype: str) -> int:
+    _worker_service.ensure_version(ship_type, version)
+    shm_in = _attach(in_name)
+    shm_out = _attach(out_name)
+    try:
+        X = np.ndarray(shape, dtype=dtype, buffer=shm_in.buf)
+        out = np.ndarray((shape[0],), dtype=np.float64, buffer=shm_out.buf)
+        out[:] = _worker_service._predict_local(ship_type, X)
+        # Bỏ view trước khi close, nếu không buffer vẫn còn bị giữ
+        del X, out
+    finally:
+        shm_in.close()
+        shm_out.close()
+    return shape[0]
+
+
+class InferencePool:
+    def __init__(self, workers: int, backend: str = "native", start_method: str = "spawn"):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(backend,),
+        )
+        self._lock = threading.Lock()
+        self._closed = False
+        atexit.register(self.shutdown)
+
+    def submit(self, ship_type: str, X: np.ndarray, version: Optional[str] = None) -> "Future[np.ndarray]":
+        """
+        Gửi một batch sang worker; Future trả về mảng dự đoán float64.
+
+        version: version model (trong model store) worker phải dùng; None = SHIP_MODEL_MAP.
+        """
+        X = np.ascontiguousarray(X)
+        n_rows = X.shape[0]
+        result: "Future[np.ndarray]" = Future()
+
+        shm_in = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+        shm_out = shared_memory.SharedMemory(create=True, size=max(n_rows * 8, 1))
+        view = np.ndarray(X.shape, dtype=X.dtype, buffer=shm_in.buf)
+        view[:] = X
+        del view
+
+        def _release():
+            for shm in (shm_in, shm_out):
+                shm.close()
+                shm.unlink()
+
+        def _done(future):
+            try:
+                future.result()
+                out = np.ndarray((n_rows,), dtype=np.float64, buffer=shm_out.buf)
+                values = out.copy()
+                del out
+                result.set_result(values)
+            except BaseException as e:
+                result.set_exception(e)
+            finally:
+                _release()
+
+        try:
+            future = self._executor.submit(
+                _predict_shared, ship_type, version, shm_in.name, shm_out.name, X.shape, X.dtype.str
+            )
+        except BaseException:
+            _release()
+            raise
+        future.add_done_callback(_done)
+        return result
+
+    def predict(
+        self,
+        ship_type: str,
+        X: np.ndarray,
+        version: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> np.ndarray:
+        return self.submit(ship_type, X, version).result(timeout=timeout)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,270 @@
+"""
+Index ANN kiểu IVF (inverted file) cho chunk embedding, thuần NumPy.
+
+Các vector (đã chuẩn hóa L2) được chia vào nlist cụm bằng spherical k-means;
+lúc search chỉ quét nprobe cụm có centroid gần query nhất. nprobe lớn hơn
+-> recall cao hơn, chậm hơn; nprobe = nlist tương đương exact search.
+
+Index được lưu thành các file .npy và mở lại bằng mmap_mode="r", nên worker
+khởi động nhanh và dùng chung page cache. Bản lưu ghi kèm watermark của DB;
+worker mở bản cũ hơn DB chỉ cần sync() phần chênh lệch:
+
+    data/chunk_index/
+        CURRENT                  (tên thư mục build đang dùng)
+        .lock                    (flock: một process ghi build tại một thời điểm)
+        20260101-120000-xxxxxx/
+            centroids.npy  offsets.npy  ids.npy  vectors.npy  meta.json
+
+Bản lưu chỉ là điểm xuất phát cho worker mới, nên sau khi gộp delta chỉ ghi
+lại khi bản trên đĩa đã cũ hơn persist_seconds.
+"""
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from services.embedding_index import EmbeddingIndex, IndexState, normalize_rows, top_k
+
+
+ARRAYS = ("centroids", "offsets", "ids", "vectors")
+ASSIGN_BLOCK_ROWS = 4096
+
+
+def assign_lists(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Cụm gần nhất (cosine) cho từng dòng, tính theo block để giới hạn bộ nhớ."""
+    out = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], ASSIGN_BLOCK_ROWS):
+        block = matrix[start:start + ASSIGN_BLOCK_ROWS]
+        out[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(matrix: np.ndarray, nlist: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means trên một mẫu con của matrix."""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    train_size = min(n, max(nlist * 64, 20000))
+    sample = matrix if train_size == n else matrix[rng.choice(n, train_size, replace=False)]
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = assign_lists(sample, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+
+        sums = np.empty_like(centroids)
+        sums[non_empty] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            # Cụm rỗng: khởi tạo lại bằng điểm ngẫu nhiên
+            sums[empty] = sample[rng.choice(sample.shape[0], empty.size)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex(EmbeddingIndex):
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        nlist: int = 0,
+        nprobe: int = 8,
+        use_mmap: bool = True,
+        n_iter: int = 10,
+        persist_seconds: float = 600.0,
+    ):
+        super().__init__()
+        self.root = root
+        self.nlist = nlist  # 0 = tự chọn ~4 * sqrt(n)
+        self.nprobe = nprobe
+        self.use_mmap = use_mmap
+        self.n_iter = n_iter
+        # Khoảng cách tối thiểu (giây) giữa hai lần ghi lại sau khi gộp delta
+        self.persist_seconds = persist_seconds
+        self._persisted_at = 0.0
+        self._persist_thread_lock = threading.Lock()
+
+    @staticmethod
+    def _empty() -> Tuple[np.ndarray, ...]:
+        # (centroids, offsets, ids, vectors); vectors/ids đã sắp theo cụm,
+        # cụm l chiếm [offsets[l], offsets[l + 1])
+        return (
+            np.empty((0, 0), dtype=np.float32),
+            np.zeros(1, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty((0, 0), dtype=np.float32),
+        )
+
+    @staticmethod
+    def _main_ids(main: Tuple[np.ndarray, ...]) -> np.ndarray:
+        return main[2]
+
+    @staticmethod
+    def _main_matrix(main: Tuple[np.ndarray, ...]) -> np.ndarray:
+        return main[3]
+
+    def _choose_nlist(self, n: int) -> int:
+        nlist = self.nlist or int(4 * np.sqrt(n))
+        return max(1, min(nlist, n))
+
+    @staticmethod
+    def _sorted_by_list(
+        centroids: np.ndarray, assign: np.ndarray, ids: np.ndarray, matrix: np.ndarray
+    ) -> Tuple[np.ndarray, ...]:
+        nlist = centroids.shape[0]
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=nlist)))).astype(np.int64)
+        return (centroids, offsets, ids[order], np.ascontiguousarray(matrix[order]))
+
+    def _build_main(self, ids: np.ndarray, matrix: np.ndarray) -> Tuple[np.ndarray, ...]:
+        centroids = train_centroids(matrix, self._choose_nlist(ids.shape[0]), self.n_iter)
+        return self._sorted_by_list(centroids, assign_lists(matrix, centroids), ids, matrix)
+
+    def _merge_main(
+        self, main: Tuple[np.ndarray, ...], keep: np.ndarray, ids: np.ndarray, matrix: np.ndarray
+    ) -> Tuple[np.ndarray, ...]:
+        centroids, offsets, old_ids, old_vectors = main
+        if not old_ids.size:
+            return self._build_main(ids, matrix)
+        # Giữ centroid cũ, chỉ gán cụm cho vector mới (không train lại)
+        old_assign = np.repeat(np.arange(centroids.shape[0]), np.diff(offsets))[keep]
+        return self._sorted_by_list(
+            centroids,
+            np.concatenate((old_assign, assign_lists(matrix, centroids))),
+            np.concatenate((old_ids[keep], ids)),
+            np.concatenate((old_vectors[keep], matrix)),
+        )
+
+    def _score_main(
+        self, main: Tuple[np.ndarray, ...], q: np.ndarray, nprobe: Optional[int] = None, **kwargs: Any
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, offsets, _, vectors = main
+        probe = top_k(centroids @ q, min(nprobe or self.nprobe, centroids.shape[0]))
+        positions: List[np.ndarray] = [np.empty(0, dtype=np.int64)]
+        scores: List[np.ndarray] = [np.empty(0, dtype=np.float32)]
+        for lst in probe.tolist():
+            start, end = int(offsets[lst]), int(offsets[lst + 1])
+            if start == end:
+                continue
+            positions.append(np.arange(start, end))
+            scores.append(vectors[start:end] @ q)
+        return np.concatenate(positions), np.concatenate(scores)
+
+    # --- Lưu / mở lại từ đĩa ---
+    def _current_dir(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, "CURRENT"), encoding="utf-8") as fh:
+                name = fh.read().strip()
+        except FileNotFoundError:
+            return None
+        return os.path.join(self.root, name) if name else None
+
+    def _load_persisted(self, fingerprint: Any) -> bool:
+        if not self.root:
+            return False
+        if not os.path.exists(os.path.join(self.root, "CURRENT")):
+            return False
+        with self._persist_lock(shared=True):
+            path = self._current_dir()
+            if path is None:
+                return False
+            try:
+                with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+                    meta = json.load(fh)
+                if self.nlist and meta.get("nlist") != self.nlist:
+                    return False
+                mmap_mode = "r" if self.use_mmap else None
+                arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS]
+            except (OSError, ValueError) as e:
+                print(f"Cannot open chunk index at {path}: {e}")
+                return False
+        self._state = IndexState(
+            tuple(arrays), None,
+            np.empty(0, dtype=np.int64), np.empty((0, arrays[3].shape[1]), dtype=np.float32),
+            frozenset(),
+        )
+        # Bản lưu có thể cũ hơn DB: watermark của nó để sync() bắt kịp phần chênh
+        self.watermark = meta.get("fingerprint")
+        self._max_id = None
+        self._skipped = frozenset()
+        self.loaded = True
+        print(f"Opened chunk index {path} ({len(self)} vectors, nlist={meta.get('nlist')}, watermark={self.watermark})")
+        return True
+
+    @contextlib.contextmanager
+    def _persist_lock(self, shared: bool = False):
+        # Writer (exclusive) serialize đọc CURRENT / ghi build / đổi CURRENT / xóa
+        # build cũ giữa các process; reader (shared) mở build mà không bị xóa giữa chừng
+        os.makedirs(self.root, exist_ok=True)
+        with contextlib.ExitStack() as stack:
+            if not shared:
+                stack.enter_context(self._persist_thread_lock)
+            lock_file = stack.enter_context(open(os.path.join(self.root, ".lock"), "a"))
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def _persisted_fingerprint(self, path: str) -> Any:
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+                return json.load(fh).get("fingerprint")
+        except (OSError, ValueError):
+            return None
+
+    def _after_merge(self) -> None:
+        if self.watermark is None or time.monotonic() - self._persisted_at < self.persist_seconds:
+            return
+        self._persist(self.watermark)
+
+    def _persist(self, fingerprint: Any) -> None:
+        if not self.root:
+            return
+        with self._persist_lock():
+            previous = self._current_dir()
+            if previous and self._persisted_fingerprint(previous) == fingerprint:
+                # Process khác vừa ghi bản cùng watermark
+                self._persisted_at = time.monotonic()
+                return
+            path = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d-%H%M%S-"), dir=self.root)
+            name = os.path.basename(path)
+            try:
+                for array_name, array in zip(ARRAYS, self._state.main):
+                    np.save(os.path.join(path, f"{array_name}.npy"), array)
+                with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as fh:
+                    json.dump({
+                        "fingerprint": fingerprint,
+                        "nlist": int(self._state.main[0].shape[0]),
+                        "count": len(self),
+                        "created_at": time.time(),
+                    }, fh)
+
+                # Đổi CURRENT bằng os.replace -> reader luôn thấy một build hoàn chỉnh
+                tmp_path = os.path.join(self.root, f"CURRENT.tmp.{os.getpid()}")
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    fh.write(name)
+                os.replace(tmp_path, os.path.join(self.root, "CURRENT"))
+            except OSError as e:
+                print(f"Cannot persist chunk index to {path}: {e}")
+                shutil.rmtree(path, ignore_errors=True)
+                return
+            self._persisted_at = time.monotonic()
+
+            # Xóa mọi build khác CURRENT (kể cả bản sót lại khi process bị kill
+            # giữa chừng); process khác đang mmap bản cũ vẫn đọc được (POSIX)
+            for entry in os.listdir(self.root):
+                stale = os.path.join(self.root, entry)
+                if entry != name and os.path.isdir(stale):
+                    shutil.rmtree(stale, ignore_errors=True)
+        print(f"Saved chunk index {path} ({len(self)} vectors)")
@@ -0,0 +1,213 @@
+"""
+Index BM25 trong RAM trên DocumentChunk.content.
+
+Bổ sung cho tìm kiếm vector ở các query chứa token kỹ thuật chính xác
+("Weather_WavePeriod", "Triton") mà cosine không qua ngưỡng. Chuẩn hóa
+tiếng Việt bỏ dấu (đ -> d) để "sóng" khớp "song"; identifier được tách thêm
+thành từng phần (Weather_WavePeriod -> weather, wave, period) bên cạnh token
+nguyên vẹn.
+
+Posting list của mỗi term được gom thành mảng NumPy lúc cần và cache lại
+tới khi term đó bị sửa, nên một query chỉ tốn vài phép toán vector trên
+posting list của các term trong query.
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from services.index_sync import WatermarkSync
+
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def fold_diacritics(text: str) -> str:
+    if text.isascii():
+        return text
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    """Token đã bỏ dấu, chữ thường; identifier sinh thêm các phần con."""
+    tokens: List[str] = []
+    for word in WORD_RE.findall(fold_diacritics(text)):
+        lowered = word.lower()
+        tokens.append(lowered)
+        if lowered == word and "_" not in word:
+            continue
+        parts = [p.lower() for piece in word.split("_") for p in CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index(WatermarkSync):
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_terms: Dict[int, Counter] = {}
+        self._doc_len: Dict[int, int] = {}
+        self._total_len = 0
+        # term -> (doc ids, tf, doc len), build lại khi term bị sửa
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self.loaded = False
+        self.watermark: Optional[List[int]] = None
+        self._last_poll = 0.0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def ids(self) -> Set[int]:
+        with self._lock:
+            return set(self._doc_len)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "documents": len(self),
+            "terms": len(self._postings),
+            "watermark": self.watermark,
+        }
+
+    # --- Cập nhật ---
+    def add(self, ids: Sequence[int], texts: Iterable[str]) -> int:
+        """Thêm (hoặc thay) chunk vào index đang chạy; trả về số chunk đã thêm."""
+        if not self.loaded:
+            return 0  # lần search đầu tiên sẽ build đầy đủ
+        return self._add(ids, texts)
+
+    def _add(self, ids: Sequence[int], texts: Iterable[str]) -> int:
+        added = 0
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if text is None:
+                    continue
+                doc_id = int(doc_id)
+                self._remove_one(doc_id)
+                terms = Counter(tokenize(text))
+                self._doc_terms[doc_id] = terms
+                length = sum(terms.values())
+                self._doc_len[doc_id] = length
+                self._total_len += length
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[doc_id] = tf
+                    self._arrays.pop(term, None)
+                added += 1
+        return added
+
+    def remove(self, ids: Iterable[int]) -> int:
+        with self._lock:
+            return sum(self._remove_one(int(doc_id)) for doc_id in ids)
+
+    def _remove_one(self, doc_id: int) -> int:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return 0
+        self._total_len -= self._doc_len.pop(doc_id)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+            self._arrays.pop(term, None)
+        return 1
+
+    def build(self, ids: Sequence[int], texts: Iterable[str]) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._arrays.clear()
+            self._total_len = 0
+            self._add(ids, texts)
+            self._max_id = max(self._doc_len, default=0)
+            self._skipped = frozenset()
+        self.loaded = True
+
+    def ensure_loaded(self, loader) -> "BM25Index":
+        if self.loaded:
+            return self
+        with self._build_lock:
+            if not self.loaded:
+                self.build(*loader())
+                self._last_poll = 0.0  # watermark chưa có -> sync ở lần gọi kế tiếp
+        return self
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+    # --- Search ---
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        arrays = self._arrays.get(term)
+        if arrays is not None:
+            return arrays
+        with self._lock:
+            posting = self._postings.get(term)
+            if not posting:
+                return None
+            ids = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+            tf = np.fromiter(posting.values(), dtype=np.float32, count=len(posting))
+            lens = np.fromiter((self._doc_len[i] for i in posting), dtype=np.float32, count=len(posting))
+            arrays = (ids, tf, lens)
+            self._arrays[term] = arrays
+        return arrays
+
+    def search(self, query: str, k: int = 10, min_term_match: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        [(chunk_id, bm25)] tốt nhất. min_term_match: tỉ lệ tối thiểu số term
+        (khác nhau) của query phải xuất hiện trong chunk.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        n_docs = len(self._doc_len)
+        if not terms or n_docs == 0:
+            return []
+        avgdl = self._total_len / n_docs
+
+        ids_parts: List[np.ndarray] = []
+        score_parts: List[np.ndarray] = []
+        for term in terms:
+            arrays = self._term_arrays(term)
+            if arrays is None:
+                continue
+            ids, tf, lens = arrays
+            df = ids.shape[0]
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = tf + self.k1 * (1.0 - self.b + self.b * lens / avgdl)
+            ids_parts.append(ids)
+            score_parts.append(idf * tf * (self.k1 + 1.0) / norm)
+        if not ids_parts:
+            return []
+
+        all_ids = np.concatenate(ids_parts)
+        unique_ids, inverse = np.unique(all_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        if min_term_match > 0:
+            matched = np.bincount(inverse)
+            scores = np.where(matched >= math.ceil(min_term_match * len(terms)), scores, 0.0)
+
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(unique_ids[i]), float(scores[i])) for i in candidates]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Gộp nhiều danh sách id đã xếp hạng: score = sum 1 / (k + rank)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
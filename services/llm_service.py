@@ -1,11 +1,20 @@
+import asyncio
+import atexit
+import contextlib
 import json
 import os
+import queue
 import re
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, List, Dict, Any, Optional, Tuple
 
 import httpx
 from httpx import URL
 
+from services.admission import PRIORITY_INTERACTIVE, AdmissionController
+from services.env import get_env_bool, get_env_float, get_env_int
+from services.singleflight import SingleFlight, payload_key
+
 # System Prompts
 SYSTEM_PROMPT_EN = """You are a helpful maritime fuel consumption assistant powered by AI.
 
@@ -50,24 +59,25 @@ Do not include any explanations, notes, or calculations before or after this cal
 
 SYSTEM_PROMPT_VI = """Bạn là trợ lý AI hỗ trợ dự đoán tiêu thụ nhiên liệu hàng hải. Bạn PHẢI trả lời HOÀN TOÀN bằng tiếng Việt, kể cả khi câu hỏi hay dữ liệu đầu vào là tiếng Anh."""
 
-def _get_env_float(name: str, default: float) -> float:
-    value = os.getenv(name)
-    if value is None:
-        return default
-    try:
-        return float(value)
-    except ValueError:
-        return default
 
+_STREAM_END = object()
 
-def _get_env_int(name: str, default: int) -> int:
-    value = os.getenv(name)
-    if value is None:
-        return default
+
+def parse_stream_line(line: str) -> Optional[str]:
+    """Text của một dòng SSE 'data: {...}' trong stream chat completion (None nếu không có)."""
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if not data or data == "[DONE]":
+        return None
     try:
-        return int(value)
+        chunk = json.loads(data)
     except ValueError:
-        return default
+        return None
+    choices = chunk.get("choices") or []
+    if not choices:
+        return None
+    return (choices[0].get("delta") or {}).get("content") or None
 
 
 class LLMService:
@@ -80,11 +90,157 @@ class LLMService:
     ):
         self.api_url = api_url or os.getenv("LLM_API_URL", "http://localhost:1234/v1/chat/completions")
         self.model_name = model_name or os.getenv("LLM_MODEL_NAME", "llama3-8b-instruct")
-        self.temperature = temperature if temperature is not None else _get_env_float("LLM_TEMPERATURE", 0.7)
-        self.max_tokens = max_tokens if max_tokens is not None else _get_env_int("LLM_MAX_TOKENS", 1024)
+        self.temperature = temperature if temperature is not None else get_env_float("LLM_TEMPERATURE", 0.7)
+        self.max_tokens = max_tokens if max_tokens is not None else get_env_int("LLM_MAX_TOKENS", 1024)
         api_url_object = URL(self.api_url)
         self.models_url = str(api_url_object.copy_with(path="/v1/models", query=None))
 
+        # Một AsyncClient dùng chung (pool + keep-alive tới LM Studio), sống trên
+        # event loop nền của worker; view Flask gọi qua chat_sync()
+        self.timeout = get_env_float("LLM_TIMEOUT", 60.0)
+        self.limits = httpx.Limits(
+            max_connections=get_env_int("LLM_POOL_MAX_CONNECTIONS", 10),
+            max_keepalive_connections=get_env_int("LLM_POOL_MAX_KEEPALIVE", 5),
+            keepalive_expiry=get_env_float("LLM_KEEPALIVE_EXPIRY", 30.0),
+        )
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_pid: Optional[int] = None
+        self._loop_lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._atexit_registered = False
+
+        # Request giống hệt nhau đang chạy đồng thời dùng chung một lần gọi LLM
+        self.coalesce = get_env_bool("LLM_COALESCE", True)
+        self.flights = SingleFlight(get_env_float("LLM_COALESCE_WAIT_SECONDS", self.timeout))
+
+        # Giới hạn số request đồng thời tới LM Studio, phần dư xếp hàng ưu tiên;
+        # hàng đầy / chờ quá lâu -> LLMOverloadedError (API trả 503)
+        self.admission = AdmissionController(
+            max_concurrency=get_env_int("LLM_MAX_CONCURRENCY", 2),
+            max_queue=get_env_int("LLM_MAX_QUEUE", 16),
+            queue_timeout=get_env_float("LLM_QUEUE_TIMEOUT_SECONDS", 20.0),
+        )
+
+    # --- Event loop nền + client dùng chung ---
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """Event loop nền của process hiện tại (tạo lại sau fork)."""
+        loop = self._loop
+        if loop is not None and self._loop_pid == os.getpid() and loop.is_running():
+            return loop
+        with self._loop_lock:
+            loop = self._loop
+            if loop is not None and self._loop_pid == os.getpid() and loop.is_running():
+                return loop
+            # Sau fork: thread của loop cũ không tồn tại trong process con
+            self._client = None
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def _run() -> None:
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+                loop.close()
+
+            thread = threading.Thread(target=_run, name="llm-event-loop", daemon=True)
+            thread.start()
+            started.wait()
+            self._loop, self._loop_thread, self._loop_pid = loop, thread, os.getpid()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+        return loop
+
+    @contextlib.asynccontextmanager
+    async def _client_session(self) -> AsyncIterator[httpx.AsyncClient]:
+        """Client dùng chung nếu đang chạy trên loop nền, ngược lại một client tạm."""
+        if asyncio.get_running_loop() is self._loop:
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+            yield self._client
+        else:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                yield client
+
+    def run_sync(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Chạy coroutine trên loop nền và chờ kết quả; gọi được từ mọi thread (không phải từ loop nền)."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def chat_sync(
+        self,
+        messages: List[Dict[str, str]],
+        language: str = "en",
+        model_name: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> str:
+        """Bản đồng bộ của chat() cho view Flask, thay cho asyncio.run(...)."""
+        return self.run_sync(self.chat(messages, language, model_name=model_name, priority=priority), timeout)
+
+    def stream_sync(
+        self,
+        messages: List[Dict[str, str]],
+        language: str = "en",
+        model_name: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> Iterator[str]:
+        """
+        Bản đồng bộ của chat_stream() cho view Flask: stream chạy trên loop nền,
+        từng delta được chuyển qua hàng đợi. Đóng generator giữa chừng (client
+        ngắt kết nối) sẽ hủy request tới LLM.
+        """
+        loop = self._ensure_loop()
+        deltas: "queue.Queue[Any]" = queue.Queue()
+
+        async def _pump() -> None:
+            try:
+                async for delta in self.chat_stream(messages, language, model_name=model_name, priority=priority):
+                    deltas.put(delta)
+            except Exception as e:
+                deltas.put(e)
+            finally:
+                deltas.put(_STREAM_END)
+
+        future = asyncio.run_coroutine_threadsafe(_pump(), loop)
+        try:
+            while True:
+                try:
+                    item = deltas.get(timeout=timeout or self.timeout)
+                except queue.Empty:
+                    raise TimeoutError("LLM stream stalled") from None
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    def shutdown(self) -> None:
+        """Đóng client và dừng loop nền (đăng ký atexit)."""
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            if loop is None or self._loop_pid != os.getpid() or not loop.is_running():
+                return
+            client, self._client = self._client, None
+            if client is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(5)
+                except Exception as e:
+                    print(f" LLM client close failed: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop = self._loop_thread = None
+        if thread is not None:
+            thread.join(timeout=5)
+
     async def _discover_model(self, client: httpx.AsyncClient) -> Optional[str]:
         try:
             response = await client.get(self.models_url)
@@ -117,7 +273,8 @@ class LLMService:
         self, 
         messages: List[Dict[str, str]], 
         language: str = "en",
-        model_name: Optional[str] = None
+        model_name: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> str:
         """
         Send chat request to LLM
@@ -125,10 +282,83 @@ class LLMService:
         Args:
             messages: List of {'role': 'user/assistant', 'content': '...'}
             language: 'en' or 'vi'
+            priority: PRIORITY_INTERACTIVE (chat) or PRIORITY_BATCH (analysis)
         
         Returns:
             LLM response text
         """
+        payload = self._build_payload(messages, language, model_name, stream=False)
+        if not self.coalesce:
+            return await self._post_chat(payload, priority)
+        return await self.flights.do_async(payload_key(payload), lambda: self._post_chat(payload, priority))
+
+    async def _post_chat(self, payload: Dict[str, Any], priority: int) -> str:
+        async with self.admission.slot(priority):
+            try:
+                async with self._client_session() as client:
+                    response = await client.post(self.api_url, json=payload)
+                    if response.status_code == 404:
+                        fallback_model = await self._discover_model(client)
+                        if fallback_model and fallback_model != self.model_name:
+                            print(
+                                f" LLM model '{self.model_name}' not available; retrying with '{fallback_model}'"
+                            )
+                            self.model_name = fallback_model
+                            payload["model"] = fallback_model
+                            response = await client.post(self.api_url, json=payload)
+                    response.raise_for_status()
+                    data = response.json()
+                    return data["choices"][0]["message"]["content"]
+            except Exception as e:
+                self._log_error(e)
+                raise
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        language: str = "en",
+        model_name: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> AsyncIterator[str]:
+        """
+        Như chat() nhưng gửi "stream": true và yield từng đoạn text (delta)
+        ngay khi LLM sinh ra, theo SSE của API tương thích OpenAI. Slot của
+        admission control được giữ tới khi stream kết thúc.
+        """
+        payload = self._build_payload(messages, language, model_name, stream=True)
+        async with self.admission.slot(priority):
+            try:
+                async with self._client_session() as client:
+                    for attempt in range(2):
+                        async with client.stream("POST", self.api_url, json=payload) as response:
+                            if response.status_code == 404 and attempt == 0:
+                                fallback_model = await self._discover_model(client)
+                                if fallback_model and fallback_model != self.model_name:
+                                    print(
+                                        f" LLM model '{self.model_name}' not available; retrying with '{fallback_model}'"
+                                    )
+                                    self.model_name = fallback_model
+                                    payload["model"] = fallback_model
+                                    continue
+                            if response.is_error:
+                                await response.aread()
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                delta = parse_stream_line(line)
+                                if delta:
+                                    yield delta
+                            return
+            except Exception as e:
+                self._log_error(e)
+                raise
+
+    def _build_payload(
+        self,
+        messages: List[Dict[str, str]],
+        language: str,
+        model_name: Optional[str],
+        stream: bool,
+    ) -> Dict[str, Any]:
         # Prepend system prompt
         system_prompt = self.get_system_prompt(language)
         full_messages = [
@@ -137,43 +367,27 @@ class LLMService:
         ]
         print("Full messages sent to LLM:")
         print(full_messages)
-        
-        payload = {
-        "model": model_name or self.model_name,
-        "messages": full_messages,
-        "temperature": self.temperature,
-        "max_tokens": self.max_tokens,
-        "stream": False
+
+        return {
+            "model": model_name or self.model_name,
+            "messages": full_messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stream": stream,
         }
 
-        
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(self.api_url, json=payload)
-                if response.status_code == 404:
-                    fallback_model = await self._discover_model(client)
-                    if fallback_model and fallback_model != self.model_name:
-                        print(
-                            f" LLM model '{self.model_name}' not available; retrying with '{fallback_model}'"
-                        )
-                        self.model_name = fallback_model
-                        payload["model"] = fallback_model
-                        response = await client.post(self.api_url, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                return data["choices"][0]["message"]["content"]
-        except httpx.HTTPError as e:
+    @staticmethod
+    def _log_error(e: Exception) -> None:
+        if isinstance(e, httpx.HTTPError):
             body = None
-            if e.response is not None:
+            if getattr(e, "response", None) is not None:
                 try:
                     body = e.response.json()
                 except ValueError:
                     body = e.response.text
             print(f" LLM HTTP error: {e} | response={body}")
-            raise
-        except Exception as e:
+        else:
             print(f" LLM error: {e}")
-            raise
     
     def parse_function_call(self, response: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
         """
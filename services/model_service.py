@@ -1,8 +1,36 @@
+import asyncio
 import joblib
+import math
+import numpy as np
+import os
 import pandas as pd
 import requests
+import threading
 import time
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from services.cache import LRUCache
+from services.embedding_cache import EmbeddingCache
+from services.env import get_env_bool, get_env_float, get_env_int
+from services.inference_pool import InferencePool
+from services.model_store import ModelStore
+from services.singleflight import SingleFlight
+from services.tree_engine import CompiledEnsemble, compile_model, max_abs_error
+from services.voyage_service import VoyageIntegrator, parse_timestamp
+
+
+def _parse_precision(spec: str) -> Dict[str, int]:
+    """Đọc chuỗi dạng "Weather_WaveHeight=1,Weather_WindSpeed10M=0"."""
+    precision: Dict[str, int] = {}
+    for part in spec.split(","):
+        name, sep, digits = part.partition("=")
+        if not sep:
+            continue
+        try:
+            precision[name.strip()] = int(digits)
+        except ValueError:
+            continue
+    return precision
 
 
 class ModelService:
@@ -24,82 +52,677 @@ class ModelService:
         "Weather_WavePeriod"
     ]
 
-    def __init__(self):
-        self.model = None
-        self.current_ship_type = None
+    # Số chữ số thập phân giữ lại khi tạo key cho prediction cache
+    CACHE_PRECISION = {
+        "Ship_SpeedOverGround": 2,
+        "Environment_SeaFloorDepth": 1,
+        "Weather_Temperature2M": 1,
+        "Weather_OceanCurrentVelocity": 2,
+        "Weather_WindSpeed10M": 1,
+        "Weather_WaveHeight": 2,
+        "Weather_WavePeriod": 1,
+    }
+
+    def __init__(
+        self,
+        cache_size: Optional[int] = None,
+        cache_precision: Optional[Dict[str, int]] = None,
+        inference_workers: Optional[int] = None,
+    ):
+        # Registry: ship type -> model đã load, giữ thường trú trong RAM
+        self._models: Dict[str, Any] = {}
+        # Lock riêng cho từng loại tàu để không load trùng một file
+        self._load_locks: Dict[str, threading.Lock] = {
+            st: threading.Lock() for st in self.SHIP_MODEL_MAP
+        }
+        # Tăng mỗi lần load lại model -> entry cache cũ không còn khớp key
+        self._generations: Dict[str, int] = {st: 0 for st in self.SHIP_MODEL_MAP}
+        # Version (trong model store) của model đang thường trú; None = SHIP_MODEL_MAP
+        self._versions: Dict[str, Optional[str]] = {}
+
+        # Kho model có version; không có manifest thì dùng SHIP_MODEL_MAP như cũ
+        self.store = ModelStore(os.getenv("MODEL_STORE_DIR", "models/store"))
+        self.use_mmap = get_env_bool("MODEL_MMAP", True)
+        # Chu kỳ (giây) kiểm tra manifest để nhận hot-swap từ worker khác
+        self.store_poll_seconds = get_env_float("MODEL_STORE_POLL_SECONDS", 5.0)
+        self._store_checked_at = 0.0
+        self._store_signature = self.store.signature()
+        self._refresh_lock = threading.Lock()
+
+        # Prediction cache (PREDICTION_CACHE_SIZE=0 để tắt)
+        if cache_size is None:
+            cache_size = get_env_int("PREDICTION_CACHE_SIZE", 1024)
+        self.prediction_cache = LRUCache(cache_size)
+        precision = dict(self.CACHE_PRECISION)
+        precision.update(_parse_precision(os.getenv("PREDICTION_CACHE_PRECISION", "")))
+        precision.update(cache_precision or {})
+        self._cache_digits = [precision.get(name, 3) for name in self.FEATURES]
+        
+        # "native": pickle gốc; "compiled": bảng cây NumPy (*.trees.npz) nếu đã export
+        self.backend = os.getenv("MODEL_BACKEND", "native").strip().lower()
+
+        # INFERENCE_WORKERS > 0: chạy predict trong process pool (tạo lúc cần)
+        if inference_workers is None:
+            inference_workers = get_env_int("INFERENCE_WORKERS", 0)
+        self.inference_workers = max(0, inference_workers)
+        self._pool: Optional[InferencePool] = None
+        self._pool_lock = threading.Lock()
+
+        # dtype của ma trận input (float64 giữ nguyên ngưỡng split của model)
+        self.input_dtype = np.dtype(os.getenv("MODEL_INPUT_DTYPE", "float64"))
         
         # Embedding server config
         self.LM_STUDIO_URL = "http://localhost:1234/v1/embeddings"
-        self.EMBEDDING_MODEL = "text-embedding-nomic-embed-text-v1.5"
+        self.EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-nomic-embed-text-v1.5")
+        # LRU trong process; store bền vững được core gắn vào qua set_embedding_store
+        self.embedding_cache = EmbeddingCache(get_env_int("EMBEDDING_CACHE_SIZE", 4096))
+        self.embedding_batch_size = max(1, get_env_int("EMBEDDING_BATCH_SIZE", 64))
+        # Giữ kết nối keep-alive tới LM Studio giữa các lần gọi
+        self._http = requests.Session()
+        # Cùng một text đang được embedding ở thread khác -> chờ kết quả đó
+        self.embedding_flights = SingleFlight(get_env_float("EMBEDDING_COALESCE_WAIT_SECONDS", 30.0))
 
 
-    # --- Load model theo loại tàu ---
-    def load_model_for_ship(self, ship_type: str):
-        st = ship_type.upper()
+    def _normalize_ship(self, ship_type: str) -> str:
+        st = str(ship_type).strip().upper()
         if st not in self.SHIP_MODEL_MAP:
             raise ValueError(f"Unknown ship type: {st}")
+        return st
+
+
+    # --- Load model theo loại tàu ---
+    def _resolve_artifact(self, st: str) -> Tuple[str, Optional[str], bool]:
+        """(path, version, mmap) của model cần dùng cho loại tàu."""
+        entry = self.store.active(st)
+        if entry:
+            return entry["path"], entry["version"], entry["mmap"]
+        return self.SHIP_MODEL_MAP[st], None, False
 
-        path = self.SHIP_MODEL_MAP[st]
-        self.model = joblib.load(path)
-        self.current_ship_type = st
-        print(f"Loaded model for {st} -> {path}")
+
+    def compiled_path(self, ship_type: str) -> str:
+        path, _, _ = self._resolve_artifact(self._normalize_ship(ship_type))
+        return os.path.splitext(path)[0] + ".trees.npz"
+
+
+    def _read_artifact(self, st: str, path: str, mmap: bool):
+        if self.backend == "compiled":
+            compiled = os.path.splitext(path)[0] + ".trees.npz"
+            if os.path.exists(compiled):
+                # Không cần import xgboost/catboost/lightgbm/sklearn
+                return CompiledEnsemble.load(compiled), compiled
+            print(f"Compiled model not found for {st} ({compiled}); using {path}")
+        if mmap and self.use_mmap:
+            # Mảng lớn của model được map từ file -> các worker dùng chung page cache
+            return joblib.load(path, mmap_mode="r"), path
+        return joblib.load(path), path
+
+
+    def _install(self, st: str, model, version: Optional[str], path: str):
+        # Caller phải giữ self._load_locks[st].
+        # Gán một lần: request khác vẫn dùng model cũ cho tới khi load xong
+        self._models[st] = model
+        self._versions[st] = version
+        self._generations[st] += 1
+        dropped = self.prediction_cache.discard_where(lambda key: key[0] == st)
+        print(f"Loaded model for {st} -> {path}" + (f" (version {version})" if version else ""))
+        if dropped:
+            print(f"Invalidated {dropped} cached predictions for {st}")
 
         # Debug: xem model được train với bao nhiêu features
-        if hasattr(self.model, "feature_names_in_"):
-            print("Model feature names:", list(self.model.feature_names_in_))
+        if hasattr(model, "feature_names_in_"):
+            print("Model feature names:", list(model.feature_names_in_))
+        return model
+
+
+    def _load_from_disk(self, st: str):
+        # Caller phải giữ self._load_locks[st]
+        path, version, mmap = self._resolve_artifact(st)
+        model, loaded_path = self._read_artifact(st, path, mmap)
+        return self._install(st, model, version, loaded_path)
+
+
+    def _mark_version(self, st: str, version: Optional[str]) -> None:
+        # Chế độ process pool: model nằm trong worker, process cha chỉ ghi nhận
+        # version (gửi kèm mỗi task) và đổi generation để key cache cũ không khớp
+        self._versions[st] = version
+        self._generations[st] += 1
+        dropped = self.prediction_cache.discard_where(lambda key: key[0] == st)
+        print(f"Inference pool switched {st} to " + (f"version {version}" if version else self.SHIP_MODEL_MAP[st]))
+        if dropped:
+            print(f"Invalidated {dropped} cached predictions for {st}")
+
+
+    def _pool_version(self, st: str) -> Optional[str]:
+        """Version mà worker của process pool phải dùng cho loại tàu."""
+        if st not in self._versions:
+            with self._load_locks[st]:
+                if st not in self._versions:
+                    entry = self.store.active(st)
+                    self._versions[st] = entry["version"] if entry else None
+        return self._versions[st]
+
+
+    def ensure_version(self, ship_type: str, version: Optional[str]) -> None:
+        """Load đúng version được chỉ định nếu model thường trú đang là version khác."""
+        st = self._normalize_ship(ship_type)
+        if st in self._models and self._versions.get(st) == version:
+            return
+        with self._load_locks[st]:
+            if st in self._models and self._versions.get(st) == version:
+                return
+            if version is None:
+                path, mmap = self.SHIP_MODEL_MAP[st], False
+            else:
+                entry = self.store.version(st, version)
+                path, mmap = entry["path"], entry["mmap"]
+            model, loaded_path = self._read_artifact(st, path, mmap)
+            self._install(st, model, version, loaded_path)
+
+
+    def activate_version(self, ship_type: str, version: str) -> Dict[str, Any]:
+        """
+        Hot-swap model của một loại tàu sang version khác trong store.
+
+        Model mới được load xong rồi mới ghi manifest và thay vào registry,
+        nên request đang chạy không bao giờ thấy trạng thái dở dang.
+        Khi process pool phục vụ inference, process cha không load model:
+        worker tự load version mới ở task kế tiếp.
+        """
+        st = self._normalize_ship(ship_type)
+        entry = self.store.version(st, version)
+        if self.inference_workers:
+            if not os.path.exists(entry["path"]):
+                raise ValueError(f"Model file not found: {entry['path']}")
+            with self._load_locks[st]:
+                self.store.set_active(st, version)
+            self._mark_version(st, version)
+            self._store_signature = self.store.signature()
+            return {"ship_type": st, "version": version, "path": entry["path"]}
+
+        with self._load_locks[st]:
+            model, loaded_path = self._read_artifact(st, entry["path"], entry["mmap"])
+            self.store.set_active(st, version)
+            self._install(st, model, version, loaded_path)
+        self._store_signature = self.store.signature()
+        return {"ship_type": st, "version": version, "path": loaded_path}
+
+
+    def _maybe_refresh(self) -> None:
+        """Reload model khi manifest bị process khác đổi version active."""
+        now = time.monotonic()
+        if now - self._store_checked_at < self.store_poll_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._store_checked_at = now
+            signature = self.store.signature()
+            if signature == self._store_signature:
+                return
+            self._store_signature = signature
+            # Với process pool: loại tàu đã gửi task (có trong _versions) thay vì đã load
+            tracked = self._versions if self.inference_workers else self._models
+            for st in list(tracked):
+                entry = self.store.active(st)
+                active_version = entry["version"] if entry else None
+                if active_version == self._versions.get(st):
+                    continue
+                if self.inference_workers:
+                    self._mark_version(st, active_version)
+                else:
+                    try:
+                        self.load_model_for_ship(st)
+                    except Exception as e:
+                        print(f"Could not reload model for {st}: {e}")
+        finally:
+            self._refresh_lock.release()
+
+
+    def model_versions(self) -> Dict[str, Any]:
+        return {
+            st: {
+                "loaded_version": self._versions.get(st),
+                **self.store.describe(st),
+            }
+            for st in self.SHIP_MODEL_MAP
+        }
+
+
+    def load_model_for_ship(self, ship_type: str):
+        """Load (hoặc reload) model của một loại tàu vào registry."""
+        st = self._normalize_ship(ship_type)
+        with self._load_locks[st]:
+            return self._load_from_disk(st)
+
+
+    def get_model(self, ship_type: str):
+        """Trả về model thường trú; chỉ load từ disk ở lần đầu tiên."""
+        st = self._normalize_ship(ship_type)
+        self._maybe_refresh()
+        model = self._models.get(st)
+        if model is not None:
+            return model
+
+        with self._load_locks[st]:
+            # Kiểm tra lại: thread khác có thể vừa load xong
+            model = self._models.get(st)
+            if model is not None:
+                return model
+            return self._load_from_disk(st)
+
+
+    def warm(self, ship_types: Optional[Iterable[str]] = None) -> Dict[str, Optional[str]]:
+        """
+        Load trước model cho các loại tàu (mặc định: tất cả).
+
+        Returns:
+            {ship_type: None nếu load thành công, hoặc thông báo lỗi}
+        """
+        targets = list(ship_types) if ship_types is not None else list(self.SHIP_MODEL_MAP)
+        status: Dict[str, Optional[str]] = {}
+        for ship_type in targets:
+            try:
+                self.get_model(ship_type)
+                status[str(ship_type).upper()] = None
+            except Exception as e:
+                print(f"Could not warm model for {ship_type}: {e}")
+                status[str(ship_type).upper()] = str(e)
+        return status
+
+
+    def unload(self, ship_type: Optional[str] = None) -> List[str]:
+        """Giải phóng model của một loại tàu (hoặc tất cả nếu không truyền)."""
+        targets = [self._normalize_ship(ship_type)] if ship_type else list(self.SHIP_MODEL_MAP)
+        removed = []
+        for st in targets:
+            with self._load_locks[st]:
+                if self._models.pop(st, None) is not None:
+                    removed.append(st)
+        return removed
+
+
+    def loaded_ships(self) -> List[str]:
+        return [st for st in self.SHIP_MODEL_MAP if st in self._models]
+
+
+    def export_compiled(
+        self,
+        X_check: np.ndarray,
+        ship_types: Optional[Iterable[str]] = None,
+        tolerance: float = 1e-4,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Biên dịch pickle của từng loại tàu thành bảng cây và lưu cạnh file gốc.
+
+        Bản biên dịch chỉ được ghi khi sai số so với model gốc trên X_check
+        không vượt quá tolerance.
+
+        Returns:
+            {ship_type: {"path", "trees", "nodes", "max_abs_error"} hoặc {"error"}}
+        """
+        targets = [self._normalize_ship(st) for st in ship_types] if ship_types else list(self.SHIP_MODEL_MAP)
+        X_check = np.ascontiguousarray(X_check, dtype=np.float64)
+        report: Dict[str, Dict[str, Any]] = {}
+        for st in targets:
+            try:
+                native = joblib.load(self._resolve_artifact(st)[0])
+                compiled = compile_model(native, self.FEATURES)
+                error = max_abs_error(native, compiled, X_check, self._model_input(native, X_check))
+                if error > tolerance:
+                    raise ValueError(f"Compiled model differs by {error:.3g} (> {tolerance:g})")
+                out_path = self.compiled_path(st)
+                compiled.save(out_path)
+                report[st] = {
+                    "path": out_path,
+                    "source": compiled.source,
+                    "trees": compiled.n_trees,
+                    "nodes": compiled.n_nodes,
+                    "max_abs_error": error,
+                }
+            except Exception as e:
+                report[st] = {"error": str(e)}
+        return report
 
 
     # --- Chuẩn hóa input ---
-    def prepare_features(self, params: Dict[str, Any]) -> pd.DataFrame:
-        df = pd.DataFrame([[  
-            params["Ship_SpeedOverGround"],
-            params["Environment_SeaFloorDepth"],
-            params["Weather_Temperature2M"],
-            params["Weather_OceanCurrentVelocity"],
-            params["Weather_WindSpeed10M"],
-            params["Weather_WaveHeight"],
-            params["Weather_WavePeriod"],
-        ]], columns=self.FEATURES)
+    def prepare_features(self, params: Dict[str, Any]) -> np.ndarray:
+        """Ghi một dòng input vào mảng (1, len(FEATURES)) cấp phát sẵn, đúng thứ tự FEATURES."""
+        X = np.empty((1, len(self.FEATURES)), dtype=self.input_dtype)
+        row = X[0]
+        for j, name in enumerate(self.FEATURES):
+            row[j] = params[name]
+        # NaN/inf: mỗi framework (và bảng cây compiled) rẽ nhánh khác nhau -> từ chối
+        bad = np.flatnonzero(~np.isfinite(row))
+        if bad.size:
+            name = self.FEATURES[int(bad[0])]
+            raise ValueError(f"Invalid value for {name}: {params[name]!r}")
+        return X
+
+
+    def _row_to_vector(self, params: Dict[str, Any]) -> List[float]:
+        values = []
+        for name in self.FEATURES:
+            raw = params.get(name)
+            if raw is None:
+                raise ValueError(f"Missing feature: {name}")
+            try:
+                value = float(raw)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid value for {name}: {raw!r}")
+            if not math.isfinite(value):
+                raise ValueError(f"Invalid value for {name}: {raw!r}")
+            values.append(value)
+        return values
+
+
+    def _cache_key(self, st: str, values) -> Tuple:
+        rounded = tuple(round(float(v), d) for v, d in zip(values, self._cache_digits))
+        return (st, self._generations[st], rounded)
+
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.prediction_cache.stats()
+
+
+    def _model_input(self, model, X: np.ndarray):
+        # Model train bằng DataFrame sẽ kiểm tra tên cột -> bọc lại, không copy dữ liệu
+        if hasattr(model, "feature_names_in_"):
+            return pd.DataFrame(X, columns=self.FEATURES, copy=False)
+        return X
 
-        print("INPUT FED TO MODEL:")
-        print(df)
 
-        return df
+    def _get_pool(self) -> Optional[InferencePool]:
+        if not self.inference_workers:
+            return None
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = InferencePool(
+                        self.inference_workers,
+                        backend=self.backend,
+                        start_method=os.getenv("INFERENCE_START_METHOD", "spawn"),
+                    )
+        return self._pool
+
+
+    def _ensure_loaded(self, st: str) -> None:
+        # Key cache chứa generation của model -> cần model đã load ở process này.
+        # Với process pool, model nằm trong worker: chỉ cần biết version đang dùng.
+        if self.inference_workers:
+            self._pool_version(st)
+        else:
+            self.get_model(st)
+
+
+    def _predict_local(self, ship_type: str, X: np.ndarray) -> np.ndarray:
+        """Chạy một lần model.predict cho cả ma trận (n_rows, len(FEATURES))."""
+        model = self.get_model(ship_type)
+        pred = model.predict(self._model_input(model, X))
+        return np.asarray(pred, dtype=np.float64).reshape(-1)
+
+
+    def _predict_array(self, ship_type: str, X: np.ndarray) -> np.ndarray:
+        pool = self._get_pool()
+        if pool is not None:
+            return pool.predict(ship_type, X, self._pool_version(ship_type))
+        return self._predict_local(ship_type, X)
 
 
     # --- Predict ---
     def predict(self, params: Dict[str, Any]) -> float:
-        st = params["ship_type"].upper()
+        st = self._normalize_ship(params["ship_type"])
+        self._maybe_refresh()
+        X = self.prepare_features(params)
+
+        key = None
+        if self.prediction_cache.enabled:
+            # Load model trước để generation trong key là của model đang dùng
+            self._ensure_loaded(st)
+            key = self._cache_key(st, X[0])
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                return cached
+
+        # DataFrame chỉ được tạo khi model cần feature_names_in_ (xem _model_input)
+        value = float(self._predict_array(st, X)[0])
+        if key is not None:
+            self.prediction_cache.put(key, value)
+        return value
+
+
+    def predict_many(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Dự đoán cho nhiều dòng cùng lúc.
+
+        Các dòng được gom theo ship_type, mỗi nhóm chỉ gọi model.predict một lần.
+        Kết quả giữ đúng thứ tự input; dòng lỗi trả về {"index", "error"}
+        thay vì làm hỏng cả batch.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(rows)
+        vectors: List[Optional[List[float]]] = [None] * len(rows)
+        keys: List[Optional[Tuple]] = [None] * len(rows)
+        groups: Dict[str, List[int]] = {}
+        use_cache = self.prediction_cache.enabled
+        self._maybe_refresh()
+
+        for i, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("Row must be an object")
+                if not row.get("ship_type"):
+                    raise ValueError("Missing ship_type")
+                st = self._normalize_ship(row["ship_type"])
+                vectors[i] = self._row_to_vector(row)
+            except ValueError as e:
+                results[i] = {"index": i, "error": str(e)}
+                continue
+
+            if use_cache:
+                try:
+                    self._ensure_loaded(st)
+                except Exception as e:
+                    results[i] = {"index": i, "error": f"Prediction failed: {e}"}
+                    continue
+                keys[i] = self._cache_key(st, vectors[i])
+                cached = self.prediction_cache.get(keys[i])
+                if cached is not None:
+                    results[i] = {"index": i, "ship_type": st, "fuel_consumption": cached}
+                    continue
+            groups.setdefault(st, []).append(i)
+
+        for st, indices in groups.items():
+            X = np.empty((len(indices), len(self.FEATURES)), dtype=self.input_dtype)
+            for j, i in enumerate(indices):
+                X[j] = vectors[i]
+            try:
+                preds = self._predict_array(st, X)
+            except Exception as e:
+                for i in indices:
+                    results[i] = {"index": i, "error": f"Prediction failed: {e}"}
+                continue
+            for i, value in zip(indices, preds.tolist()):
+                results[i] = {"index": i, "ship_type": st, "fuel_consumption": value}
+                if keys[i] is not None:
+                    self.prediction_cache.put(keys[i], value)
+
+        return results  # type: ignore[return-value]
+
+
+    def speed_sweep(
+        self,
+        params: Dict[str, Any],
+        speed_min: float,
+        speed_max: float,
+        steps: int = 100,
+        distance_km: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Giữ cố định thời tiết/độ sâu, quét Ship_SpeedOverGround trên lưới đều
+        và dự đoán cả lưới bằng một lần predict.
+
+        Tốc độ tính bằng m/s, mức tiêu thụ bằng kg/s. Nếu có distance_km thì
+        tính thêm thời gian hành trình và tổng nhiên liệu = rate x thời gian.
+        """
+        if not params.get("ship_type"):
+            raise ValueError("Missing ship_type")
+        st = self._normalize_ship(params["ship_type"])
+        if steps < 2:
+            raise ValueError("steps must be at least 2")
+        if not (math.isfinite(speed_min) and math.isfinite(speed_max)) or speed_min >= speed_max:
+            raise ValueError("speed_min must be smaller than speed_max")
+        if distance_km is not None and (distance_km <= 0 or speed_min <= 0):
+            raise ValueError("distance_km and speed_min must be positive")
+        self._maybe_refresh()
 
-        # load model nếu chuyển loại tàu
-        if st != self.current_ship_type:
-            self.load_model_for_ship(st)
+        base = self._row_to_vector({**params, "Ship_SpeedOverGround": speed_min})
+        speeds = np.linspace(speed_min, speed_max, steps)
+        X = np.empty((steps, len(self.FEATURES)), dtype=self.input_dtype)
+        X[:] = base
+        X[:, self.FEATURES.index("Ship_SpeedOverGround")] = speeds
 
+        rates = self._predict_array(st, X)
+        best_rate = int(np.argmin(rates))
+        result: Dict[str, Any] = {
+            "ship_type": st,
+            "speeds": speeds.tolist(),
+            "fuel_rate": rates.tolist(),
+            "min_fuel_rate": {"speed": float(speeds[best_rate]), "fuel_rate": float(rates[best_rate])},
+        }
+
+        if distance_km is not None:
+            seconds = distance_km * 1000.0 / speeds
+            hours = seconds / 3600.0
+            totals = rates * seconds
+            best = int(np.argmin(totals))
+            result.update({
+                "distance_km": distance_km,
+                "voyage_time_h": hours.tolist(),
+                "total_fuel": totals.tolist(),
+                "optimal": {
+                    "speed": float(speeds[best]),
+                    "fuel_rate": float(rates[best]),
+                    "voyage_time_h": float(hours[best]),
+                    "total_fuel": float(totals[best]),
+                },
+            })
+        return result
+
+
+    def score_voyage(
+        self,
+        rows: Iterable[Dict[str, Any]],
+        ship_type: str,
+        chunk_size: int = 1024,
+        segment_seconds: float = 3600.0,
+        max_gap_seconds: Optional[float] = None,
+        max_errors: int = 20,
+    ) -> Dict[str, Any]:
+        """
+        Chấm điểm chuỗi thời gian của một hành trình theo từng chunk cố định
+        và tích phân mức tiêu thụ (kg/s) theo thời gian.
+
+        rows có thể là generator: chỉ một chunk được giữ trong bộ nhớ.
+        Dòng lỗi hoặc không tăng dần theo thời gian bị bỏ qua và đếm lại.
+        """
+        st = self._normalize_ship(ship_type)
+        self._maybe_refresh()
+        chunk_size = max(1, int(chunk_size))
+        integrator = VoyageIntegrator(segment_seconds, max_gap_seconds)
+
+        X = np.empty((chunk_size, len(self.FEATURES)), dtype=self.input_dtype)
+        times = np.empty(chunk_size, dtype=np.float64)
+        filled = 0
+        skipped = 0
+        errors: List[str] = []
+        last_time: Optional[float] = None
+
+        def flush(n: int) -> None:
+            rates = self._predict_array(st, X[:n])
+            integrator.add(times[:n].copy(), rates)
+
+        for line_no, row in enumerate(rows, 1):
+            try:
+                if "_error" in row:
+                    raise ValueError(row["_error"])
+                t = parse_timestamp(row)
+                if last_time is not None and t <= last_time:
+                    raise ValueError("Timestamp is not increasing")
+                X[filled] = self._row_to_vector(row)
+            except ValueError as e:
+                skipped += 1
+                if len(errors) < max_errors:
+                    errors.append(f"Row {line_no}: {e}")
+                continue
+
+            times[filled] = t
+            last_time = t
+            filled += 1
+            if filled == chunk_size:
+                flush(filled)
+                filled = 0
+
+        if filled:
+            flush(filled)
+
+        result = integrator.summary()
+        result.update({"ship_type": st, "skipped": skipped, "errors": errors})
+        return result
+
+
+    # --- API bất đồng bộ ---
+    async def apredict(self, params: Dict[str, Any]) -> float:
+        """Như predict() nhưng không chặn event loop."""
+        pool = self._get_pool()
+        if pool is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.predict, params)
+
+        st = self._normalize_ship(params["ship_type"])
+        self._maybe_refresh()
+        version = self._pool_version(st)
         X = self.prepare_features(params)
-        pred = self.model.predict(X)
-        return float(pred[0])
+        key = None
+        if self.prediction_cache.enabled:
+            key = self._cache_key(st, X[0])
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                return cached
+
+        pred = await asyncio.wrap_future(pool.submit(st, X, version))
+        value = float(pred[0])
+        if key is not None:
+            self.prediction_cache.put(key, value)
+        return value
+
+
+    async def apredict_many(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Phần nặng chạy trong worker process; thread chỉ chờ kết quả
+        return await asyncio.get_running_loop().run_in_executor(None, self.predict_many, rows)
+
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
 
 
     # --- Lấy embedding từ LM Studio ---
-    def get_embedding(self, text: str, retry_count: int = 3) -> List[float]:
+    def _post_embeddings(self, inputs: Any, retry_count: int = 3) -> List[List[float]]:
+        """Gọi /v1/embeddings; inputs là một chuỗi hoặc list chuỗi."""
         for attempt in range(retry_count):
             try:
-                response = requests.post(
+                response = self._http.post(
                     self.LM_STUDIO_URL,
                     json={
                         "model": self.EMBEDDING_MODEL,
-                        "input": text,
+                        "input": inputs,
                     },
                     headers={"Content-Type": "application/json"},
-                    timeout=30
+                    timeout=30 if isinstance(inputs, str) else 30 + len(inputs)
                 )
 
                 if response.status_code == 200:
-                    data = response.json()
-                    embedding = data["data"][0]["embedding"]
-
-                    print(f"Embedded text (len {len(text)} chars) -> dim {len(embedding)}")
-                    return embedding
+                    data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+                    return [item["embedding"] for item in data]
 
                 else:
                     print(f"Error: {response.status_code} - {response.text}")
@@ -111,6 +734,55 @@ class ModelService:
 
         raise Exception(f"Failed to get embedding after {retry_count} attempts")
 
+    def set_embedding_store(self, store: Any) -> None:
+        self.embedding_cache.attach_store(store)
+
+    def embedding_cache_stats(self) -> Dict[str, Any]:
+        return self.embedding_cache.stats()
+
+    def get_embedding(self, text: str, retry_count: int = 3) -> List[float]:
+        cached = self.embedding_cache.get_many(self.EMBEDDING_MODEL, [text])[0]
+        if cached is not None:
+            return cached
+        return self.embedding_flights.do(
+            (self.EMBEDDING_MODEL, text), lambda: self._embed_uncached(text, retry_count)
+        )
+
+    def _embed_uncached(self, text: str, retry_count: int) -> List[float]:
+        embedding = self._post_embeddings(text, retry_count)[0]
+        self.embedding_cache.put_many(self.EMBEDDING_MODEL, [text], [embedding])
+        print(f"Embedded text (len {len(text)} chars) -> dim {len(embedding)}")
+        return embedding
+
+    def get_embeddings(
+        self,
+        texts: List[str],
+        batch_size: Optional[int] = None,
+        retry_count: int = 3,
+    ) -> List[List[float]]:
+        """Embedding cho nhiều text, mỗi request gửi tối đa batch_size text (input dạng list)."""
+        model = self.EMBEDDING_MODEL
+        embeddings = self.embedding_cache.get_many(model, texts)
+        # Chỉ gửi text chưa có trong cache, mỗi text một lần
+        pending = list(dict.fromkeys(text for text, vector in zip(texts, embeddings) if vector is None))
+
+        batch_size = max(1, batch_size or self.embedding_batch_size)
+        computed: Dict[str, List[float]] = {}
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            vectors = self._post_embeddings(batch, retry_count)
+            if len(vectors) != len(batch):
+                raise Exception(f"Embedding server returned {len(vectors)} vectors for {len(batch)} inputs")
+            self.embedding_cache.put_many(model, batch, vectors)
+            computed.update(zip(batch, vectors))
+
+        if pending:
+            print(
+                f"Embedded {len(pending)}/{len(texts)} texts in batches of {batch_size} "
+                f"-> dim {len(next(iter(computed.values())))}"
+            )
+        return [vector if vector is not None else computed[text] for text, vector in zip(texts, embeddings)]
+
 
 # Create global instance
 model_service = ModelService()
@@ -0,0 +1,156 @@
+"""
+Kho model có version cho từng loại tàu.
+
+    models/store/
+        manifest.json
+        CETO/
+            v20260101-120000/model.joblib
+            v20260101-120000/model.trees.npz   (tùy chọn, từ export_compiled)
+
+manifest.json:
+    {"ships": {"CETO": {"active": "v...", "versions": {"v...": {"file": "model.joblib", ...}}}}}
+
+Manifest luôn được ghi bằng file tạm + os.replace nên process đọc không bao
+giờ thấy file ghi dở. Artifact được dump bằng joblib không nén để có thể load
+với mmap_mode="r": các mảng lớn của model được chia sẻ qua page cache giữa
+các worker thay vì mỗi worker giữ một bản riêng.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import joblib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+ARTIFACT_FILE = "model.joblib"
+
+
+class ModelStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock = threading.Lock()
+        self._cached_signature: Optional[Tuple[int, int, int]] = None
+        self._cached: Dict[str, Any] = {"ships": {}}
+
+    # --- Đọc manifest ---
+    def signature(self) -> Optional[Tuple[int, int, int]]:
+        """(mtime, inode, size) của manifest; đổi mỗi lần os.replace."""
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def read_manifest(self) -> Dict[str, Any]:
+        signature = self.signature()
+        if signature is None:
+            return {"ships": {}}
+        if signature != self._cached_signature:
+            with open(self.manifest_path, encoding="utf-8") as fh:
+                self._cached = json.load(fh)
+            self._cached_signature = signature
+        return self._cached
+
+    def active(self, ship_type: str) -> Optional[Dict[str, Any]]:
+        """{"version", "path", "mmap"} của version đang active, hoặc None."""
+        ship = self.read_manifest().get("ships", {}).get(ship_type)
+        if not ship or not ship.get("active"):
+            return None
+        return self._entry(ship_type, ship["active"], ship["versions"][ship["active"]])
+
+    def version(self, ship_type: str, version: str) -> Dict[str, Any]:
+        ship = self.read_manifest().get("ships", {}).get(ship_type) or {}
+        info = ship.get("versions", {}).get(version)
+        if info is None:
+            raise ValueError(f"Unknown version {version!r} for {ship_type}")
+        return self._entry(ship_type, version, info)
+
+    def describe(self, ship_type: str) -> Dict[str, Any]:
+        ship = self.read_manifest().get("ships", {}).get(ship_type) or {}
+        return {"active": ship.get("active"), "versions": sorted(ship.get("versions", {}))}
+
+    def _entry(self, ship_type: str, version: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "version": version,
+            "path": os.path.join(self.root, ship_type, version, info.get("file", ARTIFACT_FILE)),
+            "mmap": bool(info.get("mmap", False)),
+        }
+
+    # --- Ghi manifest ---
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = f"{self.manifest_path}.tmp.{os.getpid()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(manifest, fh, indent=2, ensure_ascii=False)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_path, self.manifest_path)
+        except BaseException:
+            # Manifest cũ vẫn nguyên vẹn; không để lại file tạm ghi dở
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _fresh_manifest(self) -> Dict[str, Any]:
+        # Đọc lại trực tiếp (không qua cache) khi đang giữ write lock
+        self._cached_signature = None
+        manifest = self.read_manifest()
+        return json.loads(json.dumps(manifest))
+
+    def publish(
+        self,
+        ship_type: str,
+        source_path: str,
+        version: Optional[str] = None,
+        activate: bool = False,
+    ) -> str:
+        """Thêm một version mới từ file model (pickle/joblib) đã train."""
+        version = version or datetime.now(timezone.utc).strftime("v%Y%m%d-%H%M%S")
+        target_dir = os.path.join(self.root, ship_type, version)
+        if os.path.exists(target_dir):
+            raise ValueError(f"Version {version!r} already exists for {ship_type}")
+
+        # Dump lại không nén để version này load được bằng mmap_mode="r"
+        model = joblib.load(source_path)
+        os.makedirs(target_dir)
+        joblib.dump(model, os.path.join(target_dir, ARTIFACT_FILE))
+
+        with self._write_lock():
+            manifest = self._fresh_manifest()
+            ship = manifest.setdefault("ships", {}).setdefault(ship_type, {"active": None, "versions": {}})
+            ship["versions"][version] = {
+                "file": ARTIFACT_FILE,
+                "mmap": True,
+                "source": os.path.basename(source_path),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            if activate or not ship.get("active"):
+                ship["active"] = version
+            self._write_manifest(manifest)
+        return version
+
+    def set_active(self, ship_type: str, version: str) -> None:
+        with self._write_lock():
+            manifest = self._fresh_manifest()
+            ship = manifest.get("ships", {}).get(ship_type)
+            if not ship or version not in ship.get("versions", {}):
+                raise ValueError(f"Unknown version {version!r} for {ship_type}")
+            ship["active"] = version
+            self._write_manifest(manifest)
@@ -0,0 +1,125 @@
+"""
+Gộp các request giống hệt nhau đang chạy đồng thời (single-flight).
+
+Call đầu tiên với một key là leader và thực sự gọi upstream; các call cùng
+key đến khi leader chưa xong chỉ chờ kết quả của nó (tối đa wait_seconds)
+và nhận cùng giá trị hoặc cùng exception. Leader xong thì key được gỡ ngay,
+call sau đó sẽ gọi upstream mới (không phải cache).
+
+Leader bị hủy (CancelledError, KeyboardInterrupt...) thì follower không nhận
+lại việc hủy đó: một follower đứng ra làm leader mới và gọi upstream, các
+follower còn lại chờ leader mới.
+
+Registry dùng concurrent.futures.Future nên thread và coroutine (trên bất kỳ
+event loop nào) gộp chung được với nhau.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _LeaderCancelled(Exception):
+    """Gửi cho follower khi leader bị hủy: follower thử lại để làm leader mới."""
+
+
+def payload_key(payload: Any) -> str:
+    """Key ổn định của payload JSON (thứ tự key trong dict không ảnh hưởng)."""
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, wait_seconds: Optional[float] = None):
+        # wait_seconds: thời gian tối đa follower chờ leader (None = chờ đến khi xong)
+        self.wait_seconds = wait_seconds
+        self._calls: Dict[Hashable, "concurrent.futures.Future[Any]"] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.takeovers = 0
+
+    def _join(self, key: Hashable) -> Tuple["concurrent.futures.Future[Any]", bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: "concurrent.futures.Future[Any]", result: Any = None,
+                error: Optional[BaseException] = None) -> None:
+        # Gỡ key trước khi trả kết quả: call đến sau thời điểm này là một flight mới
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None and not isinstance(error, Exception):
+            # Hủy chỉ áp dụng cho leader, không lan sang follower
+            future.set_exception(_LeaderCancelled())
+        elif error is not None:
+            self.errors += 1
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Bản cho thread: fn() chỉ chạy ở leader."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = fn()
+                except BaseException as e:
+                    self._finish(key, future, error=e)
+                    raise
+                self._finish(key, future, result)
+                return result
+            try:
+                return future.result(self.wait_seconds)
+            except _LeaderCancelled:
+                self.takeovers += 1
+            except concurrent.futures.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"Timed out after {self.wait_seconds}s waiting for in-flight request") from None
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Bản cho coroutine: await fn() chỉ chạy ở leader."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                try:
+                    result = await fn()
+                except BaseException as e:
+                    self._finish(key, future, error=e)
+                    raise
+                self._finish(key, future, result)
+                return result
+            try:
+                # shield: follower hết giờ / bị hủy không được hủy Future dùng chung
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.wait_seconds)
+            except _LeaderCancelled:
+                self.takeovers += 1
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"Timed out after {self.wait_seconds}s waiting for in-flight request") from None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls)
+        calls = self.leaders + self.coalesced
+        return {
+            "in_flight": in_flight,
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "takeovers": self.takeovers,
+            "coalesced_ratio": round(self.coalesced / calls, 4) if calls else 0.0,
+        }
@@ -0,0 +1,488 @@
+"""
+Biên dịch ensemble cây (scikit-learn, XGBoost, LightGBM, CatBoost) thành bảng
+mảng phẳng và đánh giá bằng NumPy thuần.
+
+Mỗi node có: feature (-1 nếu là lá), threshold, left, right, value.
+Khi load, node được sắp lại để con phải luôn nằm ngay sau con trái; lá trỏ
+về chính nó với threshold = +inf. Nhờ vậy mọi (hàng, cây) được duyệt đồng
+thời đúng `max_depth` bước chỉ bằng gather + so sánh, không rẽ nhánh.
+
+Module này chỉ import NumPy; thư viện ML chỉ cần lúc export (compile_model).
+"""
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class UnsupportedModelError(ValueError):
+    """Model không thể biên dịch sang bảng cây (loại model, objective, categorical...)."""
+
+
+class CompiledEnsemble:
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int,
+        base_score: float = 0.0,
+        scale: float = 1.0,
+        inclusive: bool = True,
+        input_dtype: str = "float64",
+        source: str = "",
+    ):
+        self.feature = np.ascontiguousarray(feature, dtype=np.int32)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.int32)
+        self.right = np.ascontiguousarray(right, dtype=np.int32)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+        self.base_score = float(base_score)
+        self.scale = float(scale)
+        # True: sang trái khi x <= threshold; False: khi x < threshold (XGBoost)
+        self.inclusive = bool(inclusive)
+        # Framework gốc so sánh trên float32 hay float64
+        self.input_dtype = np.dtype(input_dtype)
+        self.source = source
+        self._build_eval_layout()
+
+    def _build_eval_layout(self) -> None:
+        # Đánh số lại node theo BFS: hai con của một node luôn liền kề nhau
+        order: List[int] = []
+        new_id = np.full(self.n_nodes, -1, dtype=np.int64)
+        for root in self.roots.tolist():
+            new_id[root] = len(order)
+            order.append(root)
+            head = len(order) - 1
+            while head < len(order):
+                node = order[head]
+                head += 1
+                if self.feature[node] < 0:
+                    continue
+                for child in (int(self.left[node]), int(self.right[node])):
+                    new_id[child] = len(order)
+                    order.append(child)
+
+        order_arr = np.array(order, dtype=np.int64)
+        is_leaf = self.feature[order_arr] < 0
+        own = np.arange(len(order_arr))
+        self._eval_feature = np.where(is_leaf, 0, self.feature[order_arr]).astype(np.intp)
+        # Lá: threshold +inf -> không bao giờ rẽ phải, đứng yên tại chỗ
+        self._eval_threshold = np.where(is_leaf, np.inf, self.threshold[order_arr])
+        self._eval_child = np.where(is_leaf, own, new_id[self.left[order_arr]]).astype(np.intp)
+        self._eval_value = np.where(is_leaf, self.value[order_arr], 0.0)
+        self._eval_roots = new_id[self.roots].astype(np.intp)
+
+    @property
+    def n_trees(self) -> int:
+        return int(self.roots.shape[0])
+
+    @property
+    def n_nodes(self) -> int:
+        return int(self.feature.shape[0])
+
+    def predict(self, X, block_rows: int = 256) -> np.ndarray:
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        # Ép về dtype của framework gốc trước khi so sánh để khớp ngưỡng split
+        X = np.ascontiguousarray(X, dtype=self.input_dtype).astype(np.float64, copy=False)
+        # Bảng cây không có hướng mặc định cho giá trị thiếu: NaN sẽ rẽ nhánh tùy ý
+        if not np.isfinite(X).all():
+            raise ValueError("Compiled ensemble does not support NaN or infinite inputs")
+
+        out = np.empty(X.shape[0], dtype=np.float64)
+        # Chia block để ma trận (hàng x cây) nằm gọn trong cache
+        for start in range(0, X.shape[0], block_rows):
+            out[start:start + block_rows] = self._predict_block(X[start:start + block_rows])
+        return out * self.scale + self.base_score
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        n_rows, n_cols = X.shape
+        flat = X.reshape(-1)
+        row_offset = (np.arange(n_rows, dtype=np.intp) * n_cols)[:, None]
+        idx = np.broadcast_to(self._eval_roots, (n_rows, self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            x = flat[row_offset + self._eval_feature[idx]]
+            t = self._eval_threshold[idx]
+            go_right = x > t if self.inclusive else x >= t
+            idx = self._eval_child[idx] + go_right
+        return self._eval_value[idx].sum(axis=1)
+
+    # --- Lưu / load bảng cây ---
+    def save(self, path: str) -> None:
+        meta = {
+            "max_depth": self.max_depth,
+            "base_score": self.base_score,
+            "scale": self.scale,
+            "inclusive": self.inclusive,
+            "input_dtype": self.input_dtype.name,
+            "source": self.source,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            np.savez(
+                fh,
+                feature=self.feature,
+                threshold=self.threshold,
+                left=self.left,
+                right=self.right,
+                value=self.value,
+                roots=self.roots,
+                meta=np.array(json.dumps(meta)),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledEnsemble":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(
+                feature=data["feature"],
+                threshold=data["threshold"],
+                left=data["left"],
+                right=data["right"],
+                value=data["value"],
+                roots=data["roots"],
+                **meta,
+            )
+
+
+class _TableBuilder:
+    def __init__(self):
+        self.feature: List[int] = []
+        self.threshold: List[float] = []
+        self.left: List[int] = []
+        self.right: List[int] = []
+        self.value: List[float] = []
+        self.roots: List[int] = []
+        self.max_depth = 0
+
+    def leaf(self, value: float) -> int:
+        i = len(self.feature)
+        self.feature.append(-1)
+        self.threshold.append(0.0)
+        self.left.append(i)
+        self.right.append(i)
+        self.value.append(float(value))
+        return i
+
+    def split(self, feature: int, threshold: float) -> int:
+        i = self.leaf(0.0)
+        self.feature[i] = int(feature)
+        self.threshold[i] = float(threshold)
+        return i
+
+    def link(self, node: int, left: int, right: int) -> None:
+        self.left[node] = left
+        self.right[node] = right
+
+    def add_root(self, node: int, depth: int) -> None:
+        self.roots.append(node)
+        self.max_depth = max(self.max_depth, depth)
+
+    def add_arrays(self, feature, threshold, left, right, value, depth: int) -> None:
+        """Thêm một cây đã ở dạng mảng (-1 ở left/right nghĩa là lá)."""
+        offset = len(self.feature)
+        left = np.asarray(left, dtype=np.int64)
+        right = np.asarray(right, dtype=np.int64)
+        own = np.arange(len(left)) + offset
+        is_leaf = left < 0
+        self.feature.extend(np.where(is_leaf, -1, feature).tolist())
+        self.threshold.extend(np.where(is_leaf, 0.0, threshold).tolist())
+        self.left.extend(np.where(is_leaf, own, left + offset).tolist())
+        self.right.extend(np.where(is_leaf, own, right + offset).tolist())
+        self.value.extend(np.where(is_leaf, value, 0.0).tolist())
+        self.add_root(offset, depth)
+
+    def build(self, **kwargs) -> CompiledEnsemble:
+        if not self.roots:
+            raise UnsupportedModelError("Model has no trees")
+        return CompiledEnsemble(
+            feature=np.array(self.feature),
+            threshold=np.array(self.threshold),
+            left=np.array(self.left),
+            right=np.array(self.right),
+            value=np.array(self.value),
+            roots=np.array(self.roots),
+            max_depth=self.max_depth,
+            **kwargs,
+        )
+
+
+def _feature_index_map(names: Optional[Sequence[str]], features: Sequence[str]) -> Dict[str, int]:
+    """Map tên feature của model -> vị trí cột trong `features`."""
+    if names is None:
+        return {}
+    mapping = {}
+    for name in names:
+        name = str(name)
+        if name not in features:
+            raise UnsupportedModelError(f"Model feature {name!r} is not in FEATURES")
+        mapping[name] = list(features).index(name)
+    return mapping
+
+
+# --- scikit-learn ---
+def _sklearn_columns(model, features: Sequence[str]) -> np.ndarray:
+    names = getattr(model, "feature_names_in_", None)
+    if names is None:
+        return np.arange(model.n_features_in_)
+    mapping = _feature_index_map(list(names), features)
+    return np.array([mapping[str(name)] for name in names])
+
+
+def _add_sklearn_tree(builder: _TableBuilder, tree, columns: np.ndarray, weight: float = 1.0) -> None:
+    t = tree.tree_
+    if t.value.shape[1] != 1:
+        raise UnsupportedModelError("Multi-output trees are not supported")
+    feature = np.where(t.feature >= 0, columns[np.maximum(t.feature, 0)], -1)
+    builder.add_arrays(
+        feature,
+        t.threshold,
+        t.children_left,
+        t.children_right,
+        t.value[:, 0, 0] * weight,
+        depth=t.max_depth,
+    )
+
+
+def _compile_sklearn(model, features: Sequence[str]) -> CompiledEnsemble:
+    from sklearn.ensemble import (
+        ExtraTreesRegressor,
+        GradientBoostingRegressor,
+        HistGradientBoostingRegressor,
+        RandomForestRegressor,
+    )
+    from sklearn.tree import DecisionTreeRegressor, ExtraTreeRegressor
+
+    columns = _sklearn_columns(model, features)
+    builder = _TableBuilder()
+
+    # Cây sklearn so sánh X đã ép float32 với threshold float64
+    if isinstance(model, (DecisionTreeRegressor, ExtraTreeRegressor)):
+        _add_sklearn_tree(builder, model, columns)
+        return builder.build(input_dtype="float32", source=type(model).__name__)
+
+    if isinstance(model, (RandomForestRegressor, ExtraTreesRegressor)):
+        for tree in model.estimators_:
+            _add_sklearn_tree(builder, tree, columns)
+        return builder.build(
+            scale=1.0 / len(model.estimators_),
+            input_dtype="float32",
+            source=type(model).__name__,
+        )
+
+    if isinstance(model, GradientBoostingRegressor):
+        if model.init_ == "zero":
+            base = 0.0
+        elif hasattr(model.init_, "constant_"):
+            base = float(np.ravel(model.init_.constant_)[0])
+        else:
+            raise UnsupportedModelError("Custom init estimators are not supported")
+        for tree in model.estimators_[:, 0]:
+            _add_sklearn_tree(builder, tree, columns, weight=model.learning_rate)
+        return builder.build(base_score=base, input_dtype="float32", source=type(model).__name__)
+
+    if isinstance(model, HistGradientBoostingRegressor):
+        if model.loss not in ("squared_error", "absolute_error", "quantile"):
+            raise UnsupportedModelError(f"Unsupported HistGradientBoosting loss: {model.loss}")
+        for predictors in model._predictors:
+            nodes = predictors[0].nodes
+            if nodes["is_categorical"].any():
+                raise UnsupportedModelError("Categorical splits are not supported")
+            is_leaf = nodes["is_leaf"].astype(bool)
+            feature = np.where(is_leaf, -1, columns[nodes["feature_idx"]])
+            builder.add_arrays(
+                feature,
+                nodes["num_threshold"],
+                np.where(is_leaf, -1, nodes["left"].astype(np.int64)),
+                np.where(is_leaf, -1, nodes["right"].astype(np.int64)),
+                nodes["value"],
+                depth=int(nodes["depth"].max()),
+            )
+        base = float(np.ravel(model._baseline_prediction)[0])
+        return builder.build(base_score=base, input_dtype="float64", source=type(model).__name__)
+
+    raise UnsupportedModelError(f"Unsupported scikit-learn model: {type(model).__name__}")
+
+
+# --- XGBoost ---
+def _parse_xgb_base_score(raw) -> float:
+    text = str(raw).strip().strip("[]")
+    return float(text.split(",")[0])
+
+
+def _compile_xgboost(model, features: Sequence[str]) -> CompiledEnsemble:
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    config = json.loads(booster.save_config())
+    learner = config["learner"]
+    objective = learner["objective"]["name"]
+    if objective not in ("reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror", "reg:quantileerror"):
+        raise UnsupportedModelError(f"Unsupported XGBoost objective: {objective}")
+    if learner["gradient_booster"]["name"] != "gbtree":
+        raise UnsupportedModelError("Only the gbtree booster is supported")
+
+    names = booster.feature_names
+    mapping = _feature_index_map(names, features)
+
+    def column(split: str) -> int:
+        if mapping:
+            return mapping[split]
+        return int(split.lstrip("f"))
+
+    builder = _TableBuilder()
+
+    def add(node: Dict[str, Any], depth: int):
+        if "leaf" in node:
+            return builder.leaf(node["leaf"]), depth
+        if "split_condition" not in node:
+            raise UnsupportedModelError("Categorical splits are not supported")
+        i = builder.split(column(node["split"]), np.float32(node["split_condition"]))
+        children = {child["nodeid"]: child for child in node["children"]}
+        left, dl = add(children[node["yes"]], depth + 1)
+        right, dr = add(children[node["no"]], depth + 1)
+        builder.link(i, left, right)
+        return i, max(dl, dr)
+
+    dumps = booster.get_dump(dump_format="json")
+    # predict() của XGBRegressor chỉ dùng cây tới best_iteration khi train có early stopping
+    if hasattr(model, "get_booster"):
+        try:
+            best_iteration = model.best_iteration
+        except AttributeError:
+            best_iteration = None
+        if best_iteration is not None:
+            per_iteration = int(learner["gradient_booster"]["gbtree_model_param"]["num_parallel_tree"])
+            dumps = dumps[:(best_iteration + 1) * per_iteration]
+
+    for dump in dumps:
+        root, depth = add(json.loads(dump), 0)
+        builder.add_root(root, depth)
+
+    base = _parse_xgb_base_score(learner["learner_model_param"]["base_score"])
+    # XGBoost: sang nhánh "yes" khi x < split_condition, so sánh trên float32
+    return builder.build(base_score=base, inclusive=False, input_dtype="float32", source="xgboost")
+
+
+# --- LightGBM ---
+def _compile_lightgbm(model, features: Sequence[str]) -> CompiledEnsemble:
+    booster = model.booster_ if hasattr(model, "booster_") else model
+    # Giống Booster.predict mặc định: chỉ tới best_iteration nếu train có early stopping
+    best_iteration = booster.best_iteration if booster.best_iteration > 0 else -1
+    dump = booster.dump_model(num_iteration=best_iteration)
+    objective = str(dump.get("objective", "")).split(" ")[0]
+    if objective not in ("regression", "regression_l1", "huber", "fair", "quantile"):
+        raise UnsupportedModelError(f"Unsupported LightGBM objective: {objective}")
+
+    mapping = _feature_index_map(dump.get("feature_names"), features)
+    names = dump.get("feature_names") or []
+    builder = _TableBuilder()
+
+    def add(node: Dict[str, Any], depth: int):
+        if "leaf_value" in node:
+            if "leaf_coeff" in node:
+                raise UnsupportedModelError("Linear trees are not supported")
+            return builder.leaf(node["leaf_value"]), depth
+        if node.get("decision_type") != "<=":
+            raise UnsupportedModelError("Categorical splits are not supported")
+        feat = node["split_feature"]
+        col = mapping[names[feat]] if mapping else feat
+        i = builder.split(col, node["threshold"])
+        left, dl = add(node["left_child"], depth + 1)
+        right, dr = add(node["right_child"], depth + 1)
+        builder.link(i, left, right)
+        return i, max(dl, dr)
+
+    trees = dump["tree_info"]
+    if best_iteration > 0:
+        trees = trees[:best_iteration * dump.get("num_tree_per_iteration", 1)]
+    for tree in trees:
+        root, depth = add(tree["tree_structure"], 0)
+        builder.add_root(root, depth)
+
+    scale = 1.0 / len(builder.roots) if dump.get("average_output") else 1.0
+    return builder.build(scale=scale, input_dtype="float64", source="lightgbm")
+
+
+# --- CatBoost ---
+def _compile_catboost(model, features: Sequence[str]) -> CompiledEnsemble:
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        model.save_model(path, format="json")
+        with open(path, encoding="utf-8") as fh:
+            dump = json.load(fh)
+    finally:
+        os.remove(path)
+
+    if "oblivious_trees" not in dump:
+        raise UnsupportedModelError("Only symmetric (oblivious) CatBoost trees are supported")
+    float_features = dump["features_info"].get("float_features", [])
+    if dump["features_info"].get("categorical_features"):
+        raise UnsupportedModelError("Categorical features are not supported")
+
+    names = model.feature_names_ if getattr(model, "feature_names_", None) else None
+    # Train bằng ndarray thì CatBoost tự đặt tên "0", "1", ... -> coi là vị trí cột
+    if names and all(str(name).isdigit() for name in names):
+        names = None
+    mapping = _feature_index_map(names, features)
+
+    def column(float_index: int) -> int:
+        flat = float_features[float_index]["flat_feature_index"]
+        return mapping[names[flat]] if mapping else flat
+
+    builder = _TableBuilder()
+    for tree in dump["oblivious_trees"]:
+        splits = tree["splits"]
+        leaf_values = tree["leaf_values"]
+        depth = len(splits)
+        if len(leaf_values) != 2 ** depth:
+            raise UnsupportedModelError("Multi-dimensional CatBoost leaves are not supported")
+
+        # Split thứ l quyết định bit l của chỉ số lá: bit = 1 khi x > border
+        def add(level: int, leaf_index: int) -> int:
+            if level == depth:
+                return builder.leaf(leaf_values[leaf_index])
+            split = splits[level]
+            if split.get("split_type", "FloatFeature") != "FloatFeature":
+                raise UnsupportedModelError("Only float feature splits are supported")
+            i = builder.split(column(split["float_feature_index"]), np.float32(split["border"]))
+            left = add(level + 1, leaf_index)
+            right = add(level + 1, leaf_index | (1 << level))
+            builder.link(i, left, right)
+            return i
+
+        builder.add_root(add(0, 0), depth)
+
+    scale, bias = dump.get("scale_and_bias", [1.0, [0.0]])
+    bias = float(np.ravel(bias)[0]) if np.ndim(bias) else float(bias)
+    return builder.build(base_score=bias, scale=scale, input_dtype="float32", source="catboost")
+
+
+def compile_model(model, features: Sequence[str]) -> CompiledEnsemble:
+    """Chuyển model đã train thành CompiledEnsemble; raise UnsupportedModelError nếu không hỗ trợ."""
+    module = type(model).__module__.split(".")[0]
+    if module == "sklearn":
+        return _compile_sklearn(model, features)
+    if module == "xgboost":
+        return _compile_xgboost(model, features)
+    if module == "lightgbm":
+        return _compile_lightgbm(model, features)
+    if module == "catboost":
+        return _compile_catboost(model, features)
+    raise UnsupportedModelError(f"Unsupported model type: {type(model).__module__}.{type(model).__name__}")
+
+
+def max_abs_error(model, compiled: CompiledEnsemble, X, model_input=None) -> float:
+    """Sai số tuyệt đối lớn nhất giữa model gốc và bản biên dịch trên X."""
+    expected = np.asarray(model.predict(model_input if model_input is not None else X), dtype=np.float64).reshape(-1)
+    actual = compiled.predict(X)
+    return float(np.max(np.abs(expected - actual))) if expected.size else 0.0
@@ -0,0 +1,47 @@
+"""
+Định dạng lưu embedding gọn hơn double precision[].
+
+  - float32: bytes little-endian "<f4" (4 byte/chiều), decode bằng
+    np.frombuffer không copy
+  - int8: lượng tử hóa đối xứng theo từng vector, x ~= q * scale với
+    scale = max|x| / 127 (1 byte/chiều + một float)
+"""
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+F32 = np.dtype("<f4")
+
+
+def encode_f32(vector: Sequence[float]) -> bytes:
+    return np.asarray(vector, dtype=F32).tobytes()
+
+
+def decode_f32(buf: Optional[bytes]) -> Optional[np.ndarray]:
+    if buf is None:
+        return None
+    return np.frombuffer(buf, dtype=F32)
+
+
+def quantize_i8(vector: Sequence[float]) -> Tuple[bytes, float]:
+    """(bytes int8, scale) của một vector."""
+    arr = np.asarray(vector, dtype=np.float32)
+    peak = float(np.abs(arr).max()) if arr.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    q = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8)
+    return q.tobytes(), scale
+
+
+def decode_i8(buf: Optional[bytes], scale: Optional[float]) -> Optional[np.ndarray]:
+    if buf is None or scale is None:
+        return None
+    return np.frombuffer(buf, dtype=np.int8).astype(np.float32) * np.float32(scale)
+
+
+def quantize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Lượng tử hóa từng dòng của ma trận float32: (int8 matrix, scales float32)."""
+    peak = np.abs(matrix).max(axis=1) if matrix.size else np.zeros(matrix.shape[0], dtype=np.float32)
+    scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+    q = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales
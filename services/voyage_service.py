@@ -0,0 +1,157 @@
+"""
+Đọc log hành trình (CSV/NDJSON) theo kiểu streaming và tích phân mức tiêu
+thụ tức thời (kg/s) theo thời gian để ra tổng nhiên liệu.
+"""
+import csv
+import io
+import json
+import math
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+TIMESTAMP_FIELDS = ("timestamp", "time", "datetime")
+# Khoảng datetime biểu diễn được; epoch ngoài khoảng này làm _iso() lỗi
+MIN_TIMESTAMP = datetime(1, 1, 2, tzinfo=timezone.utc).timestamp()
+MAX_TIMESTAMP = datetime(9999, 12, 30, tzinfo=timezone.utc).timestamp()
+
+
+def detect_format(content_type: Optional[str], filename: Optional[str]) -> str:
+    name = (filename or "").lower()
+    ctype = (content_type or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in ctype or "jsonl" in ctype:
+        return "ndjson"
+    return "csv"
+
+
+def iter_voyage_rows(stream: IO[bytes], fmt: str = "csv") -> Iterator[Dict[str, Any]]:
+    """Đọc từng dòng từ stream nhị phân; không giữ cả file trong bộ nhớ."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+
+    for line_no, line in enumerate(text, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            yield {"_error": f"Line {line_no}: invalid JSON"}
+            continue
+        yield row if isinstance(row, dict) else {"_error": f"Line {line_no}: expected an object"}
+
+
+def parse_timestamp(row: Dict[str, Any]) -> float:
+    """Trả về epoch seconds từ số (epoch) hoặc chuỗi ISO 8601."""
+    raw = next((row[f] for f in TIMESTAMP_FIELDS if row.get(f) not in (None, "")), None)
+    if raw is None:
+        raise ValueError("Missing timestamp")
+    if isinstance(raw, (int, float)):
+        value = float(raw)
+    else:
+        text = str(raw).strip()
+        try:
+            value = float(text)
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+            except ValueError:
+                raise ValueError(f"Invalid timestamp: {raw!r}")
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            value = parsed.timestamp()
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid timestamp: {raw!r}")
+    if not MIN_TIMESTAMP <= value <= MAX_TIMESTAMP:
+        raise ValueError(f"Timestamp out of range: {raw!r}")
+    return value
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+class VoyageIntegrator:
+    """
+    Cộng dồn nhiên liệu theo quy tắc hình thang giữa các mốc thời gian liên tiếp.
+
+    Khoảng [t_i, t_{i+1}] được tính vào segment chứa t_i. Khoảng lớn hơn
+    max_gap_seconds (mất tín hiệu) bị bỏ qua thay vì nội suy.
+    """
+
+    def __init__(self, segment_seconds: float = 3600.0, max_gap_seconds: Optional[float] = None):
+        if not math.isfinite(segment_seconds) or segment_seconds <= 0:
+            raise ValueError("segment_seconds must be a positive number")
+        self.segment_seconds = float(segment_seconds)
+        self.max_gap_seconds = max_gap_seconds
+        self.start: Optional[float] = None
+        self.last_time: Optional[float] = None
+        self.last_rate: Optional[float] = None
+        self.total_fuel = 0.0
+        self.samples = 0
+        self.gaps = 0
+        self._segments: Dict[int, Dict[str, float]] = {}
+
+    def add(self, times: np.ndarray, rates: np.ndarray) -> None:
+        """Thêm một chunk (times tăng dần, nối tiếp chunk trước)."""
+        if times.size == 0:
+            return
+        if self.start is None:
+            self.start = float(times[0])
+
+        if self.last_time is not None:
+            times = np.concatenate(([self.last_time], times))
+            rates = np.concatenate(([self.last_rate], rates))
+            new_samples = times.size - 1
+        else:
+            new_samples = times.size
+
+        dt = np.diff(times)
+        fuel = (rates[:-1] + rates[1:]) * 0.5 * dt
+        if self.max_gap_seconds is not None:
+            gap = dt > self.max_gap_seconds
+            self.gaps += int(gap.sum())
+            fuel = np.where(gap, 0.0, fuel)
+
+        segment_ids = ((times[:-1] - self.start) // self.segment_seconds).astype(np.int64)
+        for seg_id in np.unique(segment_ids).tolist():
+            mask = segment_ids == seg_id
+            seg = self._segments.setdefault(seg_id, {"fuel": 0.0, "samples": 0})
+            seg["fuel"] += float(fuel[mask].sum())
+            seg["samples"] += int(mask.sum())
+
+        self.total_fuel += float(fuel.sum())
+        self.samples += new_samples
+        self.last_time = float(times[-1])
+        self.last_rate = float(rates[-1])
+
+    def summary(self) -> Dict[str, Any]:
+        segments: List[Dict[str, Any]] = []
+        cumulative = 0.0
+        for seg_id in sorted(self._segments):
+            seg = self._segments[seg_id]
+            cumulative += seg["fuel"]
+            seg_start = self.start + seg_id * self.segment_seconds
+            segments.append({
+                "start": _iso(seg_start),
+                "end": _iso(min(seg_start + self.segment_seconds, self.last_time)),
+                "fuel": seg["fuel"],
+                "cumulative_fuel": cumulative,
+                "intervals": seg["samples"],
+            })
+
+        duration = (self.last_time - self.start) if self.start is not None else 0.0
+        return {
+            "samples": self.samples,
+            "start": _iso(self.start) if self.start is not None else None,
+            "end": _iso(self.last_time) if self.last_time is not None else None,
+            "duration_s": duration,
+            "total_fuel": self.total_fuel,
+            "mean_fuel_rate": self.total_fuel / duration if duration > 0 else None,
+            "gaps_skipped": self.gaps,
+            "segments": segments,
+        }
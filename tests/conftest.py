@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cho phép chạy `python -m pytest` từ thư mục gốc mà không cần cài package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from services.admission import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionController,
+    LLMOverloadedError,
+)
+
+
+async def _hold(controller, priority, order, name, release):
+    async with controller.slot(priority):
+        order.append(name)
+        await release.wait()
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_immediately_under_limit():
+    async def main():
+        controller = AdmissionController(max_concurrency=2, max_queue=0, queue_timeout=1)
+        async with controller.slot():
+            async with controller.slot(PRIORITY_BATCH):
+                assert controller.stats()["active"] == 2
+        return controller.stats()
+
+    stats = asyncio.run(main())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+    assert stats["queue_depth"] == 0
+
+
+def test_interactive_before_batch_then_fifo():
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=10, queue_timeout=5)
+        order, gate, done = [], asyncio.Event(), asyncio.Event()
+        done.set()
+        holder = asyncio.create_task(_hold(controller, PRIORITY_INTERACTIVE, order, "holder", gate))
+        await _settle()
+        waiters = []
+        for name, priority in (("b1", PRIORITY_BATCH), ("i1", PRIORITY_INTERACTIVE),
+                               ("b2", PRIORITY_BATCH), ("i2", PRIORITY_INTERACTIVE)):
+            waiters.append(asyncio.create_task(_hold(controller, priority, order, name, done)))
+            await _settle()
+        assert controller.stats()["queued"] == {"interactive": 2, "batch": 2}
+        gate.set()
+        await asyncio.gather(holder, *waiters)
+        return order, controller.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["holder", "i1", "i2", "b1", "b2"]
+    assert stats["admitted"] == 5
+    assert stats["active"] == 0
+
+
+def test_full_queue_evicts_batch_for_interactive():
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+        order, gate, done = [], asyncio.Event(), asyncio.Event()
+        done.set()
+        holder = asyncio.create_task(_hold(controller, PRIORITY_INTERACTIVE, order, "holder", gate))
+        await _settle()
+        batch = asyncio.create_task(_hold(controller, PRIORITY_BATCH, order, "batch", done))
+        await _settle()
+        interactive = asyncio.create_task(_hold(controller, PRIORITY_INTERACTIVE, order, "interactive", done))
+        await _settle()
+        with pytest.raises(LLMOverloadedError) as excinfo:
+            await batch
+        gate.set()
+        await asyncio.gather(holder, interactive)
+        return excinfo.value, order, controller.stats()
+
+    error, order, stats = asyncio.run(main())
+    assert "preempted" in str(error)
+    assert error.retry_after >= 1
+    assert order == ["holder", "interactive"]
+    assert stats["evicted"] == 1
+    assert stats["rejected"] == 0
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.parametrize("queued_priority, new_priority", [
+    (PRIORITY_BATCH, PRIORITY_BATCH),
+    (PRIORITY_INTERACTIVE, PRIORITY_INTERACTIVE),
+    (PRIORITY_INTERACTIVE, PRIORITY_BATCH),
+])
+def test_full_queue_rejects_same_or_lower_priority(queued_priority, new_priority):
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+        order, gate = [], asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, PRIORITY_INTERACTIVE, order, "holder", gate))
+        await _settle()
+        queued = asyncio.create_task(_hold(controller, queued_priority, order, "queued", gate))
+        await _settle()
+        with pytest.raises(LLMOverloadedError) as excinfo:
+            async with controller.slot(new_priority):
+                pass
+        gate.set()
+        await asyncio.gather(holder, queued)
+        return excinfo.value, order, controller.stats()
+
+    error, order, stats = asyncio.run(main())
+    assert "queue full" in str(error)
+    assert order == ["holder", "queued"]
+    assert stats["rejected"] == 1
+    assert stats["evicted"] == 0
+
+
+def test_queue_timeout_raises_overloaded_and_withdraws():
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+        order, gate = [], asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, PRIORITY_INTERACTIVE, order, "holder", gate))
+        await _settle()
+        with pytest.raises(LLMOverloadedError) as excinfo:
+            async with controller.slot():
+                pass
+        during = controller.stats()
+        gate.set()
+        await holder
+        # Waiter đã rút khỏi hàng, slot được trả về chứ không trao cho nó
+        async with controller.slot():
+            pass
+        return excinfo.value, during, controller.stats()
+
+    error, during, stats = asyncio.run(main())
+    assert "waited more than" in str(error)
+    assert during["timeouts"] == 1
+    assert during["queue_depth"] == 0
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def main():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+        order, gate = [], asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, PRIORITY_INTERACTIVE, order, "holder", gate))
+        await _settle()
+        waiter = asyncio.create_task(_hold(controller, PRIORITY_BATCH, order, "waiter", gate))
+        await _settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        gate.set()
+        await holder
+        return order, controller.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["holder"]
+    assert stats["active"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def test_retry_after_grows_with_queue_depth():
+    controller = AdmissionController(max_concurrency=2, max_queue=10, queue_timeout=1)
+    controller._service_seconds = 3.0
+    assert controller.retry_after() == 2
+    controller._queued[PRIORITY_BATCH] = 5
+    assert controller.retry_after() == 9
@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from services.chunking import TOKEN_RE, chunk_text, iter_text
+
+
+DOC = (
+    "Tàu CETO chạy ở tốc độ 12.5 hải lý. Sóng cao 2 m, chu kỳ sóng 8 giây!\n\n"
+    "Mức tiêu thụ nhiên liệu tăng khi gió mạnh; độ sâu đáy biển ảnh hưởng ít hơn. "
+) * 20
+
+
+def _token_starts(text):
+    return [m.start() for m in TOKEN_RE.finditer(text)]
+
+
+def _chunks(block_size, max_tokens=40, overlap_tokens=8):
+    stream = io.BytesIO(DOC.encode("utf-8"))
+    return list(chunk_text(iter_text(stream, block_size=block_size), max_tokens, overlap_tokens))
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 7, 64, 1 << 16])
+def test_chunks_do_not_depend_on_block_boundaries(block_size):
+    # Block nhỏ cắt ngang ký tự nhiều byte và ngang token
+    assert _chunks(block_size) == _chunks(1 << 16)
+
+
+def test_offsets_point_into_document():
+    for chunk in _chunks(5):
+        assert DOC[chunk.offset:chunk.offset + len(chunk.content)] == chunk.content
+        assert chunk.tokens == len(TOKEN_RE.findall(chunk.content))
+
+
+def test_consecutive_chunks_overlap_by_overlap_tokens():
+    max_tokens, overlap = 40, 8
+    starts = _token_starts(DOC)
+    chunks = _chunks(11, max_tokens, overlap)
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert prev.tokens <= max_tokens
+        first = starts.index(prev.offset)
+        expected = first + max(prev.tokens - overlap, 1)
+        assert starts.index(nxt.offset) == expected
+
+    # Chunk cuối phủ tới token cuối cùng
+    last = chunks[-1]
+    assert last.offset + len(last.content) == len(DOC.rstrip())
+
+
+def test_cuts_prefer_sentence_ends():
+    for chunk in _chunks(64)[:-1]:
+        assert chunk.content[-1] in ".!?;" or DOC[chunk.offset + len(chunk.content):].startswith("\n\n")
+
+
+def test_invalid_max_tokens():
+    with pytest.raises(ValueError):
+        list(chunk_text(["abc"], max_tokens=0))
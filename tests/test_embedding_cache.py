@@ -0,0 +1,128 @@
+import hashlib
+
+import numpy as np
+from flask import Flask
+from sqlalchemy.dialects import postgresql
+
+import core.embedding_store as embedding_store
+from services.embedding_cache import EmbeddingCache, embedding_key
+from services.vector_codec import decode_f32
+
+
+class _Store:
+    """Store giả cho EmbeddingCache: dict key -> (model, vector)."""
+
+    def __init__(self):
+        self.rows = {}
+        self.reads = []
+        self.purges = []
+
+    def get_many(self, keys):
+        self.reads.append(sorted(keys))
+        return {key: self.rows[key][1] for key in keys if key in self.rows}
+
+    def put_many(self, model, entries):
+        for key, vector in entries.items():
+            self.rows.setdefault(key, (model, vector))
+
+    def purge_except(self, model):
+        self.purges.append(model)
+        stale = [key for key, (m, _) in self.rows.items() if m != model]
+        for key in stale:
+            del self.rows[key]
+        return len(stale)
+
+
+def test_key_is_sha256_of_model_and_text():
+    assert embedding_key("nomic", "tàu") == hashlib.sha256("nomic\x00tàu".encode("utf-8")).hexdigest()
+    assert embedding_key("nomic", "tàu") != embedding_key("bge", "tàu")
+    # Dấu phân cách NUL: (model, text) khác nhau không ghép thành cùng chuỗi
+    assert embedding_key("ab", "c") != embedding_key("a", "bc")
+
+
+def test_memory_lru_promotes_on_hit():
+    cache = EmbeddingCache(maxsize=2)
+    cache.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    assert cache.get_many("m", ["a"]) == [[1.0]]  # "a" lên đầu LRU
+    cache.put_many("m", ["c"], [[3.0]])
+    assert cache.get_many("m", ["a", "b", "c"]) == [[1.0], None, [3.0]]
+    assert cache.memory.stats()["evictions"] == 1
+
+
+def test_store_fills_memory_misses():
+    store = _Store()
+    EmbeddingCache(maxsize=8, store=store).put_many("m", ["a", "b"], [[1.0], [2.0]])
+
+    cache = EmbeddingCache(maxsize=8, store=store)
+    assert cache.get_many("m", ["a", "x", "b"]) == [[1.0], None, [2.0]]
+    assert store.reads[-1] == sorted(embedding_key("m", t) for t in ("a", "x", "b"))
+    # Lần sau "a", "b" nằm trong LRU: store chỉ được hỏi key còn thiếu
+    assert cache.get_many("m", ["a", "x", "b"]) == [[1.0], None, [2.0]]
+    assert store.reads[-1] == [embedding_key("m", "x")]
+    assert cache.stats()["store"] == {"enabled": True, "hits": 2, "misses": 2, "errors": 0}
+
+
+def test_model_change_clears_memory_and_purges_store():
+    store = _Store()
+    cache = EmbeddingCache(maxsize=8, store=store)
+    cache.put_many("old", ["a"], [[1.0]])
+    cache.get_many("old", ["a"])
+    assert store.purges == ["old"]  # chỉ lần đầu gặp model
+
+    assert cache.get_many("new", ["a"]) == [None]
+    assert store.purges == ["old", "new"]
+    assert store.rows == {}
+    assert len(cache.memory) == 0
+    assert cache.stats()["model"] == "new"
+
+    # attach_store -> dọn lại store mới ở lần dùng kế tiếp
+    other = _Store()
+    other.rows["stale"] = ("old", [9.0])
+    cache.attach_store(other)
+    cache.get_many("new", ["a"])
+    assert other.purges == ["new"] and other.rows == {}
+
+
+def test_store_errors_do_not_fail_lookups():
+    class Broken(_Store):
+        def get_many(self, keys):
+            raise RuntimeError("db down")
+
+        put_many = purge_except = get_many
+
+    cache = EmbeddingCache(maxsize=8, store=Broken())
+    cache.put_many("m", ["a"], [[1.0]])
+    assert cache.get_many("m", ["a", "b"]) == [[1.0], None]
+    assert cache.stats()["store"]["errors"] == 3
+
+
+# --- core/embedding_store.py ---
+class _Session:
+    def __init__(self):
+        self.statements = []
+        self.events = []
+
+    def execute(self, stmt):
+        self.statements.append(stmt)
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+
+def test_db_store_writes_float32_bytes_without_overwriting(monkeypatch):
+    session = _Session()
+    monkeypatch.setattr(embedding_store, "db", type("DB", (), {"session": session}))
+    store = embedding_store.DBEmbeddingStore(Flask(__name__))
+    store.put_many("m", {})
+    assert session.statements == []
+
+    store.put_many("m", {"k1": [0.5, -1.0], "k2": [1.0, 2.0]})
+    assert session.events == ["commit"]
+    compiled = session.statements[0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT (key) DO NOTHING" in str(compiled)
+    blobs = [v for name, v in compiled.params.items() if name.startswith("embedding")]
+    assert all(isinstance(blob, bytes) for blob in blobs)
+    assert np.array_equal(decode_f32(blobs[0]), np.array([0.5, -1.0], dtype=np.float32))
@@ -0,0 +1,171 @@
+import numpy as np
+import pytest
+
+from services.embedding_index import EmbeddingIndex, normalize_rows
+
+
+def _data(n=300, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(1, n + 1), rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def _brute_force(ids, vectors, query, k):
+    scores = normalize_rows(vectors) @ (query / np.linalg.norm(query))
+    order = np.argsort(-scores)[:k]
+    return [int(ids[i]) for i in order]
+
+
+def test_exact_search_matches_brute_force():
+    ids, vectors = _data()
+    index = EmbeddingIndex()
+    index.build(ids.tolist(), vectors.tolist())
+    rng = np.random.default_rng(1)
+    for query in rng.normal(size=(20, vectors.shape[1])):
+        got = index.search(query.tolist(), k=5)
+        assert [i for i, _ in got] == _brute_force(ids, vectors, query, 5)
+        scores = [s for _, s in got]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_threshold_and_empty_index():
+    index = EmbeddingIndex()
+    assert index.search([1.0, 0.0], k=3) == []
+    index.build([1, 2], [[1.0, 0.0], [0.0, 1.0]])
+    assert index.search([1.0, 0.1], k=3, threshold=0.9) == [(1, pytest.approx(0.995, abs=1e-3))]
+    # Query sai số chiều là lỗi của caller
+    with pytest.raises(ValueError):
+        index.search([1.0, 0.0, 0.0])
+
+
+# --- Cập nhật tăng dần: delta, tombstone, merge ---
+def _live_search(live, query, k):
+    ids = np.array(sorted(live))
+    return _brute_force(ids, np.array([live[i] for i in ids]), np.asarray(query), k)
+
+
+@pytest.mark.parametrize("merge_rows", [4096, 8])
+def test_delta_and_tombstones_match_rebuild(monkeypatch, merge_rows):
+    import services.embedding_index as embedding_index
+
+    monkeypatch.setattr(embedding_index, "MERGE_DELTA_ROWS", merge_rows)
+    ids, vectors = _data(100)
+    live = {int(i): v for i, v in zip(ids, vectors)}
+    index = EmbeddingIndex()
+    index.build(ids.tolist(), vectors.tolist())
+
+    rng = np.random.default_rng(2)
+    new = rng.normal(size=(30, vectors.shape[1])).astype(np.float32)
+    index.add(list(range(101, 131)), new.tolist())
+    live.update({101 + j: v for j, v in enumerate(new)})
+
+    # Thay vector của id đang ở main và id đang ở delta
+    for doc_id in (5, 105):
+        vector = rng.normal(size=vectors.shape[1]).astype(np.float32)
+        index.add([doc_id], [vector.tolist()])
+        live[doc_id] = vector
+
+    removed = [1, 2, 3, 110, 999]
+    assert index.remove(removed) == 4
+    for doc_id in removed:
+        live.pop(doc_id, None)
+
+    assert index.ids() == set(live)
+    assert len(index) == len(live)
+    if merge_rows == 8:
+        # Đã merge: delta rỗng, không còn tombstone
+        assert index.stats()["delta"] < merge_rows
+    for query in rng.normal(size=(10, vectors.shape[1])):
+        assert [i for i, _ in index.search(query.tolist(), k=5)] == _live_search(live, query, 5)
+
+
+def test_add_before_load_is_ignored():
+    index = EmbeddingIndex()
+    assert index.add([1], [[1.0, 0.0]]) == 0
+    assert index.remove([1]) == 0
+
+
+class _Table:
+    """Bảng nguồn giả cho WatermarkSync: ghi lại các lần đọc."""
+
+    def __init__(self, rows):
+        self.rows = dict(rows)
+        self.reads = []
+
+    def fingerprint(self):
+        return [len(self.rows), max(self.rows, default=0)]
+
+    def fetch_after(self, after_id):
+        self.reads.append(("after", after_id))
+        ids = sorted(i for i in self.rows if i > after_id)
+        return ids, [self.rows[i] for i in ids]
+
+    def fetch_ids(self):
+        self.reads.append(("ids",))
+        return list(self.rows)
+
+    def fetch_by_ids(self, ids):
+        self.reads.append(("by_ids", tuple(ids)))
+        return ids, [self.rows[i] for i in ids]
+
+    def fetchers(self):
+        return self.fingerprint, self.fetch_after, self.fetch_ids, self.fetch_by_ids
+
+
+def test_sync_reads_only_new_rows_and_deleted_ids():
+    ids, vectors = _data(20, dim=4)
+    table = _Table((int(i), v.tolist()) for i, v in zip(ids, vectors))
+    index = EmbeddingIndex()
+    index.ensure_loaded(lambda: (list(table.rows), list(table.rows.values())), table.fingerprint)
+    assert index.sync(*table.fetchers()) is False
+
+    # Chỉ thêm: một lần đọc id > max id, không so danh sách id
+    table.rows[21] = [1.0, 0.0, 0.0, 0.0]
+    table.rows[22] = [0.0, 1.0, 0.0, 0.0]
+    assert index.sync(*table.fetchers()) is True
+    assert table.reads == [("after", 20)]
+    assert index.ids() == set(table.rows)
+
+    # Xóa + commit trễ (id nhỏ hơn max id xuất hiện sau)
+    table.reads.clear()
+    del table.rows[3], table.rows[21]
+    table.rows[23] = [0.0, 0.0, 1.0, 0.0]
+    assert index.sync(*table.fetchers()) is True
+    assert table.reads == [("after", 22), ("ids",)]
+    assert index.ids() == set(table.rows)
+    assert index.watermark == table.fingerprint()
+
+
+@pytest.mark.parametrize("bad_at_build", [False, True], ids=["bad_row_synced", "bad_row_at_build"])
+def test_rejected_rows_do_not_force_id_diff_every_poll(bad_at_build):
+    ids, vectors = _data(10, dim=4)
+    table = _Table((int(i), v.tolist()) for i, v in zip(ids, vectors))
+    if bad_at_build:
+        table.rows[5] = [1.0, 2.0]  # sai số chiều -> index bỏ qua
+    index = EmbeddingIndex()
+    index.ensure_loaded(lambda: (list(table.rows), list(table.rows.values())), table.fingerprint)
+
+    table.rows[11] = [1.0, 0.0, 0.0, 0.0]
+    if not bad_at_build:
+        table.rows[12] = [1.0, 2.0]
+    bad = 5 if bad_at_build else 12
+    index.sync(*table.fetchers())
+    assert index.ids() == set(table.rows) - {bad}
+
+    # Poll kế tiếp chỉ đọc dòng mới, không so lại danh sách id
+    table.reads.clear()
+    table.rows[13] = [0.0, 1.0, 0.0, 0.0]
+    assert index.sync(*table.fetchers()) is True
+    assert table.reads == [("after", 12 if not bad_at_build else 11)]
+    assert 13 in index.ids()
+
+    # Xóa chính dòng bị từ chối -> một lần so id rồi lại ổn định
+    del table.rows[bad]
+    table.rows[14] = [0.0, 0.0, 1.0, 0.0]
+    table.reads.clear()
+    index.sync(*table.fetchers())
+    assert ("ids",) in table.reads
+    assert index.ids() == set(table.rows)
+    table.rows[15] = [0.0, 0.0, 0.0, 1.0]
+    table.reads.clear()
+    index.sync(*table.fetchers())
+    assert table.reads == [("after", 14)]
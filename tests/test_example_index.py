@@ -0,0 +1,174 @@
+import pytest
+
+from services.example_index import ExampleIndex, normalize_text, trigrams
+
+
+EXAMPLES = [
+    (1, "Mức tiêu thụ nhiên liệu của tàu Triton là bao nhiêu?", "Triton: khoảng 1.2 kg/s.", None),
+    (2, "Chiều cao sóng ảnh hưởng thế nào tới nhiên liệu?", "Sóng cao làm tăng lực cản.", None),
+    (3, "mức tiêu thụ nhiên liệu của tàu triton là bao nhiêu", "Bản trùng, id lớn hơn.", None),
+]
+
+
+def _index(threshold=0.6):
+    index = ExampleIndex(threshold=threshold)
+    index.build(EXAMPLES)
+    return index
+
+
+def _jaccard(a, b):
+    ga, gb = trigrams(a), trigrams(b)
+    return len(ga & gb) / len(ga | gb)
+
+
+def test_normalize_text():
+    assert normalize_text("  Tàu   TRITON, tốc độ?! ") == "tàu triton tốc độ"
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    index = _index()
+    match = index.match("MỨC tiêu thụ nhiên liệu của tàu Triton là bao nhiêu ???")
+    # Trùng text chuẩn hóa -> id nhỏ thắng
+    assert match == (1, "Triton: khoảng 1.2 kg/s.", 1.0)
+    assert index.stats()["exact_hits"] == 1
+
+
+def test_fuzzy_match_uses_trigram_jaccard():
+    index = _index()
+    query = "chieu cao song anh huong the nao toi nhien lieu"  # bỏ dấu, không khớp exact
+    match = index.match(query)
+    assert match.id == 2
+    assert match.score == pytest.approx(_jaccard(query, EXAMPLES[1][1]))
+    assert index.stats()["fuzzy_hits"] == 1
+
+
+def test_fuzzy_match_below_threshold_is_rejected():
+    query = "chiều cao sóng hôm nay"
+    score = _jaccard(query, EXAMPLES[1][1])
+    assert 0 < score < 0.6
+    assert _index().match(query) is None
+    assert _index(threshold=score).match(query).id == 2
+    assert _index().match("") is None
+    assert ExampleIndex().match("bất kỳ") is None
+
+
+def test_refresh_rebuilds_only_when_watermark_changes():
+    index = ExampleIndex()
+    rows = list(EXAMPLES[:2])
+    builds = []
+
+    def loader():
+        builds.append(1)
+        return list(rows)
+
+    fingerprint = lambda: [len(rows), rows[-1][0]]
+    assert index.refresh(0, fingerprint, loader) is True
+    assert index.refresh(0, fingerprint, loader) is False
+    rows.append((4, "Tàu Ceto chạy bao nhanh?", "Khoảng 14 hải lý.", None))
+    # Trong poll_seconds thì không kiểm tra watermark
+    assert index.refresh(3600, fingerprint, loader) is False
+    assert index.refresh(0, fingerprint, loader) is True
+    assert len(builds) == 2
+    assert index.match("tàu ceto chạy bao nhanh").id == 4
+
+
+# --- Semantic match + embedding nền ---
+def test_match_vector_picks_nearest_embedding_above_threshold():
+    index = ExampleIndex(semantic_threshold=0.9)
+    index.build([
+        (1, "a", "answer a", [1.0, 0.0, 0.0]),
+        (2, "b", "answer b", None),
+        (3, "c", "answer c", [0.0, 2.0, 0.0]),
+    ])
+    assert index.unembedded == 1
+    match = index.match_vector([0.1, 1.0, 0.0])
+    assert (match.id, match.response) == (3, "answer c")
+    assert match.score == pytest.approx(1.0 / (1.01 ** 0.5))
+    assert index.match_vector([1.0, 1.0, 0.0]) is None  # cosine 0.707
+    assert index.match_vector([1.0, 0.0]) is None       # sai số chiều
+    assert index.stats()["semantic_hits"] == 1
+    assert ExampleIndex().match_vector([1.0, 0.0, 0.0]) is None
+
+
+class _Threads:
+    """Thay threading.Thread: giữ lại target để test tự chạy (không chạy nền)."""
+
+    def __init__(self):
+        self.started = []
+
+    def __call__(self, target, args, daemon):
+        threads = self
+
+        class _Thread:
+            def start(self):
+                threads.started.append((target, args))
+        return _Thread()
+
+    def run_all(self):
+        started, self.started = self.started, []
+        for target, args in started:
+            target(*args)
+        return len(started)
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    import services.example_index as example_index
+
+    fake = _Threads()
+    monkeypatch.setattr(example_index.threading, "Thread", fake)
+    return fake
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import services.example_index as example_index
+
+    now = [1000.0]
+    monkeypatch.setattr(example_index.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_embedding_failures_back_off_then_recover(threads, clock):
+    index = ExampleIndex(semantic_threshold=0.9)
+    rows = [(1, "a", "answer a", [1.0, 0.0]), (2, "b", "answer b", None)]
+    fingerprint = lambda: [2, 2]
+    calls = []
+
+    def failing(pending):
+        calls.append(pending)
+        raise RuntimeError("embedding service down")
+
+    delays = []
+    for _ in range(7):
+        index.refresh(0, fingerprint, lambda: rows, failing)
+        assert threads.run_all() == 1
+        delays.append(index.stats()["embed_retry_in"])
+        # Chưa tới lúc thử lại -> không lên lịch
+        index.refresh(0, fingerprint, lambda: rows, failing)
+        assert threads.run_all() == 0
+        clock[0] += delays[-1]
+    assert delays == [30.0, 60.0, 120.0, 240.0, 480.0, 900.0, 900.0]
+    assert calls[0] == [(2, "b")]
+    assert index.embed_failures == 7
+
+    # Thành công: ghép vào ma trận, reset backoff
+    index.refresh(0, fingerprint, lambda: rows, lambda pending: [[0.0, 1.0]])
+    assert threads.run_all() == 1
+    assert index.unembedded == 0
+    assert index.stats()["embed_retry_in"] == 0.0
+    assert index.match_vector([0.0, 1.0]).id == 2
+
+
+def test_embedding_result_is_dropped_after_rebuild(threads, clock):
+    index = ExampleIndex()
+    rows = [(1, "a", "answer a", None)]
+    fingerprint = [[1, 1]]
+    index.refresh(0, lambda: fingerprint[0], lambda: list(rows), lambda pending: [[1.0, 0.0]])
+    # Build lại trước khi thread embedding chạy xong
+    rows.append((2, "b", "answer b", None))
+    fingerprint[0] = [2, 2]
+    index.refresh(0, lambda: fingerprint[0], lambda: list(rows))
+    threads.run_all()
+    assert index.unembedded == 2
+    assert index.match_vector([1.0, 0.0]) is None
@@ -0,0 +1,181 @@
+import pytest
+from flask import Flask
+from sqlalchemy.dialects import postgresql
+
+import core.explanation_store as explanation_store
+import core.supportfunc as supportfunc
+import services.explanation_cache as explanation_cache_module
+from services.explanation_cache import ExplanationCache, explanation_key, prediction_bucket, quantize
+
+
+FEATURES = {
+    "Ship_SpeedOverGround": 12.0,
+    "Environment_SeaFloorDepth": 250.0,
+    "Weather_Temperature2M": 21.0,
+    "Weather_OceanCurrentVelocity": 0.4,
+    "Weather_WindSpeed10M": 6.0,
+    "Weather_WaveHeight": 1.2,
+    "Weather_WavePeriod": 7.0,
+}
+
+
+def _key(prediction=1.5, ship_type="triton", model="m", prompt_version=1, **overrides):
+    return explanation_key(ship_type, dict(FEATURES, **overrides), prediction, model, prompt_version)
+
+
+def test_quantize():
+    assert quantize(12.04, 0.1) == 12.0
+    assert quantize("0.43", 0.05) == 0.45
+    assert quantize(float("nan"), 0.1) is None
+    assert quantize(None, 0.1) is None
+
+
+def test_nearby_inputs_share_a_key():
+    base = _key()
+    # Lệch dưới nửa bước lượng tử hóa / dưới 1% dự đoán -> cùng key
+    assert _key(Ship_SpeedOverGround=12.04, Weather_WaveHeight=1.22) == base
+    assert _key(prediction=1.503) == base
+    assert _key(ship_type="TRITON") == base
+
+
+@pytest.mark.parametrize("change", [
+    {"Ship_SpeedOverGround": 12.1},
+    {"Weather_WaveHeight": 1.3},
+    {"prediction": 1.6},
+    {"ship_type": "CETO"},
+    {"model": "other-model"},
+    {"prompt_version": 2},
+])
+def test_distinct_inputs_get_distinct_keys(change):
+    assert _key(**change) != _key()
+
+
+def test_prediction_bucket_at_zero_and_negative():
+    assert prediction_bucket(0.0) == prediction_bucket(-0.0004) == "<=0:0"
+    assert prediction_bucket(-1.0) == "<=0:-1000"
+    assert prediction_bucket(-1.0) != prediction_bucket(-1.002)
+    # Bucket không dương không trùng với bucket dương nào
+    assert prediction_bucket(1.0) == 0
+    assert prediction_bucket(0.0) != prediction_bucket(1.0)
+    assert prediction_bucket(1.0, relative_step=0) == "1.0"
+
+
+class _Store:
+    """Store giả: tuổi entry tính theo đồng hồ của test."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.rows = {}
+
+    def get(self, key, max_age_seconds):
+        row = self.rows.get(key)
+        if row is None or row[1] < self.clock[0] - max_age_seconds:
+            return None
+        return row[0]
+
+    def put(self, key, explanation, **labels):
+        self.rows[key] = (explanation, self.clock[0])
+
+    def purge_expired(self, ttl_seconds):
+        expired = [k for k, (_, created) in self.rows.items() if created < self.clock[0] - ttl_seconds]
+        for key in expired:
+            del self.rows[key]
+        return len(expired)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(explanation_cache_module.time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ExplanationCache(maxsize=8, ttl_seconds=60)
+    cache.put("k", "explanation")
+    clock[0] += 59
+    assert cache.get("k") == "explanation"
+    clock[0] += 2
+    assert cache.get("k") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_store_backs_memory_and_honours_ttl(clock):
+    store = _Store(clock)
+    cache = ExplanationCache(maxsize=8, ttl_seconds=60, store=store)
+    cache.put("k", "explanation", ship_type="TRITON")
+
+    # Worker khác (LRU rỗng) đọc từ store
+    other = ExplanationCache(maxsize=8, ttl_seconds=60, store=store)
+    assert other.get("k") == "explanation"
+    assert other.stats()["store"]["hits"] == 1
+
+    clock[0] += 61
+    assert ExplanationCache(maxsize=8, ttl_seconds=60, store=store).get("k") is None
+    ExplanationCache(maxsize=8, ttl_seconds=60).attach_store(store)
+    assert store.rows == {}
+
+
+def test_store_errors_do_not_fail_lookups(clock):
+    class Broken:
+        def get(self, key, max_age_seconds):
+            raise RuntimeError("db down")
+
+        put = get
+
+    cache = ExplanationCache(maxsize=8, ttl_seconds=60, store=Broken())
+    cache.put("k", "explanation")
+    assert cache.get("k") == "explanation"
+    assert cache.get("other") is None
+    assert cache.stats()["store"]["errors"] == 2
+
+
+def test_prompt_version_bump_invalidates_cached_explanations(monkeypatch, clock):
+    calls = []
+    monkeypatch.setattr(supportfunc, "explanation_cache", ExplanationCache(maxsize=8, ttl_seconds=60))
+    monkeypatch.setattr(supportfunc.llm_service, "chat_sync", lambda messages, lang: calls.append(1) or f"answer {len(calls)}")
+    params = dict(FEATURES, ship_type="TRITON")
+
+    assert supportfunc.call_llm(1.5, params) == "answer 1"
+    assert supportfunc.call_llm(1.501, params) == "answer 1"
+    monkeypatch.setattr(supportfunc, "EXPLANATION_PROMPT_VERSION", supportfunc.EXPLANATION_PROMPT_VERSION + 1)
+    assert supportfunc.call_llm(1.5, params) == "answer 2"
+    assert len(calls) == 2
+
+
+# --- core/explanation_store.py ---
+class _Session:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.statements = []
+        self.events = []
+
+    def execute(self, stmt):
+        self.statements.append(stmt)
+        if self.fail:
+            raise RuntimeError("db down")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_db_store_put_upserts_and_rolls_back_on_error(monkeypatch, fail):
+    session = _Session(fail)
+    monkeypatch.setattr(explanation_store, "db", type("DB", (), {"session": session}))
+    store = explanation_store.DBExplanationStore(Flask(__name__))
+
+    if fail:
+        with pytest.raises(RuntimeError):
+            store.put("k", "explanation", ship_type="TRITON", model="m", prompt_version=3)
+        assert session.events == ["rollback"]
+    else:
+        store.put("k", "explanation", ship_type="TRITON", model="m", prompt_version=3)
+        assert session.events == ["commit"]
+
+    sql = str(session.statements[0].compile(dialect=postgresql.dialect()))
+    # Entry hết hạn cùng key được ghi đè và tính tuổi lại từ đầu
+    assert "ON CONFLICT (key) DO UPDATE SET explanation = excluded.explanation, created_at = now()" in sql
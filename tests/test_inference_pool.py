@@ -0,0 +1,54 @@
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+from services.model_service import ModelService
+from services.model_store import ModelStore
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 20, size=(200, len(ModelService.FEATURES)))
+    y = X.sum(axis=1)
+    store = ModelStore(str(tmp_path / "store"))
+    for version, scale in (("v1", 1.0), ("v2", 3.0)):
+        path = str(tmp_path / f"triton_{version}.pkl")
+        joblib.dump(RandomForestRegressor(n_estimators=5, max_depth=4, random_state=0).fit(X, y * scale), path)
+        store.publish("TRITON", path, version=version)
+    # Worker spawn kế thừa biến môi trường của process cha
+    monkeypatch.setenv("MODEL_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setenv("MODEL_BACKEND", "native")
+    return tmp_path / "store"
+
+
+def _rows(n):
+    rng = np.random.default_rng(1)
+    values = rng.uniform(0, 20, size=(n, len(ModelService.FEATURES)))
+    return [dict(zip(ModelService.FEATURES, row), ship_type="TRITON") for row in values.tolist()]
+
+
+def test_pool_matches_local_and_follows_hot_swap(store_dir):
+    local = ModelService(cache_size=0, inference_workers=0)
+    pooled = ModelService(cache_size=16, inference_workers=1)
+    rows = _rows(20)
+    try:
+        expected_v1 = [r["fuel_consumption"] for r in local.predict_many(rows)]
+        assert [r["fuel_consumption"] for r in pooled.predict_many(rows)] == pytest.approx(expected_v1)
+        assert pooled.predict(rows[0]) == pytest.approx(expected_v1[0])
+        # Process cha không load model khi chạy qua pool
+        assert pooled.loaded_ships() == []
+
+        local.activate_version("TRITON", "v2")
+        pooled.activate_version("TRITON", "v2")
+        assert pooled.loaded_ships() == []
+        expected_v2 = [r["fuel_consumption"] for r in local.predict_many(rows)]
+        assert expected_v2 != pytest.approx(expected_v1)
+        # Entry cache của v1 không còn khớp sau khi đổi version
+        assert pooled.predict(rows[0]) == pytest.approx(expected_v2[0])
+        assert [r["fuel_consumption"] for r in pooled.predict_many(rows)] == pytest.approx(expected_v2)
+    finally:
+        pooled.shutdown()
+        local.shutdown()
+
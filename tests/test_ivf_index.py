@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+
+from services import embedding_index
+from services.embedding_index import EmbeddingIndex
+from services.ivf_index import IVFIndex
+
+
+def _clustered(n=2000, dim=32, clusters=40, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(n, dim))
+    queries = centers[rng.integers(0, clusters, 50)] + 0.3 * rng.normal(size=(50, dim))
+    return np.arange(1, n + 1), vectors.astype(np.float32), queries
+
+
+def _recall(ivf, exact, queries, k=10, **kwargs):
+    hits = 0
+    for q in queries:
+        truth = {i for i, _ in exact.search(q.tolist(), k=k)}
+        hits += len(truth & {i for i, _ in ivf.search(q.tolist(), k=k, **kwargs)})
+    return hits / (k * len(queries))
+
+
+def test_ivf_recall_against_exact():
+    ids, vectors, queries = _clustered()
+    exact = EmbeddingIndex()
+    exact.build(ids.tolist(), vectors.tolist())
+    ivf = IVFIndex(nlist=32, nprobe=8)
+    ivf.build(ids.tolist(), vectors.tolist())
+
+    assert _recall(ivf, exact, queries) >= 0.9
+    # nprobe = nlist quét mọi cụm -> giống exact
+    assert _recall(ivf, exact, queries, nprobe=32) == 1.0
+
+
+def test_ivf_persists_and_reopens_with_mmap(tmp_path):
+    ids, vectors, queries = _clustered(n=500)
+    rows = (ids.tolist(), vectors.tolist())
+    built = IVFIndex(root=str(tmp_path), nlist=16, nprobe=4)
+    built.ensure_loaded(lambda: rows, lambda: [500, 500])
+
+    reopened = IVFIndex(root=str(tmp_path), nlist=16, nprobe=4)
+    reopened.ensure_loaded(lambda: (_ for _ in ()).throw(AssertionError("should not rebuild")), lambda: [500, 500])
+    assert isinstance(reopened._state.main[3], np.memmap)
+    assert reopened.watermark == [500, 500]
+    for q in queries[:10]:
+        assert reopened.search(q.tolist(), k=5) == built.search(q.tolist(), k=5)
+
+
+def _build_dirs(root):
+    return sorted(p.name for p in root.iterdir() if p.is_dir())
+
+
+def test_concurrent_persists_leave_one_build(tmp_path):
+    ids, vectors, _ = _clustered(n=300)
+    # Mỗi index có file lock riêng -> flock serialize giữa chúng như giữa các process
+    indexes = [IVFIndex(root=str(tmp_path), nlist=8) for _ in range(4)]
+    for index in indexes:
+        index.build(ids.tolist(), vectors.tolist())
+    (tmp_path / "orphan-from-crash").mkdir()
+
+    def persist(index, n):
+        for round_ in range(5):
+            index._persist([n, round_])
+
+    threads = [threading.Thread(target=persist, args=(index, n)) for n, index in enumerate(indexes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    current = (tmp_path / "CURRENT").read_text()
+    assert _build_dirs(tmp_path) == [current]
+    reopened = IVFIndex(root=str(tmp_path), nlist=8)
+    assert reopened._load_persisted(None)
+    assert len(reopened) == len(ids)
+
+
+def test_same_watermark_is_not_rewritten(tmp_path):
+    ids, vectors, _ = _clustered(n=300)
+    first = IVFIndex(root=str(tmp_path), nlist=8)
+    first.ensure_loaded(lambda: (ids.tolist(), vectors.tolist()), lambda: [300, 300])
+    written = (tmp_path / "CURRENT").read_text()
+
+    second = IVFIndex(root=str(tmp_path), nlist=8)
+    second.build(ids.tolist(), vectors.tolist())
+    second._persist([300, 300])
+    assert (tmp_path / "CURRENT").read_text() == written
+
+
+def test_merge_persists_at_most_once_per_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_index, "MERGE_DELTA_ROWS", 10)
+    ids, vectors, _ = _clustered(n=400)
+    index = IVFIndex(root=str(tmp_path), nlist=8, persist_seconds=3600)
+    index.ensure_loaded(lambda: (ids[:300].tolist(), vectors[:300].tolist()), lambda: [300, 300])
+    saved = []
+    monkeypatch.setattr(IVFIndex, "_persist", lambda self, fingerprint: saved.append(fingerprint))
+
+    for start in range(300, 400, 10):
+        index.watermark = [start + 10, start + 10]
+        index.add(ids[start:start + 10].tolist(), vectors[start:start + 10].tolist())
+    # 10 lần gộp delta, bản trên đĩa vừa được ghi lúc build -> không ghi lại
+    assert index.stats()["delta"] == 0 and len(index) == 400
+    assert saved == []
+
+    index.persist_seconds = 0
+    index.add(ids[:10].tolist(), vectors[:10].tolist())
+    assert saved == [[400, 400]]
@@ -0,0 +1,59 @@
+from services.lexical_index import BM25Index, fold_diacritics, reciprocal_rank_fusion, tokenize
+
+
+DOCS = {
+    1: "Tốc độ tàu ảnh hưởng lớn tới mức tiêu thụ nhiên liệu.",
+    2: "Chiều cao sóng Weather_WaveHeight làm tăng lực cản.",
+    3: "Độ sâu đáy biển ít ảnh hưởng tới tàu lớn.",
+    4: "Nhiên liệu nhiên liệu nhiên liệu: báo cáo tiêu thụ theo tháng của tàu CETO.",
+}
+
+
+def _index():
+    index = BM25Index()
+    index.build(list(DOCS), list(DOCS.values()))
+    return index
+
+
+def test_fold_diacritics():
+    assert fold_diacritics("Độ sâu đáy biển") == "Do sau day bien"
+    assert fold_diacritics("plain ascii") == "plain ascii"
+
+
+def test_tokenize_folds_and_splits_identifiers():
+    tokens = tokenize("Chiều cao sóng Weather_WaveHeight")
+    assert {"chieu", "cao", "song"} <= set(tokens)
+    assert {"weather_waveheight", "weather", "wave", "height"} <= set(tokens)
+
+
+def test_query_without_diacritics_matches_vietnamese_text():
+    hits = _index().search("do sau day bien", k=3)
+    assert hits[0][0] == 3
+
+
+def test_ranking_prefers_rarer_terms_and_saturates_tf():
+    index = _index()
+    ids = [doc_id for doc_id, _ in index.search("tiêu thụ nhiên liệu tốc độ", k=4)]
+    # Doc 1 có đủ term; doc 4 lặp "nhiên liệu" nhưng tf bị bão hòa bởi k1;
+    # doc 3 chỉ khớp "độ" (trong "Độ sâu")
+    assert ids == [1, 4, 3]
+
+
+def test_identifier_query_and_min_term_match():
+    index = _index()
+    assert index.search("WaveHeight", k=2)[0][0] == 2
+    assert index.search("sóng xyz abc qwe", k=5, min_term_match=0.5) == []
+
+
+def test_incremental_add_and_remove():
+    index = _index()
+    index.add([5], ["Poseidon chạy chậm để tiết kiệm nhiên liệu"])
+    assert index.search("poseidon", k=1)[0][0] == 5
+    index.remove([5])
+    assert index.search("poseidon", k=1) == []
+    assert len(index) == len(DOCS)
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2]
@@ -0,0 +1,237 @@
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+
+from services.model_service import ModelService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 20, size=(200, len(ModelService.FEATURES)))
+    y = X @ np.arange(1, len(ModelService.FEATURES) + 1) + rng.normal(0, 0.1, 200)
+
+    paths = {}
+    for st in ModelService.SHIP_MODEL_MAP:
+        if st == "CETO":
+            # Train bằng DataFrame -> model có feature_names_in_
+            model = LinearRegression().fit(pd.DataFrame(X, columns=ModelService.FEATURES), y)
+        else:
+            model = RandomForestRegressor(n_estimators=5, max_depth=4, random_state=len(paths)).fit(X, y)
+        paths[st] = str(tmp_path / f"{st.lower()}.pkl")
+        joblib.dump(model, paths[st])
+
+    monkeypatch.setattr(ModelService, "SHIP_MODEL_MAP", paths)
+    monkeypatch.setenv("MODEL_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setenv("MODEL_BACKEND", "native")
+    svc = ModelService(cache_size=0, inference_workers=0)
+    yield svc
+    svc.shutdown()
+
+
+def _row(ship_type, speed, **overrides):
+    row = dict.fromkeys(ModelService.FEATURES, 1.0)
+    row["Ship_SpeedOverGround"] = speed
+    row["ship_type"] = ship_type
+    row.update(overrides)
+    return row
+
+
+def test_predict_many_keeps_order_across_ship_types(service):
+    rows = [_row(st, speed) for speed in (5.0, 10.0, 15.0) for st in ("triton", "CETO", "Poseidon")]
+    results = service.predict_many(rows)
+
+    assert [r["index"] for r in results] == list(range(len(rows)))
+    for row, result in zip(rows, results):
+        assert result["ship_type"] == row["ship_type"].upper()
+        assert result["fuel_consumption"] == pytest.approx(service.predict(row))
+
+
+def test_predict_many_reports_errors_per_row(service):
+    rows = [
+        _row("CETO", 12.0),
+        "not a row",
+        _row("", 12.0),
+        _row("TITANIC", 12.0),
+        {k: v for k, v in _row("TRITON", 12.0).items() if k != "Weather_WaveHeight"},
+        _row("TRITON", 12.0, Weather_WindSpeed10M="fast"),
+        _row("TRITON", 12.0, Weather_WavePeriod=float("nan")),
+        _row("TRITON", 12.0),
+    ]
+    results = service.predict_many(rows)
+
+    assert [r["index"] for r in results] == list(range(len(rows)))
+    errors = {r["index"]: r["error"] for r in results if "error" in r}
+    assert errors == {
+        1: "Row must be an object",
+        2: "Missing ship_type",
+        3: "Unknown ship type: TITANIC",
+        4: "Missing feature: Weather_WaveHeight",
+        5: "Invalid value for Weather_WindSpeed10M: 'fast'",
+        6: "Invalid value for Weather_WavePeriod: nan",
+    }
+    assert results[0]["fuel_consumption"] == pytest.approx(service.predict(rows[0]))
+    assert results[7]["fuel_consumption"] == pytest.approx(service.predict(rows[7]))
+
+
+def test_predict_many_isolates_failing_ship_group(service, tmp_path):
+    # File model của POSEIDON hỏng -> chỉ các dòng POSEIDON lỗi
+    with open(ModelService.SHIP_MODEL_MAP["POSEIDON"], "wb") as fh:
+        fh.write(b"not a pickle")
+    rows = [_row("POSEIDON", 8.0), _row("CETO", 8.0), _row("POSEIDON", 9.0)]
+    results = service.predict_many(rows)
+
+    assert results[0]["error"].startswith("Prediction failed")
+    assert results[2]["error"].startswith("Prediction failed")
+    assert results[1]["fuel_consumption"] == pytest.approx(service.predict(rows[1]))
+
+
+def test_predict_many_empty(service):
+    assert service.predict_many([]) == []
+
+
+def test_prediction_cache_hits_and_invalidates_on_unload(service):
+    service.prediction_cache = type(service.prediction_cache)(16)
+    row = _row("TRITON", 11.0)
+    first = service.predict(row)
+    # Chênh lệch nhỏ hơn CACHE_PRECISION -> cùng key
+    assert service.predict(_row("TRITON", 11.001)) == first
+    assert service.cache_stats()["hits"] == 1
+
+    results = service.predict_many([row, _row("TRITON", 12.0)])
+    assert results[0]["fuel_consumption"] == first
+    assert service.cache_stats()["hits"] == 2
+
+    service.unload("TRITON")
+    service.predict(row)
+    # Load lại -> generation mới, entry cũ không còn khớp
+    assert service.cache_stats()["hits"] == 2
+
+
+def test_models_stay_resident_and_load_once(service, monkeypatch):
+    import services.model_service as model_service_module
+
+    loads = []
+    real_load = model_service_module.joblib.load
+    monkeypatch.setattr(model_service_module.joblib, "load", lambda path, **kw: loads.append(path) or real_load(path, **kw))
+
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        service.get_model("ceto")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(loads) == 1
+
+    # Đổi qua lại giữa các loại tàu không load lại model nào
+    for st in ("TRITON", "CETO", "POSEIDON", "TRITON", "CETO"):
+        service.predict(_row(st, 10.0))
+    assert len(loads) == 3
+    assert service.loaded_ships() == ["CETO", "POSEIDON", "TRITON"]
+
+    assert service.unload("triton") == ["TRITON"]
+    assert service.loaded_ships() == ["CETO", "POSEIDON"]
+    assert service.warm() == {"CETO": None, "POSEIDON": None, "TRITON": None}
+    assert len(loads) == 4
+
+
+@pytest.mark.parametrize("bad", [float("nan"), float("inf"), "nan"])
+def test_non_finite_inputs_rejected_by_native_and_compiled(service, bad):
+    report = service.export_compiled(np.random.default_rng(2).uniform(0, 20, (200, 7)), ["TRITON", "POSEIDON"])
+    assert all("error" not in info for info in report.values())
+    compiled = ModelService(cache_size=0, inference_workers=0)
+    compiled.backend = "compiled"
+
+    rows = [_row("TRITON", 9.0), _row("TRITON", 9.0, Weather_WaveHeight=bad), _row("POSEIDON", 14.0)]
+    native_results = service.predict_many(rows)
+    compiled_results = compiled.predict_many(rows)
+    assert native_results[1] == compiled_results[1] == {
+        "index": 1, "error": f"Invalid value for Weather_WaveHeight: {bad!r}",
+    }
+    for i in (0, 2):
+        assert compiled_results[i]["fuel_consumption"] == pytest.approx(native_results[i]["fuel_consumption"])
+
+    for svc in (service, compiled):
+        with pytest.raises(ValueError, match="Weather_WaveHeight"):
+            svc.predict(rows[1])
+        assert svc.predict(rows[0]) == pytest.approx(native_results[0]["fuel_consumption"])
+
+
+def test_score_voyage_skips_out_of_range_timestamps(service):
+    rows = [dict(_row("TRITON", 10.0), timestamp=t) for t in (0, 60, 1e20, 120)]
+    result = service.score_voyage(rows, "TRITON", chunk_size=2)
+    assert result["samples"] == 3
+    assert result["skipped"] == 1
+    assert result["errors"] == ["Row 3: Timestamp out of range: 1e+20"]
+    assert result["end"] == "1970-01-01T00:02:00+00:00"
+
+
+@pytest.mark.parametrize("ship_type", ["CETO", "triton"])
+def test_speed_sweep_matches_per_speed_predict(service, ship_type):
+    params = _row(ship_type, 99.0, Weather_WaveHeight=2.5)
+    result = service.speed_sweep(params, 4.0, 12.0, steps=9, distance_km=100.0)
+
+    assert result["ship_type"] == ship_type.upper()
+    assert result["speeds"] == pytest.approx(np.linspace(4.0, 12.0, 9))
+    expected = [service.predict({**params, "Ship_SpeedOverGround": s}) for s in result["speeds"]]
+    assert result["fuel_rate"] == pytest.approx(expected)
+    assert result["min_fuel_rate"]["fuel_rate"] == pytest.approx(min(expected))
+
+    seconds = 100_000.0 / np.asarray(result["speeds"])
+    assert result["total_fuel"] == pytest.approx(np.asarray(expected) * seconds)
+    best = int(np.argmin(result["total_fuel"]))
+    assert result["optimal"]["speed"] == result["speeds"][best]
+    assert result["optimal"]["voyage_time_h"] == pytest.approx(seconds[best] / 3600)
+
+
+@pytest.mark.parametrize("args, message", [
+    ((5.0, 5.0), "speed_min must be smaller"),
+    ((10.0, 5.0), "speed_min must be smaller"),
+    ((float("nan"), 5.0), "speed_min must be smaller"),
+    ((0.0, float("inf")), "speed_min must be smaller"),
+    ((0.0, 5.0, 1), "steps must be at least 2"),
+    ((0.0, 5.0, 10, 100.0), "must be positive"),
+    ((1.0, 5.0, 10, -1.0), "must be positive"),
+])
+def test_speed_sweep_rejects_bad_ranges(service, args, message):
+    with pytest.raises(ValueError, match=message):
+        service.speed_sweep(_row("TRITON", 1.0), *args)
+    with pytest.raises(ValueError, match="ship_type"):
+        service.speed_sweep(_row("", 1.0), 1.0, 5.0)
+
+
+def test_refresh_follows_external_manifest_change(service):
+    from services.model_store import ModelStore
+
+    # v2 của TRITON là model của POSEIDON -> dự đoán khác nhau rõ ràng
+    other = ModelStore(service.store.root)
+    other.publish("TRITON", ModelService.SHIP_MODEL_MAP["TRITON"], version="v1")
+    other.publish("TRITON", ModelService.SHIP_MODEL_MAP["POSEIDON"], version="v2")
+    service.store_poll_seconds = 0.0
+
+    row = _row("TRITON", 10.0)
+    v1 = service.predict(row)
+    assert service.model_versions()["TRITON"]["loaded_version"] == "v1"
+
+    # Process khác đổi version active
+    other.set_active("TRITON", "v2")
+    assert service.predict(row) == pytest.approx(service.predict(_row("POSEIDON", 10.0)))
+    assert service.predict(row) != pytest.approx(v1)
+    assert service.model_versions()["TRITON"] == {"loaded_version": "v2", "active": "v2", "versions": ["v1", "v2"]}
+
+    with pytest.raises(ValueError, match="Unknown version"):
+        service.activate_version("TRITON", "v3")
+    assert service.model_versions()["TRITON"]["loaded_version"] == "v2"
+    assert service.activate_version("TRITON", "v1")["version"] == "v1"
+    assert service.predict(row) == pytest.approx(v1)
+    assert other.active("TRITON")["version"] == "v1"
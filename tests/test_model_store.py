@@ -0,0 +1,94 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+import services.model_store as model_store
+from services.model_store import ModelStore
+
+
+@pytest.fixture
+def source(tmp_path):
+    X = np.arange(20, dtype=float).reshape(10, 2)
+    path = tmp_path / "model.pkl"
+    joblib.dump(LinearRegression().fit(X, X.sum(axis=1)), path)
+    return str(path)
+
+
+def _manifest(store):
+    with open(store.manifest_path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def test_publish_activates_first_version_only(tmp_path, source):
+    store = ModelStore(str(tmp_path / "store"))
+    assert store.active("CETO") is None
+
+    assert store.publish("CETO", source, version="v1") == "v1"
+    store.publish("CETO", source, version="v2")
+    assert store.describe("CETO") == {"active": "v1", "versions": ["v1", "v2"]}
+
+    store.publish("CETO", source, version="v3", activate=True)
+    entry = store.active("CETO")
+    assert entry == {"version": "v3", "path": str(tmp_path / "store" / "CETO" / "v3" / "model.joblib"), "mmap": True}
+    # Artifact không nén -> load được bằng mmap
+    model = joblib.load(entry["path"], mmap_mode="r")
+    assert model.predict([[1.0, 2.0]]) == pytest.approx([3.0])
+
+
+def test_duplicate_version_is_rejected(tmp_path, source):
+    store = ModelStore(str(tmp_path / "store"))
+    store.publish("CETO", source, version="v1")
+    before = _manifest(store)
+    with pytest.raises(ValueError, match="already exists"):
+        store.publish("CETO", source, version="v1")
+    assert _manifest(store) == before
+
+
+def test_set_active_unknown_version_leaves_manifest(tmp_path, source):
+    store = ModelStore(str(tmp_path / "store"))
+    store.publish("CETO", source, version="v1")
+    signature = store.signature()
+    for ship, version in (("CETO", "v9"), ("TRITON", "v1")):
+        with pytest.raises(ValueError, match="Unknown version"):
+            store.set_active(ship, version)
+    assert store.signature() == signature
+    with pytest.raises(ValueError):
+        store.version("CETO", "v9")
+
+
+def test_manifest_is_replaced_atomically(tmp_path, source, monkeypatch):
+    store = ModelStore(str(tmp_path / "store"))
+    store.publish("CETO", source, version="v1")
+    store.publish("CETO", source, version="v2")
+    inode = os.stat(store.manifest_path).st_ino
+
+    store.set_active("CETO", "v2")
+    # os.replace: file mới (inode khác), reader đang giữ file cũ vẫn đọc trọn bản cũ
+    assert os.stat(store.manifest_path).st_ino != inode
+    assert store.active("CETO")["version"] == "v2"
+
+    # Ghi hỏng giữa chừng -> manifest cũ nguyên vẹn, không sót file tạm
+    def broken_dump(obj, fh, **kwargs):
+        fh.write('{"ships": ')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(model_store.json, "dump", broken_dump)
+    with pytest.raises(OSError):
+        store.set_active("CETO", "v1")
+    monkeypatch.undo()
+    assert _manifest(store)["ships"]["CETO"]["active"] == "v2"
+    assert sorted(os.listdir(store.root)) == [".lock", "CETO", "manifest.json"]
+
+
+def test_reader_sees_changes_from_another_store(tmp_path, source):
+    writer = ModelStore(str(tmp_path / "store"))
+    reader = ModelStore(str(tmp_path / "store"))
+    writer.publish("CETO", source, version="v1")
+    writer.publish("CETO", source, version="v2")
+    assert reader.active("CETO")["version"] == "v1"
+    writer.set_active("CETO", "v2")
+    assert reader.active("CETO")["version"] == "v2"
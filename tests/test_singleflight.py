@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.singleflight import SingleFlight, payload_key
+
+
+def test_payload_key_ignores_dict_order():
+    assert payload_key({"a": 1, "b": [1, 2]}) == payload_key({"b": [1, 2], "a": 1})
+    assert payload_key({"a": 1}) != payload_key({"a": 2})
+
+
+def test_threads_share_one_call_and_one_exception():
+    flights = SingleFlight(wait_seconds=5)
+    calls = []
+    release = threading.Event()
+
+    def upstream():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def worker():
+        try:
+            flights.do("k", upstream)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    while flights.stats()["coalesced"] < 4:
+        time.sleep(0.005)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len(errors) == 5 and len({id(e) for e in errors}) == 1
+    # Key đã được gỡ: call sau là flight mới
+    assert flights.do("k", lambda: "fresh") == "fresh"
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_follower_timeout_does_not_cancel_leader():
+    async def main():
+        flights = SingleFlight(wait_seconds=0.05)
+
+        async def slow():
+            await asyncio.sleep(0.2)
+            return "done"
+
+        leader = asyncio.create_task(flights.do_async("k", slow))
+        await asyncio.sleep(0.01)
+        with pytest.raises(TimeoutError):
+            await flights.do_async("k", slow)
+        return await leader, flights.stats()
+
+    result, stats = asyncio.run(main())
+    assert result == "done"
+    assert stats["timeouts"] == 1
+
+
+def test_cancelled_leader_hands_over_to_a_follower():
+    async def main():
+        flights = SingleFlight(wait_seconds=5)
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return len(calls)
+
+        leader = asyncio.create_task(flights.do_async("k", upstream))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flights.do_async("k", upstream)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers), calls, flights.stats()
+
+    results, calls, stats = asyncio.run(main())
+    # Một follower gọi lại upstream đúng một lần, các follower khác nhận cùng kết quả
+    assert results == [2, 2, 2]
+    assert len(calls) == 2
+    assert stats["errors"] == 0
+    assert stats["takeovers"] == 3
+
+
+def test_thread_and_coroutine_share_a_flight():
+    flights = SingleFlight(wait_seconds=5)
+    started = threading.Event()
+
+    def upstream():
+        started.set()
+        time.sleep(0.1)
+        return 42
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("thread", flights.do("k", upstream)))
+    thread.start()
+    started.wait(5)
+
+    async def follower():
+        return await flights.do_async("k", lambda: asyncio.sleep(0, result="not called"))
+
+    assert asyncio.run(follower()) == 42
+    thread.join()
+    assert result["thread"] == 42
+    assert flights.stats()["upstream_calls"] == 1
@@ -0,0 +1,100 @@
+import itertools
+
+import pytest
+
+import core.supportfunc as supportfunc
+
+
+class _Session:
+    """Session giả: flush gán id tăng dần, ghi lại các lần commit."""
+
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+        self.rollbacks = 0
+        self._ids = itertools.count(1)
+
+    def add_all(self, objects):
+        self.added.extend(objects)
+
+    def flush(self):
+        for obj in self.added:
+            if obj.id is None:
+                obj.id = next(self._ids)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def session(monkeypatch):
+    fake = _Session()
+    monkeypatch.setattr(supportfunc, "db", type("DB", (), {"session": fake}))
+    return fake
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """Embedding giả: batch chứa text "bad" lỗi cả batch, "bad" lỗi cả khi gửi lẻ."""
+    calls = []
+
+    def get_embeddings(texts, batch_size=None):
+        calls.append(list(texts))
+        if "bad" in texts:
+            raise RuntimeError("server rejected batch")
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def get_embedding(text, retry_count=3):
+        calls.append(text)
+        if text == "bad":
+            raise RuntimeError("input too long")
+        return [float(len(text)), 1.0]
+
+    monkeypatch.setattr(supportfunc.model_service, "get_embeddings", get_embeddings)
+    monkeypatch.setattr(supportfunc.model_service, "get_embedding", get_embedding)
+    return calls
+
+
+def test_only_the_failing_item_is_reported(session, embeddings):
+    items = [
+        {"content": "một"},
+        {"content": "bad"},
+        {"content": "ba", "metadata": {"source": "x"}},
+        {"content": "bốn"},
+        {"content": "   "},
+    ]
+    progress = list(supportfunc.store_document_chunks(items, batch_size=3))
+
+    assert [p["batch"] for p in progress] == [1, 2]
+    first, second = progress
+    # Batch lỗi -> thử từng item, chỉ item hỏng bị báo lỗi
+    assert first["failed"] == [{"index": 1, "error": "embedding failed: input too long"}]
+    assert first["stored"] == 2 and first["chunk_ids"] == [1, 2]
+    assert embeddings[:4] == [["một", "bad", "ba"], "một", "bad", "ba"]
+
+    assert second["failed"] == [{"index": 4, "error": "content is required"}]
+    assert second["chunk_ids"] == [3]
+    assert embeddings[4:] == [["bốn"]]
+
+    assert [c.content for c in session.added] == ["một", "ba", "bốn"]
+    assert session.added[1].meta == {"source": "x"}
+    assert session.commits == 2 and session.rollbacks == 0
+
+
+def test_database_error_fails_the_whole_batch(session, embeddings, monkeypatch):
+    def broken_flush():
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(session, "flush", broken_flush)
+    progress = list(supportfunc.store_document_chunks([{"content": "a"}, "oops", {"content": "b"}]))
+
+    assert progress[0]["stored"] == 0
+    assert progress[0]["failed"] == [
+        {"index": 0, "error": "database error: connection lost"},
+        {"index": 1, "error": "item must be an object"},
+        {"index": 2, "error": "database error: connection lost"},
+    ]
+    assert session.rollbacks == 1
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import (
+    ExtraTreesRegressor,
+    GradientBoostingRegressor,
+    HistGradientBoostingRegressor,
+    RandomForestRegressor,
+)
+from sklearn.linear_model import LinearRegression
+from sklearn.tree import DecisionTreeRegressor
+
+from services.tree_engine import CompiledEnsemble, UnsupportedModelError, compile_model, max_abs_error
+
+FEATURES = [f"f{i}" for i in range(7)]
+TOLERANCE = 1e-4
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 20, size=(600, len(FEATURES)))
+    y = X @ rng.uniform(0.5, 2.0, len(FEATURES)) + np.sin(X[:, 0]) * 5 + rng.normal(0, 0.5, len(X))
+    X_val = rng.uniform(0, 20, size=(150, len(FEATURES)))
+    # Validation lệch phân phối để early stopping dừng sớm
+    y_val = X_val @ rng.uniform(0.5, 2.0, len(FEATURES))
+    # Thêm điểm nằm đúng trên ngưỡng split để kiểm tra phép so sánh <= / <
+    X_check = np.vstack([X, rng.uniform(-5, 25, size=(500, len(FEATURES)))])
+    return X, y, X_val, y_val, X_check
+
+
+@pytest.mark.parametrize("make_model", [
+    lambda: DecisionTreeRegressor(max_depth=6, random_state=0),
+    lambda: RandomForestRegressor(n_estimators=20, max_depth=6, random_state=0),
+    lambda: ExtraTreesRegressor(n_estimators=20, max_depth=6, random_state=0),
+    lambda: GradientBoostingRegressor(n_estimators=40, max_depth=3, random_state=0),
+    lambda: HistGradientBoostingRegressor(max_iter=40, random_state=0),
+], ids=["tree", "rf", "extra", "gbr", "histgb"])
+def test_sklearn_parity(data, make_model):
+    X, y, _, _, X_check = data
+    model = make_model().fit(X, y)
+    compiled = compile_model(model, FEATURES)
+    assert max_abs_error(model, compiled, X_check) < TOLERANCE
+
+
+def test_sklearn_dataframe_columns_are_mapped_by_name(data):
+    X, y, _, _, X_check = data
+    # Model train với thứ tự cột khác FEATURES
+    order = FEATURES[::-1]
+    model = RandomForestRegressor(n_estimators=10, max_depth=5, random_state=0)
+    model.fit(pd.DataFrame(X[:, ::-1], columns=order), y)
+    compiled = compile_model(model, FEATURES)
+    expected = model.predict(pd.DataFrame(X_check[:, ::-1], columns=order))
+    assert np.max(np.abs(expected - compiled.predict(X_check))) < TOLERANCE
+
+
+def test_split_thresholds_are_exact(data):
+    X, y, _, _, _ = data
+    model = DecisionTreeRegressor(max_depth=8, random_state=0).fit(X, y)
+    t = model.tree_
+    # Giá trị đúng bằng threshold phải đi sang trái như sklearn
+    X_edge = np.tile(X[:1], (int((t.feature >= 0).sum()), 1)).astype(np.float32).astype(np.float64)
+    for row, (feature, threshold) in enumerate(zip(t.feature[t.feature >= 0], t.threshold[t.feature >= 0])):
+        X_edge[row, feature] = threshold
+    compiled = compile_model(model, FEATURES)
+    assert max_abs_error(model, compiled, X_edge) < TOLERANCE
+
+
+def test_unsupported_model_raises(data):
+    X, y, _, _, _ = data
+    with pytest.raises(UnsupportedModelError):
+        compile_model(LinearRegression().fit(X, y), FEATURES)
+    model = RandomForestRegressor(n_estimators=2).fit(pd.DataFrame(X, columns=[f"x{i}" for i in range(7)]), y)
+    with pytest.raises(UnsupportedModelError):
+        compile_model(model, FEATURES)
+
+
+@pytest.mark.parametrize("early_stopping", [False, True], ids=["full", "early_stopping"])
+def test_xgboost_parity(data, early_stopping):
+    xgb = pytest.importorskip("xgboost")
+    X, y, X_val, y_val, X_check = data
+    if early_stopping:
+        model = xgb.XGBRegressor(n_estimators=300, max_depth=4, early_stopping_rounds=5)
+        model.fit(X, y, eval_set=[(X_val, y_val)], verbose=False)
+        assert model.best_iteration + 1 < 300
+    else:
+        model = xgb.XGBRegressor(n_estimators=50, max_depth=4).fit(X, y)
+    compiled = compile_model(model, FEATURES)
+    if early_stopping:
+        assert compiled.n_trees == model.best_iteration + 1
+    assert max_abs_error(model, compiled, X_check) < TOLERANCE
+
+
+@pytest.mark.parametrize("early_stopping", [False, True], ids=["full", "early_stopping"])
+def test_lightgbm_parity(data, early_stopping):
+    lgb = pytest.importorskip("lightgbm")
+    X, y, X_val, y_val, X_check = data
+    columns = [f"Column_{i}" for i in range(len(FEATURES))]
+    if early_stopping:
+        model = lgb.LGBMRegressor(n_estimators=300, verbose=-1)
+        model.fit(X, y, eval_set=[(X_val, y_val)], callbacks=[lgb.early_stopping(5, verbose=False)])
+        assert 0 < model.best_iteration_ < 300
+    else:
+        model = lgb.LGBMRegressor(n_estimators=50, verbose=-1).fit(X, y)
+    compiled = compile_model(model, columns)
+    if early_stopping:
+        assert compiled.n_trees == model.best_iteration_
+    assert max_abs_error(model, compiled, X_check) < TOLERANCE
+
+
+@pytest.mark.parametrize("named", [False, True], ids=["numeric_names", "named"])
+def test_catboost_parity(data, named):
+    cb = pytest.importorskip("catboost")
+    X, y, _, _, X_check = data
+    model = cb.CatBoostRegressor(iterations=40, depth=4, verbose=0, random_seed=0, allow_writing_files=False)
+    if named:
+        model.fit(pd.DataFrame(X, columns=FEATURES), y)
+        compiled = compile_model(model, FEATURES)
+        expected = model.predict(pd.DataFrame(X_check, columns=FEATURES))
+        assert np.max(np.abs(expected - compiled.predict(X_check))) < TOLERANCE
+    else:
+        # Train bằng ndarray -> feature_names_ là "0".."6", dùng theo vị trí cột
+        model.fit(X, y)
+        compiled = compile_model(model, FEATURES)
+        assert max_abs_error(model, compiled, X_check) < TOLERANCE
+
+
+def test_save_load_roundtrip(tmp_path, data):
+    X, y, _, _, X_check = data
+    model = GradientBoostingRegressor(n_estimators=30, max_depth=3, random_state=0).fit(X, y)
+    compiled = compile_model(model, FEATURES)
+    path = str(tmp_path / "model.trees.npz")
+    compiled.save(path)
+    loaded = CompiledEnsemble.load(path)
+
+    assert loaded.n_trees == compiled.n_trees
+    assert loaded.source == "GradientBoostingRegressor"
+    np.testing.assert_array_equal(loaded.predict(X_check), compiled.predict(X_check))
+    # Một dòng 1-D và block nhỏ cho cùng kết quả
+    assert loaded.predict(X_check[0])[0] == compiled.predict(X_check[:1])[0]
+    np.testing.assert_allclose(loaded.predict(X_check, block_rows=7), loaded.predict(X_check))
+
+
+def test_non_finite_inputs_are_rejected(data):
+    X, y, _, _, X_check = data
+    compiled = compile_model(RandomForestRegressor(n_estimators=5, max_depth=4, random_state=0).fit(X, y), FEATURES)
+    for bad in (np.nan, np.inf, -np.inf):
+        X_bad = X_check[:5].copy()
+        X_bad[2, 3] = bad
+        with pytest.raises(ValueError, match="NaN or infinite"):
+            compiled.predict(X_bad)
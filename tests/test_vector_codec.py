@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from services.embedding_index import Int8Index, normalize_rows
+from services.vector_codec import decode_f32, decode_i8, encode_f32, quantize_i8, quantize_rows
+
+
+def test_f32_roundtrip():
+    vector = [0.1, -2.5, 3.0e-8, 1234.5]
+    buf = encode_f32(vector)
+    assert len(buf) == 4 * len(vector)
+    np.testing.assert_array_equal(decode_f32(buf), np.asarray(vector, dtype=np.float32))
+    assert decode_f32(None) is None
+    # Little-endian cố định, không phụ thuộc máy
+    assert encode_f32([1.0]) == b"\x00\x00\x80\x3f"
+
+
+def test_i8_error_bound():
+    rng = np.random.default_rng(0)
+    for vector in rng.normal(size=(50, 768)).astype(np.float32):
+        buf, scale = quantize_i8(vector)
+        assert len(buf) == vector.size
+        restored = decode_i8(buf, scale)
+        # Làm tròn về số nguyên gần nhất: sai số <= nửa bước lượng tử
+        assert np.max(np.abs(restored - vector)) <= scale / 2 + 1e-6
+        assert np.abs(vector).max() == pytest.approx(127 * scale)
+
+
+def test_i8_zero_and_missing():
+    buf, scale = quantize_i8([0.0, 0.0, 0.0])
+    assert scale == 1.0
+    np.testing.assert_array_equal(decode_i8(buf, scale), np.zeros(3, dtype=np.float32))
+    assert decode_i8(None, 1.0) is None
+    assert decode_i8(buf, None) is None
+
+
+def test_quantize_rows_matches_single_vector():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(size=(10, 32)).astype(np.float32)
+    matrix[3] = 0.0
+    q, scales = quantize_rows(matrix)
+    assert q.dtype == np.int8 and scales.dtype == np.float32
+    for row, q_row, scale in zip(matrix, q, scales):
+        buf, expected_scale = quantize_i8(row)
+        assert q_row.tobytes() == buf
+        assert scale == pytest.approx(expected_scale)
+
+
+def test_int8_index_rescore_restores_exact_order():
+    rng = np.random.default_rng(2)
+    ids = np.arange(1, 2001)
+    vectors = rng.normal(size=(len(ids), 64)).astype(np.float32)
+    by_id = dict(zip(ids.tolist(), vectors))
+    index = Int8Index(rescore=lambda wanted: {i: by_id[i] for i in wanted}, rescore_factor=4)
+    index.build(ids.tolist(), vectors.tolist())
+
+    normalized = normalize_rows(vectors)
+    for query in rng.normal(size=(20, 64)).astype(np.float32):
+        exact = normalized @ (query / np.linalg.norm(query))
+        expected = [int(ids[i]) for i in np.argsort(-exact)[:10]]
+        got = index.search(query.tolist(), k=10)
+        assert [i for i, _ in got] == expected
+        assert [s for _, s in got] == pytest.approx(sorted(exact, reverse=True)[:10], abs=1e-5)
@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+import pytest
+
+from services.voyage_service import VoyageIntegrator, iter_voyage_rows, parse_timestamp
+
+
+def _integrate(times, rates, chunk_size, **kwargs):
+    integrator = VoyageIntegrator(**kwargs)
+    for start in range(0, len(times), chunk_size):
+        integrator.add(np.asarray(times[start:start + chunk_size], dtype=np.float64),
+                       np.asarray(rates[start:start + chunk_size], dtype=np.float64))
+    return integrator.summary()
+
+
+def test_trapezoid_total_and_segments():
+    # (1+3)/2*10 + (3+5)/2*10 + (5+5)/2*20 = 20 + 40 + 100
+    summary = _integrate([0, 10, 20, 40], [1, 3, 5, 5], chunk_size=4, segment_seconds=15)
+    assert summary["total_fuel"] == pytest.approx(160.0)
+    assert summary["samples"] == 4
+    assert summary["duration_s"] == 40
+    assert summary["mean_fuel_rate"] == pytest.approx(4.0)
+    # Khoảng được tính vào segment chứa điểm đầu của nó
+    assert [s["fuel"] for s in summary["segments"]] == pytest.approx([60.0, 100.0])
+    assert [s["cumulative_fuel"] for s in summary["segments"]] == pytest.approx([60.0, 160.0])
+    assert [(s["start"], s["end"]) for s in summary["segments"]] == [
+        ("1970-01-01T00:00:00+00:00", "1970-01-01T00:00:15+00:00"),
+        ("1970-01-01T00:00:15+00:00", "1970-01-01T00:00:30+00:00"),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64])
+def test_total_does_not_depend_on_chunk_size(chunk_size):
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.uniform(1, 120, 50))
+    rates = rng.uniform(0.1, 2.0, 50)
+    expected = float(np.sum((rates[:-1] + rates[1:]) * 0.5 * np.diff(times)))
+
+    summary = _integrate(times, rates, chunk_size, segment_seconds=600)
+    assert summary["total_fuel"] == pytest.approx(expected)
+    assert summary["samples"] == 50
+    whole = _integrate(times, rates, 50, segment_seconds=600)["segments"]
+    assert [s["fuel"] for s in summary["segments"]] == pytest.approx([s["fuel"] for s in whole])
+    assert [s["intervals"] for s in summary["segments"]] == [s["intervals"] for s in whole]
+
+
+def test_gaps_longer_than_max_gap_are_skipped():
+    summary = _integrate([0, 10, 100, 110], [1, 1, 1, 1], chunk_size=2, max_gap_seconds=30)
+    assert summary["total_fuel"] == pytest.approx(20.0)
+    assert summary["gaps_skipped"] == 1
+
+
+@pytest.mark.parametrize("segment_seconds", [0, -60, float("nan"), float("inf")])
+def test_segment_seconds_must_be_positive(segment_seconds):
+    with pytest.raises(ValueError):
+        VoyageIntegrator(segment_seconds)
+
+
+@pytest.mark.parametrize("row", [
+    {"timestamp": "2026-01-01T00:00:00Z"},
+    {"timestamp": "2026-01-01T07:00:00+07:00"},
+    {"time": "2026-01-01T00:00:00"},  # không có timezone -> UTC
+    {"datetime": 1767225600},
+    {"timestamp": "", "time": "1767225600.0"},
+])
+def test_parse_timestamp_formats(row):
+    assert parse_timestamp(row) == 1767225600.0
+
+
+@pytest.mark.parametrize("row", [
+    {},
+    {"timestamp": "yesterday"},
+    {"timestamp": "nan"},
+    {"timestamp": 1e20},
+    {"timestamp": "-1e15"},
+])
+def test_parse_timestamp_rejects_invalid(row):
+    with pytest.raises(ValueError):
+        parse_timestamp(row)
+
+
+def test_iter_ndjson_reports_malformed_lines():
+    body = b'{"timestamp": 1}\n\n{not json\n[1, 2]\n{"timestamp": 2}\n'
+    rows = list(iter_voyage_rows(io.BytesIO(body), "ndjson"))
+    assert rows == [
+        {"timestamp": 1},
+        {"_error": "Line 3: invalid JSON"},
+        {"_error": "Line 4: expected an object"},
+        {"timestamp": 2},
+    ]
+
+
+def test_iter_csv_strips_bom():
+    body = "﻿timestamp,Ship_SpeedOverGround\n1,10.5\n".encode("utf-8")
+    assert list(iter_voyage_rows(io.BytesIO(body), "csv")) == [{"timestamp": "1", "Ship_SpeedOverGround": "10.5"}]